@@ -1,13 +1,23 @@
 from datetime import date, datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, text, func
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import select, text
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import aliased
 
 from app.db.session import get_db
-from app.models.entities import Agenda, Aula, Profissional, Unidade, Usuario, Aluno
+from app.services.agenda_eventos_service import assinar, ensure_agenda_eventos, stream_eventos
+from app.services.versoes_service import checar_condicional
+from app.models.entities import Agenda, Profissional, Usuario
+from app.api.v1.endpoints.alunos import (
+    STATUS_AULA_PERMITIDOS,
+    ensure_aulas_desconto_columns,
+    ensure_bloqueios_table,
+    ensure_contract_links,
+    ensure_contracts_table,
+    ensure_finance_columns,
+)
 
 router = APIRouter(prefix="/agenda", tags=["agenda"])
 
@@ -29,28 +39,6 @@ def dt_to_br_fields(dt: datetime) -> tuple[str, str, str]:
     return dt_br.date().strftime("%Y-%m-%d"), dt_br.strftime("%d/%m/%Y"), dt_br.strftime("%H:%M")
 
 
-async def ensure_bloqueios_table(db: AsyncSession):
-    await db.execute(
-        text(
-            """
-            CREATE TABLE IF NOT EXISTS agenda_bloqueios (
-              id SERIAL PRIMARY KEY,
-              profissional_id INTEGER REFERENCES profissionais(id) ON DELETE SET NULL,
-              unidade_id INTEGER REFERENCES unidades(id) ON DELETE SET NULL,
-              data DATE NOT NULL,
-              hora_inicio VARCHAR(5) NOT NULL,
-              hora_fim VARCHAR(5) NOT NULL,
-              motivo VARCHAR(255),
-              status VARCHAR(20) NOT NULL DEFAULT 'ativo',
-              created_at TIMESTAMP DEFAULT NOW(),
-              updated_at TIMESTAMP DEFAULT NOW()
-            )
-            """
-        )
-    )
-    await db.commit()
-
-
 def dia_label_to_weekday(dia: str) -> int | None:
     mapa = {"seg": 0, "ter": 1, "qua": 2, "qui": 3, "sex": 4, "sab": 5, "dom": 6}
     return mapa.get((dia or "").strip().lower()[:3])
@@ -71,22 +59,31 @@ def min_to_hhmm(total_min: int) -> str:
 
 
 @router.get("/professores")
-async def listar_professores(db: AsyncSession = Depends(get_db)):
+async def listar_professores(request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    headers, nao_modificada = await checar_condicional(request, "professores")
+    if nao_modificada:
+        return nao_modificada
+    response.headers.update(headers)
     # Usuarios e Profissionais sao a mesma pessoa: garante que gestor/professor sempre tenham linha em profissionais
     # para poderem ser selecionados em contratos/aulas.
-    await db.execute(
-        text(
-            """
-            INSERT INTO profissionais (usuario_id, valor_hora, created_at, updated_at)
-            SELECT u.id, 0, NOW(), NOW()
-            FROM usuarios u
-            WHERE u.ativo = TRUE
-              AND u.role <> 'aluno'
-              AND NOT EXISTS (SELECT 1 FROM profissionais p WHERE p.usuario_id = u.id)
-            """
+    # So escreve quando falta alguem: um INSERT vazio tambem dispara o trigger de versao e o ETag nunca bateria.
+    pendentes = """
+        FROM usuarios u
+        WHERE u.ativo = TRUE
+          AND u.role <> 'aluno'
+          AND NOT EXISTS (SELECT 1 FROM profissionais p WHERE p.usuario_id = u.id)
+    """
+    if (await db.execute(text(f"SELECT EXISTS (SELECT 1 {pendentes})"))).scalar():
+        await db.execute(
+            text(
+                f"""
+                INSERT INTO profissionais (usuario_id, valor_hora, created_at, updated_at)
+                SELECT u.id, 0, NOW(), NOW()
+                {pendentes}
+                """
+            )
         )
-    )
-    await db.commit()
+        await db.commit()
     rows = (
         await db.execute(
             select(Profissional.id, Profissional.usuario_id, Usuario.nome)
@@ -99,190 +96,631 @@ async def listar_professores(db: AsyncSession = Depends(get_db)):
     return [{"id": r[0], "usuario_id": r[1], "nome": r[2]} for r in rows]
 
 
-@router.get("")
-async def listar_agenda(data: date | None = None, profissional_id: int | None = None, db: AsyncSession = Depends(get_db)):
-    await ensure_bloqueios_table(db)
+@router.get("/professores/{profissional_id}/chamada")
+async def chamada_professor(profissional_id: int, data: date | None = None, db: AsyncSession = Depends(get_db)):
+    """Aulas do professor no dia (horario de Brasilia), para marcar presenca de uma vez."""
     dia = data or date.today()
     inicio_utc, fim_utc = br_day_bounds_utc(dia)
-    UsuarioAluno = aliased(Usuario)
-
-    aulas_q = (
-        select(
-            Aula.id,
-            Aula.inicio,
-            Aula.fim,
-            Aula.status,
-            Aula.professor_id,
-            func.coalesce(Usuario.nome, "Sem professor").label("professor_nome"),
-            Aula.aluno_id,
-            func.coalesce(UsuarioAluno.nome, "").label("aluno_nome"),
-            func.coalesce(Unidade.nome, "").label("unidade_nome"),
-        )
-        .join(Agenda, Aula.agenda_id == Agenda.id, isouter=True)
-        .join(Profissional, Profissional.id == Aula.professor_id, isouter=True)
-        .join(Usuario, Usuario.id == Profissional.usuario_id, isouter=True)
-        .join(Aluno, Aluno.id == Aula.aluno_id, isouter=True)
-        .join(UsuarioAluno, UsuarioAluno.id == Aluno.usuario_id, isouter=True)
-        .join(Unidade, Unidade.id == Agenda.unidade_id, isouter=True)
-        # Stored as timestamptz (UTC). Query by Brazil-local day bounds.
-        .where(Aula.inicio >= inicio_utc)
-        .where(Aula.inicio < fim_utc)
-        .order_by(Aula.inicio.asc())
-    )
-    if profissional_id:
-        aulas_q = aulas_q.where(Aula.professor_id == profissional_id)
-    aulas_rows = (await db.execute(aulas_q)).all()
-
-    bloqueios_rows = (
+    rows = (
         await db.execute(
             text(
                 """
-                SELECT b.id, b.data, b.hora_inicio, b.hora_fim, b.motivo, b.profissional_id,
-                       COALESCE(u.nome, 'Todos') AS professor_nome,
-                       COALESCE(un.nome, '') AS unidade_nome
-                FROM agenda_bloqueios b
-                LEFT JOIN profissionais p ON p.id = b.profissional_id
-                LEFT JOIN usuarios u ON u.id = p.usuario_id
-                LEFT JOIN unidades un ON un.id = b.unidade_id
-                WHERE b.data = :data
-                  AND LOWER(COALESCE(b.status, 'ativo')) = 'ativo'
-                  AND ((:profissional_id)::int IS NULL OR b.profissional_id IS NULL OR b.profissional_id = (:profissional_id)::int)
-                ORDER BY b.hora_inicio ASC
+                SELECT a.id, a.inicio, a.fim, a.status, a.aluno_id, COALESCE(u.nome, '') AS aluno_nome,
+                       a.contrato_id, COALESCE(un.nome, '') AS unidade_nome
+                FROM aulas a
+                LEFT JOIN alunos al ON al.id = a.aluno_id
+                LEFT JOIN usuarios u ON u.id = al.usuario_id
+                LEFT JOIN agendas ag ON ag.id = a.agenda_id
+                LEFT JOIN unidades un ON un.id = ag.unidade_id
+                WHERE a.professor_id = :profissional_id
+                  AND a.inicio >= :inicio AND a.inicio < :fim
+                ORDER BY a.inicio ASC, a.id ASC
                 """
             ),
-            {"data": dia, "profissional_id": profissional_id},
+            {"profissional_id": profissional_id, "inicio": inicio_utc, "fim": fim_utc},
         )
     ).all()
-
     return {
         "data": dia.strftime("%Y-%m-%d"),
+        "profissional_id": profissional_id,
         "aulas": [
             {
                 "id": r[0],
-                "inicio": r[1],
-                "fim": r[2],
-                "status": r[3],
-                "professor_id": r[4],
-                "professor_nome": r[5],
-                "aluno_id": r[6],
-                "aluno_nome": r[7] or "",
-                "unidade": r[8] or "",
-                "data_br": dt_to_br_fields(r[1])[1],
                 "hora_br": dt_to_br_fields(r[1])[2],
-            }
-            for r in aulas_rows
-        ],
-        "bloqueios": [
-            {
-                "id": r[0],
-                "data": r[1].strftime("%Y-%m-%d") if r[1] else None,
-                "hora_inicio": r[2],
-                "hora_fim": r[3],
-                "motivo": r[4] or "",
-                "profissional_id": r[5],
-                "professor_nome": r[6],
+                "hora_fim_br": dt_to_br_fields(r[2])[2],
+                "status": r[3],
+                "aluno_id": r[4],
+                "aluno_nome": r[5],
+                "contrato_id": r[6],
                 "unidade": r[7],
             }
-            for r in bloqueios_rows
+            for r in rows
         ],
     }
 
 
-@router.get("/periodo")
-async def listar_agenda_periodo(
-    data_inicio: date,
-    data_fim: date,
-    profissional_id: int | None = None,
-    db: AsyncSession = Depends(get_db),
-):
+@router.put("/aulas/status")
+async def atualizar_status_aulas_lote(payload: dict, db: AsyncSession = Depends(get_db)):
+    """
+    Marca presenca de varias aulas numa transacao, com um unico UPDATE ... FROM (VALUES ...).
+
+    Body: {"profissional_id": 3, "itens": [{"aula_id": 10, "status": "realizada"}, ...]}
+    profissional_id (opcional) restringe a atualizacao as aulas daquele professor.
+    """
+    itens = payload.get("itens")
+    if not isinstance(itens, list) or not itens:
+        raise HTTPException(status_code=400, detail="Informe itens")
+    if len(itens) > 200:
+        raise HTTPException(status_code=400, detail="Maximo de 200 aulas por lote")
+
+    por_aula: dict[int, str] = {}
+    for item in itens:
+        try:
+            aula_id = int(item.get("aula_id"))
+        except Exception:
+            raise HTTPException(status_code=400, detail="aula_id invalido")
+        status = (item.get("status") or "").strip().lower()
+        if status not in STATUS_AULA_PERMITIDOS:
+            raise HTTPException(status_code=400, detail=f"Status invalido na aula {aula_id}")
+        por_aula[aula_id] = status
+
+    params: dict[str, object] = {}
+    valores = []
+    for i, (aula_id, status) in enumerate(por_aula.items()):
+        valores.append(f"(CAST(:id{i} AS INTEGER), CAST(:st{i} AS VARCHAR))")
+        params[f"id{i}"] = aula_id
+        params[f"st{i}"] = status
+    filtro = ""
+    if payload.get("profissional_id"):
+        filtro = " AND a.professor_id = :profissional_id "
+        params["profissional_id"] = int(payload["profissional_id"])
+
+    rows = (
+        await db.execute(
+            text(
+                f"""
+                UPDATE aulas a
+                SET status = v.status, updated_at = NOW()
+                FROM (VALUES {", ".join(valores)}) AS v(id, status)
+                WHERE a.id = v.id
+                {filtro}
+                RETURNING a.id
+                """
+            ),
+            params,
+        )
+    ).all()
+    await db.commit()
+    atualizadas = {int(r[0]) for r in rows}
+    return {
+        "ok": True,
+        "atualizadas": len(atualizadas),
+        "nao_encontradas": [aula_id for aula_id in por_aula if aula_id not in atualizadas],
+    }
+
+
+# Desconto de varias aulas numa passada: valor por aula (proporcional ao contrato, como em
+# alunos.descontar_valor_aula), soma por aluno e abatimento nas contas abertas mais antigas
+# via soma acumulada, sem loop por conta.
+DESCONTO_AULAS_EM_LOTE_SQL = """
+    WITH alvo AS (
+      SELECT a.id, a.aluno_id,
+             ROUND(CASE WHEN c.valor IS NOT NULL AND tc.total > 0 THEN c.valor / tc.total
+                        ELSE COALESCE(a.valor, 0) END, 2) AS desconto
+      FROM aulas a
+      LEFT JOIN aluno_contratos c ON c.id = a.contrato_id AND c.aluno_id = a.aluno_id
+      LEFT JOIN LATERAL (
+        SELECT COUNT(*) AS total FROM aulas x WHERE x.contrato_id = a.contrato_id AND x.aluno_id = a.aluno_id
+      ) tc ON a.contrato_id IS NOT NULL
+      WHERE a.id = ANY(CAST(:ids AS INTEGER[]))
+        AND NOT COALESCE(a.descontada, FALSE)
+    ),
+    marcadas AS (
+      UPDATE aulas a
+      SET descontada = TRUE, desconto_valor = alvo.desconto, desconto_em = NOW()
+      FROM alvo
+      WHERE a.id = alvo.id AND alvo.desconto > 0
+      RETURNING a.aluno_id, alvo.desconto
+    ),
+    por_aluno AS (
+      SELECT aluno_id, SUM(desconto) AS total FROM marcadas GROUP BY aluno_id
+    ),
+    contas AS (
+      SELECT cr.id, cr.aluno_id, cr.valor, p.total,
+             SUM(cr.valor) OVER (PARTITION BY cr.aluno_id ORDER BY cr.vencimento, cr.id) AS acumulado
+      FROM contas_receber cr
+      JOIN por_aluno p ON p.aluno_id = cr.aluno_id
+      WHERE LOWER(COALESCE(cr.status, 'aberto')) = 'aberto'
+        AND COALESCE(cr.valor, 0) > 0
+    ),
+    abatidas AS (
+      UPDATE contas_receber cr
+      SET valor = cr.valor - LEAST(c.valor, c.total - (c.acumulado - c.valor)), updated_at = NOW()
+      FROM contas c
+      WHERE cr.id = c.id AND c.total > c.acumulado - c.valor
+      RETURNING cr.id
+    )
+    SELECT (SELECT COUNT(*) FROM marcadas),
+           (SELECT COALESCE(SUM(desconto), 0) FROM marcadas),
+           (SELECT COUNT(*) FROM abatidas),
+           (SELECT COALESCE(SUM(GREATEST(p.total - COALESCE(s.aberto, 0), 0)), 0)
+            FROM por_aluno p
+            LEFT JOIN (SELECT aluno_id, MAX(acumulado) AS aberto FROM contas GROUP BY aluno_id) s
+              ON s.aluno_id = p.aluno_id)
+"""
+
+
+@router.post("/operacao-em-massa")
+async def operacao_em_massa_unidade(payload: dict, db: AsyncSession = Depends(get_db)):
+    """
+    Cancela ou remarca de uma vez todas as aulas agendadas de uma unidade numa janela do dia
+    (chuva, quadra interditada), opcionalmente descontando o valor dos alunos, e registra o
+    bloqueio da janela. Tudo numa unica transacao.
+
+    Body:
+    {
+      "unidade_id": 1, "data": "YYYY-MM-DD", "hora_inicio": "HH:MM", "hora_fim": "HH:MM",
+      "acao": "cancelar" | "remarcar",
+      "nova_data": "YYYY-MM-DD", "nova_hora_inicio": "HH:MM",   # remarcar: a janela inteira e deslocada
+      "descontar": false,
+      "motivo": "Chuva"
+    }
+    """
+    await ensure_bloqueios_table(db)
+    await ensure_contracts_table(db)
+    await ensure_contract_links(db)
+    await ensure_finance_columns(db)
+    await ensure_aulas_desconto_columns(db)
+
+    acao = (payload.get("acao") or "").strip().lower()
+    if acao not in ("cancelar", "remarcar"):
+        raise HTTPException(status_code=400, detail="Acao invalida. Use cancelar ou remarcar")
+    unidade_id = payload.get("unidade_id")
+    data_txt = payload.get("data")
+    hora_inicio = (payload.get("hora_inicio") or "").strip()
+    hora_fim = (payload.get("hora_fim") or "").strip()
+    if not unidade_id or not data_txt or not hora_inicio or not hora_fim:
+        raise HTTPException(status_code=400, detail="Informe unidade, data, hora inicio e hora fim")
+    try:
+        dia = datetime.strptime(data_txt, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data invalida. Use YYYY-MM-DD")
+    h1, m1 = parse_hora_min(hora_inicio)
+    h2, m2 = parse_hora_min(hora_fim)
+    ini_min = h1 * 60 + m1
+    fim_min = h2 * 60 + m2
+    if fim_min <= ini_min:
+        raise HTTPException(status_code=400, detail="Hora fim deve ser maior que hora inicio")
+    unidade_id = int(unidade_id)
+    motivo = (payload.get("motivo") or "").strip() or None
+    janela_ini = datetime(dia.year, dia.month, dia.day, h1, m1, tzinfo=BR_TZ)
+    janela_fim = datetime(dia.year, dia.month, dia.day, h2, m2, tzinfo=BR_TZ)
+
+    deslocamento = None
+    nova_data = None
+    if acao == "remarcar":
+        try:
+            nova_data = datetime.strptime(payload.get("nova_data") or "", "%Y-%m-%d").date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Informe nova_data (YYYY-MM-DD) para remarcar")
+        nh, nm = parse_hora_min((payload.get("nova_hora_inicio") or hora_inicio).strip())
+        novo_ini_min = nh * 60 + nm
+        if novo_ini_min + (fim_min - ini_min) > 24 * 60:
+            raise HTTPException(status_code=400, detail="Nova janela passa da meia-noite")
+        if nova_data == dia and novo_ini_min < fim_min and novo_ini_min + (fim_min - ini_min) > ini_min:
+            raise HTTPException(status_code=400, detail="Nova janela sobrepoe a janela interditada")
+        deslocamento = datetime(nova_data.year, nova_data.month, nova_data.day, nh, nm, tzinfo=BR_TZ) - janela_ini
+
+    # Aulas que tocam a janela; FOR UPDATE segura edicoes concorrentes ate o commit.
+    aulas = (
+        await db.execute(
+            text(
+                """
+                SELECT a.id, a.professor_id, a.inicio, a.fim
+                FROM aulas a
+                JOIN agendas ag ON ag.id = a.agenda_id
+                WHERE ag.unidade_id = :unidade_id
+                  AND a.inicio < :janela_fim AND a.fim > :janela_ini
+                  AND LOWER(COALESCE(a.status, 'agendada')) = 'agendada'
+                ORDER BY a.inicio, a.id
+                FOR UPDATE OF a
+                """
+            ),
+            {"unidade_id": unidade_id, "janela_ini": janela_ini, "janela_fim": janela_fim},
+        )
+    ).all()
+    ids = [int(r[0]) for r in aulas]
+
+    if ids and acao == "remarcar":
+        # Faixas de destino calculadas aqui; o banco devolve so as aulas que batem em bloqueio (&& no GiST).
+        faixas = []
+        for aula_id, professor_id, inicio, fim in aulas:
+            ini_br = (inicio + deslocamento).astimezone(BR_TZ)
+            a_ini = ini_br.hour * 60 + ini_br.minute
+            faixas.append((aula_id, professor_id, a_ini, a_ini + int((fim - inicio).total_seconds() // 60)))
+        conflitos = (
+            await db.execute(
+                text(
+                    """
+                    SELECT DISTINCT v.id
+                    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:professores AS INTEGER[]),
+                                CAST(:inicios AS INTEGER[]), CAST(:fins AS INTEGER[])) AS v(id, professor_id, ini, fim)
+                    JOIN agenda_bloqueios b
+                      ON b.status = 'ativo'
+                     AND b.periodo @> CAST(:data AS DATE)
+                     AND b.minutos && int4range(v.ini, v.fim)
+                     AND (b.dias_semana_mask IS NULL OR (b.dias_semana_mask >> CAST(:dia_semana AS INTEGER)) & 1 = 1)
+                     AND (b.unidade_id IS NULL OR b.unidade_id = :unidade_id)
+                     AND (b.profissional_id IS NULL OR b.profissional_id = v.professor_id)
+                    ORDER BY v.id
+                    """
+                ),
+                {
+                    "ids": [f[0] for f in faixas],
+                    "professores": [f[1] for f in faixas],
+                    "inicios": [f[2] for f in faixas],
+                    "fins": [f[3] for f in faixas],
+                    "data": nova_data,
+                    "dia_semana": nova_data.weekday(),
+                    "unidade_id": unidade_id,
+                },
+            )
+        ).scalars().all()
+        if conflitos:
+            raise HTTPException(status_code=409, detail=f"Horario bloqueado no destino para as aulas {conflitos}")
+
+        agenda_destino = await db.scalar(select(Agenda.id).where(Agenda.unidade_id == unidade_id, Agenda.data == nova_data))
+        if not agenda_destino:
+            nova_agenda = Agenda(unidade_id=unidade_id, data=nova_data)
+            db.add(nova_agenda)
+            await db.flush()
+            agenda_destino = nova_agenda.id
+        await db.execute(
+            text(
+                """
+                UPDATE aulas
+                SET inicio = inicio + make_interval(secs => :desloc),
+                    fim = fim + make_interval(secs => :desloc),
+                    agenda_id = :agenda_id,
+                    updated_at = NOW()
+                WHERE id = ANY(CAST(:ids AS INTEGER[]))
+                """
+            ),
+            {"desloc": deslocamento.total_seconds(), "agenda_id": agenda_destino, "ids": ids},
+        )
+    elif ids:
+        await db.execute(
+            text("UPDATE aulas SET status = 'cancelada', updated_at = NOW() WHERE id = ANY(CAST(:ids AS INTEGER[]))"),
+            {"ids": ids},
+        )
+
+    desconto = (0, 0, 0, 0)
+    if ids and payload.get("descontar"):
+        desconto = (await db.execute(text(DESCONTO_AULAS_EM_LOTE_SQL), {"ids": ids})).first()
+
+    bloqueio_id = (
+        await db.execute(
+            text(
+                """
+                INSERT INTO agenda_bloqueios (profissional_id, unidade_id, data, hora_inicio, hora_fim, motivo, status, created_at, updated_at)
+                VALUES (NULL, :unidade_id, :data, :hora_inicio, :hora_fim, :motivo, 'ativo', NOW(), NOW())
+                RETURNING id
+                """
+            ),
+            {
+                "unidade_id": unidade_id,
+                "data": dia,
+                "hora_inicio": min_to_hhmm(ini_min),
+                "hora_fim": min_to_hhmm(fim_min),
+                "motivo": motivo,
+            },
+        )
+    ).scalar_one()
+    await db.commit()
+    return {
+        "ok": True,
+        "acao": acao,
+        "aulas_afetadas": len(ids),
+        "aula_ids": ids,
+        "bloqueio_id": bloqueio_id,
+        "aulas_descontadas": int(desconto[0] or 0),
+        "desconto_total": float(desconto[1] or 0),
+        "contas_abatidas": int(desconto[2] or 0),
+        "restante_nao_abatido": float(desconto[3] or 0),
+    }
+
+
+@router.post("/substituicao")
+async def substituir_professor(payload: dict, db: AsyncSession = Depends(get_db)):
+    """
+    Redistribui as aulas agendadas de um professor ausente entre substitutos candidatos.
+
+    Body: {"professor_id": 3, "data_inicio": "YYYY-MM-DD", "data_fim": "YYYY-MM-DD",
+           "candidatos": [5, 7], "aplicar": false}
+
+    A disponibilidade de todos os candidatos para todas as aulas sai de uma unica consulta de
+    bloqueios (mais uma das aulas que ja se sobrepoem ao periodo), checada em memoria. Bloqueio
+    ou aula propria do candidato sobreposta impedem a atribuicao; aulas do ausente no mesmo
+    horario exato (turma) ficam juntas com o mesmo substituto. Entre candidatos livres vai quem
+    recebeu menos aulas. Com aplicar=false devolve so a proposta; com aplicar=true grava tudo
+    num unico UPDATE.
+    """
     await ensure_bloqueios_table(db)
+    try:
+        ausente_id = int(payload.get("professor_id"))
+        candidatos = list(dict.fromkeys(int(c) for c in payload.get("candidatos") or []))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Professor ou candidatos invalidos")
+    candidatos = [c for c in candidatos if c != ausente_id]
+    if not candidatos:
+        raise HTTPException(status_code=400, detail="Informe ao menos um professor substituto")
+    try:
+        data_inicio = datetime.strptime(payload.get("data_inicio") or "", "%Y-%m-%d").date()
+        data_fim = datetime.strptime(payload.get("data_fim") or payload.get("data_inicio"), "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data invalida. Use YYYY-MM-DD")
     if data_fim < data_inicio:
         data_fim = data_inicio
+    if (data_fim - data_inicio).days > 62:
+        raise HTTPException(status_code=400, detail="Periodo maximo de 62 dias")
+
+    validos = set((await db.execute(select(Profissional.id).where(Profissional.id.in_(candidatos)))).scalars().all())
+    invalidos = [c for c in candidatos if c not in validos]
+    if invalidos:
+        raise HTTPException(status_code=400, detail=f"Professores invalidos: {invalidos}")
+
     inicio_utc, _ = br_day_bounds_utc(data_inicio)
     _, fim_utc = br_day_bounds_utc(data_fim)
-    UsuarioAluno = aliased(Usuario)
-
-    aulas_q = (
-        select(
-            Aula.id,
-            Aula.inicio,
-            Aula.fim,
-            Aula.status,
-            Aula.professor_id,
-            func.coalesce(Usuario.nome, "Sem professor").label("professor_nome"),
-            Aula.aluno_id,
-            func.coalesce(UsuarioAluno.nome, "").label("aluno_nome"),
-            func.coalesce(Unidade.nome, "").label("unidade_nome"),
+    aulas = (
+        await db.execute(
+            text(
+                """
+                SELECT a.id, a.inicio, a.fim, ag.unidade_id
+                FROM aulas a
+                LEFT JOIN agendas ag ON ag.id = a.agenda_id
+                WHERE a.professor_id = :ausente_id
+                  AND a.inicio >= :inicio AND a.inicio < :fim
+                  AND LOWER(COALESCE(a.status, 'agendada')) = 'agendada'
+                ORDER BY a.inicio, a.id
+                """
+            ),
+            {"ausente_id": ausente_id, "inicio": inicio_utc, "fim": fim_utc},
         )
-        .join(Agenda, Aula.agenda_id == Agenda.id, isouter=True)
-        .join(Profissional, Profissional.id == Aula.professor_id, isouter=True)
-        .join(Usuario, Usuario.id == Profissional.usuario_id, isouter=True)
-        .join(Aluno, Aluno.id == Aula.aluno_id, isouter=True)
-        .join(UsuarioAluno, UsuarioAluno.id == Aluno.usuario_id, isouter=True)
-        .join(Unidade, Unidade.id == Agenda.unidade_id, isouter=True)
-        .where(Aula.inicio >= inicio_utc)
-        .where(Aula.inicio < fim_utc)
-        .order_by(Aula.inicio.asc())
-    )
-    if profissional_id:
-        aulas_q = aulas_q.where(Aula.professor_id == profissional_id)
-    aulas_rows = (await db.execute(aulas_q)).all()
+    ).all()
 
     bloqueios = (
         await db.execute(
             text(
                 """
-                SELECT b.id, b.data, b.hora_inicio, b.hora_fim, b.motivo, b.profissional_id,
-                       COALESCE(u.nome, 'Todos') AS professor_nome,
-                       COALESCE(un.nome, '') AS unidade_nome
-                FROM agenda_bloqueios b
-                LEFT JOIN profissionais p ON p.id = b.profissional_id
-                LEFT JOIN usuarios u ON u.id = p.usuario_id
-                LEFT JOIN unidades un ON un.id = b.unidade_id
-                WHERE b.data BETWEEN :data_inicio AND :data_fim
-                  AND LOWER(COALESCE(b.status, 'ativo')) = 'ativo'
-                  AND ((:profissional_id)::int IS NULL OR b.profissional_id IS NULL OR b.profissional_id = (:profissional_id)::int)
-                ORDER BY b.data ASC, b.hora_inicio ASC
+                SELECT profissional_id, unidade_id, data, lower(minutos), upper(minutos)
+                FROM agenda_bloqueios_periodo(:data_inicio, :data_fim)
+                WHERE status = 'ativo' AND minutos IS NOT NULL
+                  AND (profissional_id IS NULL OR profissional_id = ANY(CAST(:candidatos AS INTEGER[])))
+                """
+            ),
+            {"data_inicio": data_inicio, "data_fim": data_fim, "candidatos": candidatos},
+        )
+    ).all()
+    ocupadas = (
+        await db.execute(
+            text(
+                """
+                SELECT professor_id, inicio, fim
+                FROM aulas
+                WHERE professor_id = ANY(CAST(:candidatos AS INTEGER[]))
+                  AND inicio < :fim AND fim > :inicio
+                  AND LOWER(COALESCE(status, 'agendada')) <> 'cancelada'
                 """
             ),
-            {"data_inicio": data_inicio, "data_fim": data_fim, "profissional_id": profissional_id},
+            {"candidatos": candidatos, "inicio": inicio_utc, "fim": fim_utc},
         )
     ).all()
 
-    return {
-        "data_inicio": data_inicio.strftime("%Y-%m-%d"),
-        "data_fim": data_fim.strftime("%Y-%m-%d"),
-        "aulas": [
-            {
-                "id": r[0],
-                "inicio": r[1],
-                "fim": r[2],
-                "status": r[3],
-                "professor_id": r[4],
-                "professor_nome": r[5],
-                "aluno_id": r[6],
-                "aluno_nome": r[7] or "",
-                "unidade": r[8] or "",
-                "data": dt_to_br_fields(r[1])[0],
-                "data_br": dt_to_br_fields(r[1])[1],
-                "hora_br": dt_to_br_fields(r[1])[2],
-            }
-            for r in aulas_rows
-        ],
-        "bloqueios": [
+    # Bloqueios por dia, em minutos locais; aulas dos candidatos como intervalos UTC.
+    bloqueios_por_dia: dict[date, list[tuple]] = {}
+    for prof_id, bloq_unidade, bloq_data, b_ini, b_fim in bloqueios:
+        bloqueios_por_dia.setdefault(bloq_data, []).append((prof_id, bloq_unidade, b_ini, b_fim))
+    agenda_candidato: dict[int, list[tuple[datetime, datetime]]] = {c: [] for c in candidatos}
+    for prof_id, ini, fim in ocupadas:
+        agenda_candidato[prof_id].append((ini, fim))
+    # Horarios ja repassados a cada candidato nesta substituicao.
+    slots_atribuidos: dict[int, set[tuple[datetime, datetime]]] = {c: set() for c in candidatos}
+    atribuidas = {c: 0 for c in candidatos}
+
+    proposta = []
+    sem_substituto = []
+    for aula_id, inicio, fim, unidade_id in aulas:
+        ini_br = inicio.astimezone(BR_TZ)
+        a_ini = ini_br.hour * 60 + ini_br.minute
+        a_fim = a_ini + int((fim - inicio).total_seconds() // 60)
+        bloqueados = set()
+        for prof_id, bloq_unidade, b_ini, b_fim in bloqueios_por_dia.get(ini_br.date(), []):
+            if (bloq_unidade is None or bloq_unidade == unidade_id) and a_ini < b_fim and a_fim > b_ini:
+                if prof_id is None:
+                    bloqueados.update(candidatos)
+                else:
+                    bloqueados.add(prof_id)
+        slot = (inicio, fim)
+        livres = [
+            c
+            for c in candidatos
+            if c not in bloqueados
+            and not any(inicio < o_fim and fim > o_ini for o_ini, o_fim in agenda_candidato[c])
+            and not any(inicio < o_fim and fim > o_ini for o_ini, o_fim in slots_atribuidos[c] if (o_ini, o_fim) != slot)
+        ]
+        if not livres:
+            sem_substituto.append(aula_id)
+            continue
+        escolhido = min(livres, key=lambda c: (slot not in slots_atribuidos[c], atribuidas[c]))
+        slots_atribuidos[escolhido].add(slot)
+        atribuidas[escolhido] += 1
+        data_iso, data_br, hora_br = dt_to_br_fields(inicio)
+        proposta.append({"aula_id": aula_id, "professor_id": escolhido, "data": data_iso, "data_br": data_br, "hora_br": hora_br})
+
+    aplicar = bool(payload.get("aplicar"))
+    if aplicar and proposta:
+        await db.execute(
+            text(
+                """
+                UPDATE aulas a
+                SET professor_id = v.professor_id, updated_at = NOW()
+                FROM unnest(CAST(:ids AS INTEGER[]), CAST(:professores AS INTEGER[])) AS v(id, professor_id)
+                WHERE a.id = v.id
+                  AND a.professor_id = :ausente_id
+                """
+            ),
             {
-                "id": r[0],
-                "data": r[1].strftime("%Y-%m-%d") if r[1] else None,
-                "hora_inicio": r[2],
-                "hora_fim": r[3],
-                "motivo": r[4] or "",
-                "profissional_id": r[5],
-                "professor_nome": r[6],
-                "unidade": r[7],
-            }
-            for r in bloqueios
-        ],
+                "ids": [p["aula_id"] for p in proposta],
+                "professores": [p["professor_id"] for p in proposta],
+                "ausente_id": ausente_id,
+            },
+        )
+        await db.commit()
+
+    return {
+        "aplicado": aplicar and bool(proposta),
+        "aulas": len(aulas),
+        "proposta": proposta,
+        "sem_substituto": sem_substituto,
+        "por_professor": atribuidas,
+    }
+
+
+def agenda_json_sql(com_data: bool, filtro_aulas: str, filtro_bloqueios: str) -> str:
+    """
+    Agenda inteira montada pelo Postgres (json_build_object/json_agg), com data e hora ja
+    formatadas no horario de Brasilia. Mesmo formato que o dict montado antes em Python:
+    inicio/fim em ISO UTC e data_br/hora_br para exibicao.
+    """
+    campo_data = "'data', to_char(a.inicio AT TIME ZONE 'America/Sao_Paulo', 'YYYY-MM-DD')," if com_data else ""
+    return f"""
+        SELECT json_build_object(
+          {"'data_inicio', CAST(:data_inicio_txt AS TEXT), 'data_fim', CAST(:data_fim_txt AS TEXT)" if com_data else "'data', CAST(:data_inicio_txt AS TEXT)"},
+          'aulas', (
+            SELECT COALESCE(json_agg(json_build_object(
+                     'id', a.id,
+                     'inicio', to_char(a.inicio AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"+00:00"'),
+                     'fim', to_char(a.fim AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"+00:00"'),
+                     'status', a.status,
+                     'professor_id', a.professor_id,
+                     'professor_nome', COALESCE(u.nome, 'Sem professor'),
+                     'aluno_id', a.aluno_id,
+                     'aluno_nome', COALESCE(ua.nome, ''),
+                     'unidade', COALESCE(un.nome, ''),
+                     {campo_data}
+                     'data_br', COALESCE(to_char(a.inicio AT TIME ZONE 'America/Sao_Paulo', 'DD/MM/YYYY'), ''),
+                     'hora_br', COALESCE(to_char(a.inicio AT TIME ZONE 'America/Sao_Paulo', 'HH24:MI'), '')
+                   ) ORDER BY a.inicio, a.id), '[]'::json)
+            FROM aulas a
+            LEFT JOIN agendas ag ON ag.id = a.agenda_id
+            LEFT JOIN profissionais p ON p.id = a.professor_id
+            LEFT JOIN usuarios u ON u.id = p.usuario_id
+            LEFT JOIN alunos al ON al.id = a.aluno_id
+            LEFT JOIN usuarios ua ON ua.id = al.usuario_id
+            LEFT JOIN unidades un ON un.id = ag.unidade_id
+            WHERE a.inicio >= :inicio AND a.inicio < :fim
+            {filtro_aulas}
+          ),
+          'bloqueios', (
+            SELECT COALESCE(json_agg(json_build_object(
+                     'id', b.id,
+                     'data', to_char(b.data, 'YYYY-MM-DD'),
+                     'hora_inicio', b.hora_inicio,
+                     'hora_fim', b.hora_fim,
+                     'motivo', COALESCE(b.motivo, ''),
+                     'profissional_id', b.profissional_id,
+                     'professor_nome', COALESCE(pu.nome, 'Todos'),
+                     'unidade', COALESCE(bun.nome, '')
+                   ) ORDER BY b.data, b.hora_inicio), '[]'::json)
+            FROM agenda_bloqueios_periodo(:data_inicio, :data_fim) b
+            LEFT JOIN profissionais bp ON bp.id = b.profissional_id
+            LEFT JOIN usuarios pu ON pu.id = bp.usuario_id
+            LEFT JOIN unidades bun ON bun.id = b.unidade_id
+            WHERE b.status = 'ativo'
+            {filtro_bloqueios}
+          )
+        )::text
+    """
+
+
+async def agenda_json(
+    db: AsyncSession, data_inicio: date, data_fim: date, profissional_id: int | None, com_data: bool
+) -> Response:
+    await ensure_bloqueios_table(db)
+    inicio_utc, _ = br_day_bounds_utc(data_inicio)
+    _, fim_utc = br_day_bounds_utc(data_fim)
+    params: dict = {
+        "data_inicio_txt": data_inicio.strftime("%Y-%m-%d"),
+        "data_fim_txt": data_fim.strftime("%Y-%m-%d"),
+        "data_inicio": data_inicio,
+        "data_fim": data_fim,
+        "inicio": inicio_utc,
+        "fim": fim_utc,
     }
+    filtro_aulas = ""
+    filtro_bloqueios = ""
+    if profissional_id:
+        filtro_aulas = " AND a.professor_id = :profissional_id "
+        filtro_bloqueios = " AND (b.profissional_id IS NULL OR b.profissional_id = :profissional_id) "
+        params["profissional_id"] = profissional_id
+    corpo = (
+        await db.execute(text(agenda_json_sql(com_data, filtro_aulas, filtro_bloqueios)), params)
+    ).scalar_one()
+    # JSON pronto do banco: vai direto no corpo, sem materializar linhas nem re-serializar.
+    return Response(content=corpo.encode(), media_type="application/json")
+
+
+@router.get("")
+async def listar_agenda(
+    request: Request, data: date | None = None, profissional_id: int | None = None, db: AsyncSession = Depends(get_db)
+):
+    dia = data or date.today()
+    # O dia entra no ETag: sem "data", a mesma URL passa a ser outro dia a meia-noite.
+    headers, nao_modificada = await checar_condicional(request, "agenda", dia.strftime("%Y%m%d"))
+    if nao_modificada:
+        return nao_modificada
+    resposta = await agenda_json(db, dia, dia, profissional_id, com_data=False)
+    resposta.headers.update(headers)
+    return resposta
+
+
+@router.get("/periodo")
+async def listar_agenda_periodo(
+    request: Request,
+    data_inicio: date,
+    data_fim: date,
+    profissional_id: int | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    if data_fim < data_inicio:
+        data_fim = data_inicio
+    headers, nao_modificada = await checar_condicional(request, "agenda")
+    if nao_modificada:
+        return nao_modificada
+    resposta = await agenda_json(db, data_inicio, data_fim, profissional_id, com_data=True)
+    resposta.headers.update(headers)
+    return resposta
+
+
+@router.get("/eventos")
+async def eventos_agenda(
+    unidade_id: int | None = None, profissional_id: int | None = None, db: AsyncSession = Depends(get_db)
+):
+    """
+    Stream SSE (text/event-stream) com os deltas da agenda: aula_criada, aula_remarcada, aula_status,
+    aula_removida, bloqueio_criado, bloqueio_removido e resync (cliente deve recarregar).
+    Filtra por unidade e/ou professor; bloqueios gerais chegam para todos.
+    """
+    await ensure_bloqueios_table(db)
+    await ensure_agenda_eventos(db)
+    # Devolve a conexao ao pool ja: o stream pode ficar aberto por horas.
+    await db.close()
+    assinante = await assinar(unidade_id, profissional_id)
+    return StreamingResponse(
+        stream_eventos(assinante),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.post("/bloqueios")
@@ -315,60 +753,75 @@ async def criar_bloqueio(payload: dict, db: AsyncSession = Depends(get_db)):
     if fim_min <= ini_min:
         raise HTTPException(status_code=400, detail="Hora fim deve ser maior que hora inicio")
 
+    dias_validos = [dia_label_to_weekday(d) for d in dias_semana]
+    dias_validos = [d for d in dias_validos if d is not None]
+    params = {
+        "profissional_id": int(profissional_id) if profissional_id else None,
+        "unidade_id": int(unidade_id) if unidade_id else None,
+        "motivo": motivo,
+    }
+
+    if payload.get("compacto"):
+        # Uma linha para o periodo inteiro (bit 0 = segunda ... bit 6 = domingo);
+        # agenda_bloqueios_periodo expande so os dias consultados.
+        bloqueio_id = (
+            await db.execute(
+                text(
+                    """
+                    INSERT INTO agenda_bloqueios (profissional_id, unidade_id, data, data_fim, dias_semana_mask,
+                                                  hora_inicio, hora_fim, motivo, status, created_at, updated_at)
+                    VALUES (:profissional_id, :unidade_id, :data, :data_fim, :mascara,
+                            :hora_inicio, :hora_fim, :motivo, 'ativo', NOW(), NOW())
+                    RETURNING id
+                    """
+                ),
+                {
+                    **params,
+                    "data": data_inicio,
+                    "data_fim": data_fim if data_fim > data_inicio else None,
+                    "mascara": sum(1 << d for d in set(dias_validos)) if dias_validos else None,
+                    "hora_inicio": min_to_hhmm(ini_min),
+                    "hora_fim": min_to_hhmm(fim_min),
+                },
+            )
+        ).scalar_one()
+        await db.commit()
+        return {"ok": True, "bloqueios_criados": 1, "bloqueio_id": bloqueio_id}
+
     # When user blocks multiple full hours (e.g. 10:00-13:00), store it as 1 record per hour.
     # This makes availability checks and UI clearer (and matches expected behavior).
     split_hourly = (m1 == 0) and (m2 == 0) and ((fim_min - ini_min) >= 120) and ((fim_min - ini_min) % 60 == 0)
+    faixas = [(t, t + 60) for t in range(ini_min, fim_min, 60)] if split_hourly else [(ini_min, fim_min)]
 
-    dias_validos = [dia_label_to_weekday(d) for d in dias_semana]
-    dias_validos = [d for d in dias_validos if d is not None]
-
-    total = 0
+    datas: list[date] = []
+    horas_inicio: list[str] = []
+    horas_fim: list[str] = []
     cursor = data_inicio
     while cursor <= data_fim:
         if not dias_validos or cursor.weekday() in dias_validos:
-            if split_hourly:
-                t = ini_min
-                while t < fim_min:
-                    await db.execute(
-                        text(
-                            """
-                            INSERT INTO agenda_bloqueios (profissional_id, unidade_id, data, hora_inicio, hora_fim, motivo, status, created_at, updated_at)
-                            VALUES (:profissional_id, :unidade_id, :data, :hora_inicio, :hora_fim, :motivo, 'ativo', NOW(), NOW())
-                            """
-                        ),
-                        {
-                            "profissional_id": profissional_id,
-                            "unidade_id": unidade_id,
-                            "data": cursor,
-                            "hora_inicio": min_to_hhmm(t),
-                            "hora_fim": min_to_hhmm(t + 60),
-                            "motivo": motivo,
-                        },
-                    )
-                    total += 1
-                    t += 60
-            else:
-                await db.execute(
-                    text(
-                        """
-                        INSERT INTO agenda_bloqueios (profissional_id, unidade_id, data, hora_inicio, hora_fim, motivo, status, created_at, updated_at)
-                        VALUES (:profissional_id, :unidade_id, :data, :hora_inicio, :hora_fim, :motivo, 'ativo', NOW(), NOW())
-                        """
-                    ),
-                    {
-                        "profissional_id": profissional_id,
-                        "unidade_id": unidade_id,
-                        "data": cursor,
-                        "hora_inicio": hora_inicio,
-                        "hora_fim": hora_fim,
-                        "motivo": motivo,
-                    },
-                )
-                total += 1
+            for f_ini, f_fim in faixas:
+                datas.append(cursor)
+                horas_inicio.append(min_to_hhmm(f_ini))
+                horas_fim.append(min_to_hhmm(f_fim))
         cursor += timedelta(days=1)
 
+    # Todas as linhas num unico INSERT via unnest, em vez de um statement por dia/hora.
+    if datas:
+        await db.execute(
+            text(
+                """
+                INSERT INTO agenda_bloqueios (profissional_id, unidade_id, data, hora_inicio, hora_fim, motivo, status, created_at, updated_at)
+                SELECT CAST(:profissional_id AS INTEGER), CAST(:unidade_id AS INTEGER), v.data, v.hora_inicio, v.hora_fim,
+                       CAST(:motivo AS VARCHAR), 'ativo', NOW(), NOW()
+                FROM unnest(CAST(:datas AS DATE[]), CAST(:horas_inicio AS VARCHAR[]), CAST(:horas_fim AS VARCHAR[]))
+                  AS v(data, hora_inicio, hora_fim)
+                """
+            ),
+            {**params, "datas": datas, "horas_inicio": horas_inicio, "horas_fim": horas_fim},
+        )
+
     await db.commit()
-    return {"ok": True, "bloqueios_criados": total}
+    return {"ok": True, "bloqueios_criados": len(datas)}
 
 
 @router.delete("/bloqueios/{bloqueio_id}")
@@ -400,12 +853,11 @@ async def listar_bloqueios_periodo(
                 SELECT b.id, b.data, b.hora_inicio, b.hora_fim, b.motivo, b.profissional_id,
                        COALESCE(u.nome, 'Todos') AS professor_nome,
                        COALESCE(un.nome, '') AS unidade_nome
-                FROM agenda_bloqueios b
+                FROM agenda_bloqueios_periodo(:data_inicio, :data_fim) b
                 LEFT JOIN profissionais p ON p.id = b.profissional_id
                 LEFT JOIN usuarios u ON u.id = p.usuario_id
                 LEFT JOIN unidades un ON un.id = b.unidade_id
-                WHERE b.data BETWEEN :data_inicio AND :data_fim
-                  AND LOWER(COALESCE(b.status, 'ativo')) = 'ativo'
+                WHERE b.status = 'ativo'
                   AND ((:profissional_id)::int IS NULL OR b.profissional_id IS NULL OR b.profissional_id = (:profissional_id)::int)
                 ORDER BY b.data ASC, b.hora_inicio ASC
                 """
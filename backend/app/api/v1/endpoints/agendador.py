@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import get_db
+from app.services.agendador_service import JOBS, JOBS_POR_NOME, ensure_agendador_table, executar_job_agendado
+
+router = APIRouter(prefix="/agendador", tags=["agendador"])
+
+
+@router.get("")
+async def listar_jobs_agendados(db: AsyncSession = Depends(get_db)):
+    """Jobs de manutencao com a ultima execucao e metricas de duracao."""
+    await ensure_agendador_table(db)
+    rows = (
+        await db.execute(
+            text(
+                """
+                SELECT nome, ultima_execucao, ultimo_status, ultima_duracao_ms, ultimo_resultado, ultimo_erro,
+                       execucoes, falhas, duracao_total_ms
+                FROM agendador_jobs
+                """
+            )
+        )
+    ).all()
+    estado = {r[0]: r for r in rows}
+    itens = []
+    for job in JOBS:
+        r = estado.get(job.nome)
+        execucoes = int(r[6] or 0) if r else 0
+        itens.append(
+            {
+                "nome": job.nome,
+                "horario": job.horario,
+                "dia_mes": job.dia_mes,
+                "ultima_execucao": r[1].isoformat() if r and r[1] else None,
+                "ultimo_status": r[2] if r else None,
+                "ultima_duracao_ms": r[3] if r else None,
+                "ultimo_resultado": r[4] if r else None,
+                "ultimo_erro": r[5] if r else None,
+                "execucoes": execucoes,
+                "falhas": int(r[7] or 0) if r else 0,
+                "duracao_media_ms": round(int(r[8] or 0) / execucoes) if execucoes else None,
+            }
+        )
+    return itens
+
+
+@router.post("/{nome}/executar")
+async def executar_job_agora(nome: str, db: AsyncSession = Depends(get_db)):
+    job = JOBS_POR_NOME.get(nome)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job nao encontrado")
+    await ensure_agendador_table(db)
+    resultado = await executar_job_agendado(job, forcar=True)
+    if resultado is None:
+        raise HTTPException(status_code=409, detail="Job em execucao em outro processo")
+    return resultado
@@ -2,7 +2,7 @@ from datetime import date, datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 import calendar
 import json
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, text
 from app.db.session import get_db
@@ -10,6 +10,17 @@ from app.api.deps import require_role
 from app.models.entities import Aluno, Usuario, Role, Aula, ContaReceber, Agenda, Unidade, Profissional
 from app.schemas.domain import AlunoIn, AlunoCadastroIn
 from app.core.security import get_password_hash
+from app.services.bulk_service import inserir_em_lote
+from app.services.categorizacao_service import categorizar
+from app.services.ddl_service import FuncaoSql, garantir_ddl
+from app.services.finance_service import (
+    ensure_contas_bancarias_table,
+    ensure_contas_receber_columns,
+    ensure_saldo_devedor,
+    verificar_saldo_devedor,
+)
+from app.services.jobs_service import enfileirar_job, registrar_job, resposta_job
+from app.services.ledger_service import ensure_ledger_schema
 
 router = APIRouter(prefix="/alunos", tags=["alunos"])
 
@@ -126,18 +137,6 @@ async def ensure_finance_columns(db: AsyncSession):
             """
             DO $$
             BEGIN
-              IF NOT EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name = 'contas_receber' AND column_name = 'data_pagamento'
-              ) THEN
-                ALTER TABLE contas_receber ADD COLUMN data_pagamento DATE;
-              END IF;
-              IF NOT EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name = 'contas_receber' AND column_name = 'conta_bancaria_id'
-              ) THEN
-                ALTER TABLE contas_receber ADD COLUMN conta_bancaria_id INTEGER;
-              END IF;
               IF NOT EXISTS (
                 SELECT 1 FROM information_schema.columns
                 WHERE table_name = 'movimentos_bancarios' AND column_name = 'categoria'
@@ -150,25 +149,67 @@ async def ensure_finance_columns(db: AsyncSession):
               ) THEN
                 ALTER TABLE movimentos_bancarios ADD COLUMN subcategoria VARCHAR(120);
               END IF;
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'movimentos_bancarios' AND column_name = 'conta_bancaria_id'
+              ) THEN
+                ALTER TABLE movimentos_bancarios ADD COLUMN conta_bancaria_id INTEGER;
+              END IF;
             END $$;
             """
         )
     )
-    await db.execute(
-        text(
-            """
-            CREATE TABLE IF NOT EXISTS contas_bancarias (
-              id SERIAL PRIMARY KEY,
-              nome_conta VARCHAR(120) NOT NULL,
-              banco VARCHAR(120) NOT NULL,
-              agencia VARCHAR(40) NOT NULL,
-              cc VARCHAR(40) NOT NULL,
-              saldo NUMERIC(12,2) NOT NULL DEFAULT 0
-            )
-            """
-        )
-    )
     await db.commit()
+    await ensure_contas_bancarias_table(db)
+    # Colunas de contas_receber (data_pagamento, conta_bancaria_id, em_atraso) e saldo_devedor.
+    await ensure_contas_receber_columns(db)
+
+
+def _hora_para_minutos(coluna: str) -> str:
+    return f"CAST(split_part({coluna}, ':', 1) AS INTEGER) * 60 + CAST(split_part({coluna}, ':', 2) AS INTEGER)"
+
+
+# CASE aninhado: o Postgres so garante a ordem de avaliacao dentro do CASE, entao o cast so roda
+# depois do formato conferido.
+BLOQUEIO_MINUTOS_SQL = f"""
+    CASE WHEN hora_inicio ~ '^[0-9]{{1,2}}:[0-9]{{2}}$' AND hora_fim ~ '^[0-9]{{1,2}}:[0-9]{{2}}$' THEN
+      CASE WHEN {_hora_para_minutos("hora_inicio")} < {_hora_para_minutos("hora_fim")} THEN
+        int4range({_hora_para_minutos("hora_inicio")}, {_hora_para_minutos("hora_fim")})
+      END
+    END
+"""
+BLOQUEIO_PERIODO_SQL = """
+    CASE WHEN data_fim IS NULL OR data_fim >= data THEN daterange(data, COALESCE(data_fim, data), '[]') END
+"""
+# Leitura sempre por aqui: expande as linhas compactas so nos dias pedidos. DROP antes do CREATE
+# para que uma versao nova possa mudar as colunas devolvidas.
+BLOQUEIOS_PERIODO_FUNCAO = FuncaoSql(
+    "agenda_bloqueios_periodo",
+    "1",
+    """
+    DO $do$
+    BEGIN
+      DROP FUNCTION IF EXISTS agenda_bloqueios_periodo(DATE, DATE);
+      CREATE FUNCTION agenda_bloqueios_periodo(p_inicio DATE, p_fim DATE)
+      RETURNS TABLE (
+        id INTEGER, profissional_id INTEGER, unidade_id INTEGER, data DATE,
+        hora_inicio VARCHAR, hora_fim VARCHAR, motivo VARCHAR, status VARCHAR, minutos INT4RANGE
+      )
+      LANGUAGE sql STABLE AS $body$
+        SELECT b.id, b.profissional_id, b.unidade_id, CAST(d.dia AS DATE),
+               b.hora_inicio, b.hora_fim, b.motivo, b.status, b.minutos
+        FROM agenda_bloqueios b
+        CROSS JOIN LATERAL generate_series(
+          GREATEST(lower(b.periodo), p_inicio), LEAST(upper(b.periodo) - 1, p_fim), INTERVAL '1 day'
+        ) AS d(dia)
+        WHERE b.periodo && daterange(p_inicio, p_fim, '[]')
+          AND (b.dias_semana_mask IS NULL
+               OR (b.dias_semana_mask >> (CAST(EXTRACT(ISODOW FROM d.dia) AS INTEGER) - 1)) & 1 = 1)
+      $body$;
+    END
+    $do$
+    """,
+)
 
 
 async def ensure_bloqueios_table(db: AsyncSession):
@@ -190,6 +231,75 @@ async def ensure_bloqueios_table(db: AsyncSession):
             """
         )
     )
+    # Bloqueio compacto: uma linha cobre data..data_fim nos dias do dias_semana_mask
+    # (bit 0 = segunda ... bit 6 = domingo; NULL = todos). Linha comum tem data_fim NULL.
+    await db.execute(
+        text(
+            """
+            DO $$
+            BEGIN
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'agenda_bloqueios' AND column_name = 'data_fim'
+              ) THEN
+                ALTER TABLE agenda_bloqueios ADD COLUMN data_fim DATE;
+              END IF;
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'agenda_bloqueios' AND column_name = 'dias_semana_mask'
+              ) THEN
+                ALTER TABLE agenda_bloqueios ADD COLUMN dias_semana_mask SMALLINT;
+              END IF;
+            END $$;
+            """
+        )
+    )
+    # Bloqueio como intervalo: periodo (dias, inclusivo) e minutos do dia [inicio, fim), gerados a
+    # partir das colunas de texto. Conflito vira "&&" indexado por GiST; status fica sempre minusculo.
+    # Linha legada com hora malformada, inicio >= fim ou data_fim < data gera NULL (fica fora dos
+    # checks de conflito, como antes) em vez de abortar o ALTER. Colunas geradas antes dessa
+    # protecao (expressao sem CASE) sao recriadas.
+    await db.execute(
+        text(
+            f"""
+            DO $$
+            BEGIN
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'agenda_bloqueios' AND column_name = 'periodo'
+              ) THEN
+                UPDATE agenda_bloqueios SET status = LOWER(TRIM(status)) WHERE status <> LOWER(TRIM(status));
+                ALTER TABLE agenda_bloqueios
+                  ADD CONSTRAINT ck_agenda_bloqueios_status CHECK (status = LOWER(TRIM(status)));
+                DROP INDEX IF EXISTS ix_agenda_bloqueios_fim;
+              END IF;
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'agenda_bloqueios' AND column_name = 'periodo' AND generation_expression LIKE '%CASE%'
+              ) THEN
+                ALTER TABLE agenda_bloqueios DROP COLUMN IF EXISTS periodo;
+                ALTER TABLE agenda_bloqueios ADD COLUMN periodo DATERANGE GENERATED ALWAYS AS ({BLOQUEIO_PERIODO_SQL}) STORED;
+              END IF;
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'agenda_bloqueios' AND column_name = 'minutos' AND generation_expression LIKE '%CASE%'
+              ) THEN
+                ALTER TABLE agenda_bloqueios DROP COLUMN IF EXISTS minutos;
+                ALTER TABLE agenda_bloqueios ADD COLUMN minutos INT4RANGE GENERATED ALWAYS AS ({BLOQUEIO_MINUTOS_SQL}) STORED;
+              END IF;
+            END $$;
+            """
+        )
+    )
+    await db.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS ix_agenda_bloqueios_periodo_minutos
+            ON agenda_bloqueios USING GIST (periodo, minutos) WHERE status = 'ativo'
+            """
+        )
+    )
+    await garantir_ddl(db, BLOQUEIOS_PERIODO_FUNCAO)
     await db.commit()
 
 
@@ -225,6 +335,46 @@ async def ensure_aulas_desconto_columns(db: AsyncSession):
     await db.commit()
 
 
+async def bloqueios_em_conflito(
+    db: AsyncSession,
+    professor_id: int,
+    data_ref: date,
+    inicio_min: int,
+    fim_min: int,
+    unidade_id: int | None = None,
+    limite: int | None = None,
+) -> list[tuple[int, int]]:
+    """
+    Bloqueios ativos do professor (ou gerais) que se sobrepoem a [inicio_min, fim_min) no dia,
+    em minutos do horario do Brasil. Overlap resolvido no banco pelo indice GiST (periodo, minutos).
+    """
+    await ensure_bloqueios_table(db)
+    # Evita AmbiguousParameterError do asyncpg quando usa ":param IS NULL" em SQL raw.
+    sql = """
+        SELECT lower(minutos), upper(minutos)
+        FROM agenda_bloqueios
+        WHERE status = 'ativo'
+          AND periodo @> CAST(:data AS DATE)
+          AND minutos && int4range(:inicio_min, :fim_min)
+          AND (dias_semana_mask IS NULL OR (dias_semana_mask >> CAST(:dia_semana AS INTEGER)) & 1 = 1)
+          AND (profissional_id IS NULL OR profissional_id = :profissional_id)
+    """
+    params: dict = {
+        "data": data_ref,
+        "inicio_min": inicio_min,
+        "fim_min": max(fim_min, inicio_min),
+        "dia_semana": data_ref.weekday(),
+        "profissional_id": professor_id,
+    }
+    if unidade_id is not None:
+        sql += " AND (unidade_id IS NULL OR unidade_id = :unidade_id)"
+        params["unidade_id"] = int(unidade_id)
+    if limite:
+        sql += " LIMIT :limite"
+        params["limite"] = limite
+    return [(int(r[0]), int(r[1])) for r in (await db.execute(text(sql), params)).all()]
+
+
 async def slot_em_conflito(
     db: AsyncSession,
     professor_id: int,
@@ -241,34 +391,11 @@ async def slot_em_conflito(
     # Como armazenamos aulas em UTC (timestamptz), convertemos para BR antes de comparar.
     inicio_br = inicio_dt.astimezone(BR_TZ) if getattr(inicio_dt, "tzinfo", None) else inicio_dt.replace(tzinfo=timezone.utc).astimezone(BR_TZ)
     fim_br = fim_dt.astimezone(BR_TZ) if getattr(fim_dt, "tzinfo", None) else fim_dt.replace(tzinfo=timezone.utc).astimezone(BR_TZ)
-
-    await ensure_bloqueios_table(db)
-    # Evita AmbiguousParameterError do asyncpg quando usa ":param IS NULL" em SQL raw.
-    sql = """
-        SELECT hora_inicio, hora_fim
-        FROM agenda_bloqueios
-        WHERE data = :data
-          AND LOWER(COALESCE(status, 'ativo')) = 'ativo'
-          AND (profissional_id IS NULL OR profissional_id = :profissional_id)
-    """
-    params: dict = {"data": inicio_br.date(), "profissional_id": professor_id}
-    if unidade_id is not None:
-        sql += " AND (unidade_id IS NULL OR unidade_id = :unidade_id)"
-        params["unidade_id"] = int(unidade_id)
-
-    rows = (await db.execute(text(sql), params)).all()
     inicio_min = inicio_br.hour * 60 + inicio_br.minute
-    fim_min = fim_br.hour * 60 + fim_br.minute
-    for r in rows:
-        try:
-            hi_h, hi_m = str(r[0]).split(":")
-            hf_h, hf_m = str(r[1]).split(":")
-            b_ini = int(hi_h) * 60 + int(hi_m)
-            b_fim = int(hf_h) * 60 + int(hf_m)
-        except Exception:
-            continue
-        if inicio_min < b_fim and fim_min > b_ini:
-            return "Conflito: horario bloqueado na agenda do professor"
+    fim_min = inicio_min + int((fim_br - inicio_br).total_seconds() // 60)
+
+    if await bloqueios_em_conflito(db, professor_id, inicio_br.date(), inicio_min, fim_min, unidade_id=unidade_id, limite=1):
+        return "Conflito: horario bloqueado na agenda do professor"
     return None
 
 def gerar_horas_cheias(inicio_h: int = 7, fim_h: int = 21) -> list[str]:
@@ -289,15 +416,20 @@ async def listar_horarios_disponiveis(
     unidade_id: int | None = None,
 ) -> list[str]:
     horas = gerar_horas_cheias()
-    livres: list[str] = []
+    duracao = max(30, duracao_min)
+    slots = []
     for hhmm in horas:
         hh, mm = hhmm.split(":")
-        ini = br_local_to_utc(data_ref, hhmm)
-        fim = ini + timedelta(minutes=max(30, duracao_min))
-        conflito = await slot_em_conflito(db, professor_id, ini, fim, unidade_id=unidade_id)
-        if not conflito:
-            livres.append(hhmm)
-    return livres
+        slots.append((hhmm, int(hh) * 60 + int(mm)))
+    # Uma consulta com os bloqueios que tocam o dia inteiro de slots; cada slot e checado em memoria.
+    bloqueios = await bloqueios_em_conflito(
+        db, professor_id, data_ref, slots[0][1], slots[-1][1] + duracao, unidade_id=unidade_id
+    )
+    return [
+        hhmm
+        for hhmm, ini in slots
+        if not any(ini < b_fim and ini + duracao > b_ini for b_ini, b_fim in bloqueios)
+    ]
 
 
 def add_months(base: date, months: int) -> date:
@@ -308,6 +440,10 @@ def add_months(base: date, months: int) -> date:
     return date(year, month, day)
 
 
+# Status aceitos na marcacao de presenca (individual e em lote pela agenda).
+STATUS_AULA_PERMITIDOS = {"realizada", "falta_aviso", "falta", "agendada", "cancelada"}
+
+
 def recorrencia_to_meses(recorrencia: str) -> int:
     mapa = {"mensal": 1, "trimestral": 3, "semestral": 6, "anual": 12}
     return mapa.get((recorrencia or "").lower(), 1)
@@ -445,28 +581,58 @@ async def resolve_unidade_aluno(db: AsyncSession, aluno_id: int, unidade_nome_pa
 
 
 @router.get("")
-async def list_alunos(db: AsyncSession = Depends(get_db)):
+async def list_alunos(
+    ordenar: str = Query(default="nome", description="nome ou saldo_devedor"),
+    em_debito: bool = Query(default=False, description="Somente alunos com saldo devedor"),
+    saldo_min: float | None = Query(default=None, description="Saldo devedor minimo"),
+    db: AsyncSession = Depends(get_db),
+):
     await ensure_details_table(db)
+    await ensure_saldo_devedor(db)
+    filtros = ""
+    params: dict[str, object] = {}
+    if em_debito:
+        filtros += " AND a.saldo_devedor > 0 "
+    if saldo_min is not None:
+        filtros += " AND a.saldo_devedor >= :saldo_min "
+        params["saldo_min"] = saldo_min
+    ordem = "a.saldo_devedor DESC, u.nome ASC" if ordenar == "saldo_devedor" else "u.nome ASC"
     rows = (
         await db.execute(
-            select(Aluno, Usuario)
-            .join(Usuario, Usuario.id == Aluno.usuario_id)
-            .order_by(Usuario.nome.asc())
+            text(
+                f"""
+                SELECT a.id, u.nome, a.telefone, a.status, COALESCE(d.unidade, un.nome) AS unidade, a.saldo_devedor
+                FROM alunos a
+                JOIN usuarios u ON u.id = a.usuario_id
+                LEFT JOIN aluno_detalhes d ON d.aluno_id = a.id
+                LEFT JOIN unidades un ON un.id = d.unidade_id
+                WHERE 1=1
+                {filtros}
+                ORDER BY {ordem}
+                """
+            ),
+            params,
         )
     ).all()
-    result = []
-    for aluno, user in rows:
-        d = await get_details(db, aluno.id)
-        result.append(
-            {
-                "id": aluno.id,
-                "nome": user.nome,
-                "telefone": aluno.telefone,
-                "status": aluno.status,
-                "unidade": d.get("unidade") or "Nao definida",
-            }
-        )
-    return result
+    return [
+        {
+            "id": r[0],
+            "nome": r[1],
+            "telefone": r[2],
+            "status": r[3],
+            "unidade": r[4] or "Nao definida",
+            "saldo_devedor": float(r[5] or 0),
+        }
+        for r in rows
+    ]
+
+
+@router.post("/saldo-devedor/verificar")
+async def verificar_saldos_devedores(corrigir: bool = True, db: AsyncSession = Depends(get_db)):
+    """Recalcula o saldo devedor de todos os alunos e lista (e corrige) divergencias."""
+    await ensure_finance_columns(db)
+    divergencias = await verificar_saldo_devedor(db, corrigir=corrigir)
+    return {"ok": True, "corrigido": corrigir, "divergencias": divergencias}
 
 
 @router.get("/{aluno_id}/ficha")
@@ -690,12 +856,16 @@ async def criar_contrato(aluno_id: int, payload: dict, db: AsyncSession = Depend
     ).first()
     contrato_id = contrato_row[0]
 
-    criadas = []
-    for i in range(meses):
-        venc = add_months(data_inicio, i)
-        conta = ContaReceber(contrato_id=contrato_id, aluno_id=aluno_id, vencimento=venc, valor=valor, status="aberto")
-        db.add(conta)
-        criadas.append(venc.strftime("%d/%m/%Y"))
+    vencimentos = [add_months(data_inicio, i) for i in range(meses)]
+    await inserir_em_lote(
+        db,
+        ContaReceber,
+        [
+            {"contrato_id": contrato_id, "aluno_id": aluno_id, "vencimento": venc, "valor": valor, "status": "aberto"}
+            for venc in vencimentos
+        ],
+    )
+    criadas = [venc.strftime("%d/%m/%Y") for venc in vencimentos]
 
     await db.commit()
     return {
@@ -804,7 +974,14 @@ async def deletar_contrato(aluno_id: int, contrato_id: int, db: AsyncSession = D
 
 
 @router.post("/{aluno_id}/contratos/{contrato_id}/reservas")
-async def criar_reservas_contrato(aluno_id: int, contrato_id: int, payload: dict, db: AsyncSession = Depends(get_db)):
+async def criar_reservas_contrato(
+    aluno_id: int, contrato_id: int, payload: dict, db: AsyncSession = Depends(get_db), assincrono: bool = False
+):
+    if assincrono:
+        job_id = await enfileirar_job(
+            db, "alunos.reservas_contrato", {"aluno_id": aluno_id, "contrato_id": contrato_id, "payload": payload}
+        )
+        return resposta_job(job_id)
     await ensure_contracts_table(db)
     await ensure_contract_links(db)
     await ensure_bloqueios_table(db)
@@ -960,6 +1137,11 @@ async def criar_reservas_contrato(aluno_id: int, contrato_id: int, payload: dict
     return {"ok": True, "aulas_criadas": aulas_criadas, "aulas_removidas": aulas_removidas, "conflitos": conflitos}
 
 
+@registrar_job("alunos.reservas_contrato")
+async def _job_reservas_contrato(db: AsyncSession, dados: dict):
+    return await criar_reservas_contrato(int(dados["aluno_id"]), int(dados["contrato_id"]), dados.get("payload") or {}, db=db)
+
+
 @router.get("/{aluno_id}/aulas-avulsas/disponibilidade")
 async def disponibilidade_aula_avulsa(
     aluno_id: int,
@@ -1238,8 +1420,7 @@ async def atualizar_status_aula(aluno_id: int, aula_id: int, payload: dict, db:
     - cancelada
     """
     status = (payload.get("status") or "").strip().lower()
-    allowed = {"realizada", "falta_aviso", "falta", "agendada", "cancelada"}
-    if status not in allowed:
+    if status not in STATUS_AULA_PERMITIDOS:
         raise HTTPException(status_code=400, detail="Status invalido")
 
     aula = await db.scalar(select(Aula).where(Aula.id == aula_id, Aula.aluno_id == aluno_id))
@@ -1294,9 +1475,18 @@ async def alterar_vencimento_conta(aluno_id: int, conta_id: int, payload: dict,
         data_venc = datetime.strptime(data_txt, "%Y-%m-%d").date()
     except Exception:
         raise HTTPException(status_code=400, detail="Formato de data invalido")
+    await ensure_finance_columns(db)
+    # Remarcar o vencimento ja atualiza a marcacao de atraso (senao so no proximo job noturno).
     res = await db.execute(
-        text("UPDATE contas_receber SET vencimento = :venc WHERE id = :id AND aluno_id = :aluno_id"),
-        {"venc": data_venc, "id": conta_id, "aluno_id": aluno_id},
+        text(
+            """
+            UPDATE contas_receber
+            SET vencimento = :venc,
+                em_atraso = (LOWER(COALESCE(status, 'aberto')) = 'aberto' AND CAST(:venc AS DATE) < CAST(:hoje AS DATE))
+            WHERE id = :id AND aluno_id = :aluno_id
+            """
+        ),
+        {"venc": data_venc, "hoje": date.today(), "id": conta_id, "aluno_id": aluno_id},
     )
     await db.commit()
     if res.rowcount == 0:
@@ -1316,6 +1506,7 @@ async def excluir_lancamento_financeiro(aluno_id: int, conta_id: int, db: AsyncS
 @router.post("/{aluno_id}/financeiro/{conta_id}/pagar")
 async def pagar_lancamento_financeiro(aluno_id: int, conta_id: int, payload: dict, db: AsyncSession = Depends(get_db)):
     await ensure_finance_columns(db)
+    await ensure_ledger_schema(db)
     data_pagamento_txt = payload.get("data_pagamento") or date.today().strftime("%Y-%m-%d")
     conta_bancaria_id = payload.get("conta_bancaria_id")
     try:
@@ -1357,11 +1548,12 @@ async def pagar_lancamento_financeiro(aluno_id: int, conta_id: int, payload: dic
                 categoria = p[0]
                 subcategoria = p[1]
 
+    descricao_movimento = f"{row[3]} + {plano_nome}"
     await db.execute(
         text(
             """
             UPDATE contas_receber
-            SET status = 'pago', data_pagamento = :data_pagamento, conta_bancaria_id = :conta_bancaria_id
+            SET status = 'pago', data_pagamento = :data_pagamento, conta_bancaria_id = :conta_bancaria_id, em_atraso = FALSE
             WHERE id = :id AND aluno_id = :aluno_id
             """
         ),
@@ -1373,23 +1565,22 @@ async def pagar_lancamento_financeiro(aluno_id: int, conta_id: int, payload: dic
         },
     )
 
-    if conta_bancaria_id:
-        await db.execute(
-            text("UPDATE contas_bancarias SET saldo = COALESCE(saldo, 0) + :valor WHERE id = :id"),
-            {"valor": float(row[1] or 0), "id": int(conta_bancaria_id)},
-        )
+    if not categoria:
+        categoria, subcategoria = await categorizar(db, descricao_movimento)
 
+    # Saldo bancario e derivado do razao: basta o movimento referenciar a conta.
     await db.execute(
         text(
             """
-            INSERT INTO movimentos_bancarios (data_movimento, tipo, valor, descricao, categoria, subcategoria, created_at, updated_at)
-            VALUES (:data_movimento, 'entrada', :valor, :descricao, :categoria, :subcategoria, NOW(), NOW())
+            INSERT INTO movimentos_bancarios (data_movimento, tipo, valor, descricao, categoria, subcategoria, conta_bancaria_id, created_at, updated_at)
+            VALUES (:data_movimento, 'entrada', :valor, :descricao, :categoria, :subcategoria, :conta_bancaria_id, NOW(), NOW())
             """
         ),
         {
+            "conta_bancaria_id": int(conta_bancaria_id) if conta_bancaria_id else None,
             "data_movimento": data_pagamento,
             "valor": float(row[1] or 0),
-            "descricao": f"{row[3]} + {plano_nome}",
+            "descricao": descricao_movimento,
             "categoria": categoria,
             "subcategoria": subcategoria,
         },
@@ -1,44 +1,82 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime
+
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.session import get_db
+from app.api.v1.endpoints.alunos import ensure_contracts_table
+from app.api.v1.endpoints.contas_pagar import ensure_contas_pagar_columns
+from app.api.v1.endpoints.planos import ensure_planos_table
+from app.services.conciliacao_service import (
+    ADVISORY_EXTRATO,
+    conciliar,
+    ensure_extrato_linhas_table,
+    identificar_linhas,
+    parse_csv,
+    parse_ofx,
+    registrar_linhas,
+    separar_ja_importadas,
+)
+from app.services.finance_service import (
+    ensure_contas_bancarias_table,
+    ensure_contas_receber_columns,
+    ensure_movimentos_columns,
+    liquidar_contas_pagar,
+    liquidar_contas_receber,
+    listar_movimentos,
+)
+from app.services.ledger_service import ensure_ledger_schema, gerar_checkpoints, saldos_em
 
 router = APIRouter(tags=["bancario"])
 
 
-async def ensure_contas_bancarias_table(db: AsyncSession):
-    await db.execute(
-        text(
-            """
-            CREATE TABLE IF NOT EXISTS contas_bancarias (
-              id SERIAL PRIMARY KEY,
-              nome_conta VARCHAR(120) NOT NULL,
-              banco VARCHAR(120) NOT NULL,
-              agencia VARCHAR(40) NOT NULL,
-              cc VARCHAR(40) NOT NULL,
-              saldo NUMERIC(12,2) NOT NULL DEFAULT 0
-            )
-            """
-        )
-    )
-    await db.commit()
-
-
 @router.get("/contas-bancarias")
 async def listar_contas_bancarias(db: AsyncSession = Depends(get_db)):
-    await ensure_contas_bancarias_table(db)
+    await ensure_ledger_schema(db)
     rows = (
         await db.execute(
-            text("SELECT id, nome_conta, banco, agencia, cc, saldo FROM contas_bancarias ORDER BY id DESC")
+            text("SELECT id, nome_conta, banco, agencia, cc, saldo_abertura FROM contas_bancarias ORDER BY id DESC")
         )
     ).all()
+    saldos = await saldos_em(db, date.today())
     return [
-        {"id": r[0], "nome_conta": r[1], "banco": r[2], "agencia": r[3], "cc": r[4], "saldo": float(r[5] or 0)}
+        {
+            "id": r[0],
+            "nome_conta": r[1],
+            "banco": r[2],
+            "agencia": r[3],
+            "cc": r[4],
+            "saldo": saldos.get(r[0], {}).get("saldo", float(r[5] or 0)),
+            "saldo_abertura": float(r[5] or 0),
+        }
         for r in rows
     ]
 
 
+@router.get("/contas-bancarias/{conta_id}/saldo")
+async def saldo_conta_bancaria(conta_id: int, data: date | None = None, db: AsyncSession = Depends(get_db)):
+    await ensure_ledger_schema(db)
+    data_ref = data or date.today()
+    saldo = (await saldos_em(db, data_ref, conta_bancaria_id=conta_id)).get(conta_id)
+    if saldo is None:
+        raise HTTPException(status_code=404, detail="Conta bancaria nao encontrada")
+    return {"conta_bancaria_id": conta_id, "data": data_ref.strftime("%Y-%m-%d"), **saldo}
+
+
+@router.post("/contas-bancarias/checkpoints")
+async def gerar_checkpoints_saldo(payload: dict | None = None, db: AsyncSession = Depends(get_db)):
+    await ensure_ledger_schema(db)
+    data_txt = (payload or {}).get("data")
+    try:
+        data_ref = datetime.strptime(data_txt, "%Y-%m-%d").date() if data_txt else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="Data invalida. Use YYYY-MM-DD")
+    total = await gerar_checkpoints(db, data_ref)
+    await db.commit()
+    return {"ok": True, "checkpoints": total}
+
+
 @router.post("/contas-bancarias")
 async def criar_conta_bancaria(payload: dict, db: AsyncSession = Depends(get_db)):
     await ensure_contas_bancarias_table(db)
@@ -48,16 +86,20 @@ async def criar_conta_bancaria(payload: dict, db: AsyncSession = Depends(get_db)
     cc = (payload.get("cc") or "").strip()
     if not (nome and banco and agencia and cc):
         raise HTTPException(status_code=400, detail="Preencha nome da conta, banco, agencia e CC")
+    try:
+        saldo_abertura = float(payload.get("saldo_inicial") or 0)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Saldo inicial invalido")
     row = (
         await db.execute(
             text(
                 """
-                INSERT INTO contas_bancarias (nome_conta, banco, agencia, cc, saldo)
-                VALUES (:nome, :banco, :agencia, :cc, 0)
+                INSERT INTO contas_bancarias (nome_conta, banco, agencia, cc, saldo_abertura)
+                VALUES (:nome, :banco, :agencia, :cc, :saldo_abertura)
                 RETURNING id
                 """
             ),
-            {"nome": nome, "banco": banco, "agencia": agencia, "cc": cc},
+            {"nome": nome, "banco": banco, "agencia": agencia, "cc": cc, "saldo_abertura": saldo_abertura},
         )
     ).first()
     await db.commit()
@@ -99,30 +141,128 @@ async def excluir_conta_bancaria(conta_id: int, db: AsyncSession = Depends(get_d
     return {"ok": True}
 
 
-@router.get("/movimentacoes-financeiras")
-async def listar_movimentacoes_financeiras(db: AsyncSession = Depends(get_db)):
-    rows = (
-        await db.execute(
-            text(
-                """
-                SELECT id, data_movimento, tipo, valor, descricao
-                     , categoria, subcategoria
-                FROM movimentos_bancarios
-                ORDER BY data_movimento DESC, id DESC
-                LIMIT 300
-                """
-            )
+@router.post("/contas-bancarias/{conta_id}/extratos")
+async def importar_extrato(
+    conta_id: int,
+    arquivo: UploadFile = File(...),
+    formato: str | None = Form(default=None),
+    janela_dias: int = Form(default=5),
+    simular: bool = Form(default=False),
+    ignorar: str | None = Form(default=None),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Importa extrato (OFX ou CSV) e concilia com contas a receber/pagar em aberto.
+    Com simular=true apenas retorna o casamento proposto, sem liquidar.
+    Linhas ja importadas nesta conta (mesmo FITID, ou mesmo hash no CSV) voltam em "duplicadas".
+    So ficam gravadas como importadas as linhas que liquidaram uma conta e as listadas em
+    ignorar (fitids separados por virgula, ex.: tarifas vindas em "nao_conciliadas"); as demais
+    podem casar numa reimportacao depois que a conta for lancada.
+    """
+    await ensure_ledger_schema(db)
+    await ensure_contas_receber_columns(db)
+    await ensure_contas_pagar_columns(db)
+    await ensure_contracts_table(db)
+    await ensure_planos_table(db)
+    await ensure_extrato_linhas_table(db)
+    existe = (await db.execute(text("SELECT 1 FROM contas_bancarias WHERE id = :id"), {"id": conta_id})).first()
+    if not existe:
+        raise HTTPException(status_code=404, detail="Conta bancaria nao encontrada")
+
+    fmt = (formato or "").strip().lower() or ("ofx" if (arquivo.filename or "").lower().endswith(".ofx") else "csv")
+    if fmt not in ("ofx", "csv"):
+        raise HTTPException(status_code=400, detail="Formato deve ser ofx ou csv")
+    parser = parse_ofx if fmt == "ofx" else parse_csv
+    linhas = [linha async for linha in parser(arquivo)]
+    identificar_linhas(linhas)
+    if not simular:
+        # Ate o commit: outra importacao da mesma conta espera e ja ve as linhas registradas aqui.
+        await db.execute(text("SELECT pg_advisory_xact_lock(:classe, :conta)"), {"classe": ADVISORY_EXTRATO, "conta": conta_id})
+    novas, duplicadas = await separar_ja_importadas(db, conta_id, linhas)
+    fitids_ignorar = {f.strip() for f in (ignorar or "").split(",") if f.strip()}
+    ignoradas = [l for l in novas if l.fitid in fitids_ignorar]
+    novas = [l for l in novas if l.fitid not in fitids_ignorar]
+
+    resultado = await conciliar(db, novas, janela_dias=max(0, min(janela_dias, 30)))
+    liquidacao_receber = {"liquidadas": [], "ignoradas": [], "total": 0.0}
+    liquidacao_pagar = {"liquidadas": [], "ignoradas": [], "total": 0.0}
+    if not simular:
+        liquidacao_receber = await liquidar_contas_receber(
+            db, [{**m, "conta_bancaria_id": conta_id} for m in resultado["receber"]]
         )
-    ).all()
-    return [
-        {
-            "id": r[0],
-            "data_movimento": r[1].strftime("%d/%m/%Y") if r[1] else "--",
-            "tipo": r[2],
-            "valor": float(r[3] or 0),
-            "descricao": r[4] or "",
-            "categoria": r[5] or "",
-            "subcategoria": r[6] or "",
+        liquidacao_pagar = await liquidar_contas_pagar(db, [{**m, "conta_bancaria_id": conta_id} for m in resultado["pagar"]])
+        liquidadas = {("receber", c) for c in liquidacao_receber["liquidadas"]} | {
+            ("pagar", c) for c in liquidacao_pagar["liquidadas"]
         }
-        for r in rows
-    ]
+        fitids_liquidados = {
+            m["fitid"]
+            for tipo in ("receber", "pagar")
+            for m in resultado[tipo]
+            if (tipo, m["conta_id"]) in liquidadas
+        }
+        await registrar_linhas(db, conta_id, ignoradas + [l for l in novas if l.fitid in fitids_liquidados])
+        await db.commit()
+
+    for m in resultado["receber"] + resultado["pagar"]:
+        m.pop("data_pagamento", None)
+    return {
+        "ok": True,
+        "simulacao": simular,
+        "linhas": len(linhas),
+        "duplicadas": [
+            {"data": l.data.strftime("%Y-%m-%d"), "valor": l.valor, "descricao": l.descricao, "fitid": l.fitid}
+            for l in duplicadas
+        ],
+        "receber": resultado["receber"],
+        "pagar": resultado["pagar"],
+        "nao_conciliadas": resultado["nao_conciliadas"],
+        "ignoradas": [
+            {"data": l.data.strftime("%Y-%m-%d"), "valor": l.valor, "descricao": l.descricao, "fitid": l.fitid}
+            for l in ignoradas
+        ],
+        "liquidacao": {"receber": liquidacao_receber, "pagar": liquidacao_pagar},
+    }
+
+
+@router.get("/movimentacoes-financeiras")
+async def listar_movimentacoes_financeiras(
+    tipo: str | None = Query(default=None, description="entrada/saida"),
+    categoria: str | None = None,
+    data_inicio: date | None = None,
+    data_fim: date | None = None,
+    cursor: str | None = Query(default=None, description="next_cursor da pagina anterior"),
+    limit: int = Query(default=50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    return await listar_movimentos(
+        db, tipo=tipo, categoria=categoria, data_inicio=data_inicio, data_fim=data_fim, cursor=cursor, limit=limit
+    )
+
+
+@router.get("/movimentacoes-financeiras/saldo-inicial")
+async def obter_saldo_inicial(db: AsyncSession = Depends(get_db)):
+    """Saldo inicial dos movimentos sem conta bancaria; o das contas e o saldo_abertura de cada uma."""
+    await ensure_movimentos_columns(db)
+    valor = await db.scalar(text("SELECT valor FROM movimentos_saldo_inicial WHERE id = 1"))
+    return {"valor": float(valor or 0)}
+
+
+@router.put("/movimentacoes-financeiras/saldo-inicial")
+async def definir_saldo_inicial(payload: dict, db: AsyncSession = Depends(get_db)):
+    await ensure_movimentos_columns(db)
+    try:
+        valor = float(payload.get("valor") or 0)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Valor invalido")
+    await db.execute(
+        text(
+            """
+            INSERT INTO movimentos_saldo_inicial (id, valor, updated_at)
+            VALUES (1, :valor, NOW())
+            ON CONFLICT (id) DO UPDATE SET valor = excluded.valor, updated_at = NOW()
+            """
+        ),
+        {"valor": valor},
+    )
+    await db.commit()
+    return {"ok": True, "valor": valor}
@@ -0,0 +1,109 @@
+import asyncio
+import json
+from urllib.parse import urlencode
+
+from fastapi import APIRouter, HTTPException, Request
+
+router = APIRouter(tags=["batch"])
+
+MAX_SUBREQUESTS = 20
+# Sub-requests simultaneas; cada uma pega sua conexao do pool.
+CONCORRENCIA = 6
+METODOS = {"GET", "POST", "PUT", "PATCH", "DELETE"}
+# Cabecalhos do request de lote repassados a cada sub-request (autenticacao compartilhada).
+CABECALHOS_COMPARTILHADOS = {b"authorization", b"cookie", b"accept-language", b"user-agent"}
+# Cabecalhos que o cliente pode mandar por sub-request (ex.: revalidar pelo ETag).
+CABECALHOS_POR_ITEM = {"if-none-match", "if-modified-since"}
+
+
+async def _executar(request: Request, item: dict, semaforo: asyncio.Semaphore) -> dict:
+    ident = item.get("id")
+    metodo = (item.get("method") or "GET").upper()
+    caminho = item.get("path") or ""
+    if metodo not in METODOS:
+        return {"id": ident, "status": 400, "body": {"detail": "Metodo invalido"}}
+    if not caminho.startswith("/api/v1/") or caminho.startswith("/api/v1/batch") or "?" in caminho:
+        return {"id": ident, "status": 400, "body": {"detail": "Path invalido (use /api/v1/... e query em 'query')"}}
+    if caminho.startswith("/api/v1/agenda/eventos"):
+        return {"id": ident, "status": 400, "body": {"detail": "Stream nao suportado em lote"}}
+
+    corpo = json.dumps(item["body"]).encode() if item.get("body") is not None else b""
+    headers = [(k, v) for k, v in request.scope["headers"] if k in CABECALHOS_COMPARTILHADOS]
+    headers += [(k.lower().encode(), str(v).encode()) for k, v in (item.get("headers") or {}).items() if k.lower() in CABECALHOS_POR_ITEM]
+    if corpo:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(corpo)).encode())]
+    scope = {
+        **request.scope,
+        "method": metodo,
+        "path": caminho,
+        "raw_path": caminho.encode(),
+        "query_string": urlencode(item.get("query") or {}, doseq=True).encode(),
+        "headers": headers,
+    }
+    for chave in ("route", "endpoint", "path_params", "router", "state"):
+        scope.pop(chave, None)
+
+    enviado = False
+    terminou = asyncio.Event()
+    inicio: dict = {}
+    partes: list[bytes] = []
+
+    async def receive():
+        nonlocal enviado
+        if not enviado:
+            enviado = True
+            return {"type": "http.request", "body": corpo, "more_body": False}
+        # O "cliente" so desconecta depois que a resposta acabou.
+        await terminou.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(mensagem):
+        if mensagem["type"] == "http.response.start":
+            inicio.update(mensagem)
+        elif mensagem["type"] == "http.response.body":
+            partes.append(mensagem.get("body", b""))
+            if not mensagem.get("more_body"):
+                terminou.set()
+
+    async with semaforo:
+        try:
+            await request.app(scope, receive, send)
+        except Exception as exc:
+            return {"id": ident, "status": 500, "body": {"detail": f"{type(exc).__name__}: {exc}"}}
+        finally:
+            terminou.set()
+
+    resposta_headers = {k.decode().lower(): v.decode() for k, v in inicio.get("headers", [])}
+    conteudo = b"".join(partes)
+    body = conteudo.decode(errors="replace") if conteudo else None
+    if body and resposta_headers.get("content-type", "").startswith("application/json"):
+        body = json.loads(body)
+    return {
+        "id": ident,
+        "status": inicio.get("status", 500),
+        "headers": {k: v for k, v in resposta_headers.items() if k in ("etag", "last-modified", "location", "content-type")},
+        "body": body,
+    }
+
+
+@router.post("/batch")
+async def batch(payload: dict, request: Request):
+    """
+    Executa varias chamadas da API numa ida so, em paralelo e dentro do proprio processo.
+
+    Body: {"requests": [{"id": "ficha", "method": "GET", "path": "/api/v1/alunos/3/ficha",
+                         "query": {...}, "body": {...}, "headers": {"If-None-Match": "..."}}, ...]}
+    Cada item passa pela app inteira (rotas, dependencias, middlewares) com o Authorization do
+    request de lote. Resposta: {"responses": [{"id", "status", "headers", "body"}, ...]}, na mesma
+    ordem; falha de um item nao derruba os outros. Itens nao sao transacionais entre si.
+    """
+    itens = payload.get("requests")
+    if not isinstance(itens, list) or not itens:
+        raise HTTPException(status_code=400, detail="Informe requests")
+    if len(itens) > MAX_SUBREQUESTS:
+        raise HTTPException(status_code=400, detail=f"Maximo de {MAX_SUBREQUESTS} requests por lote")
+    if not all(isinstance(item, dict) for item in itens):
+        raise HTTPException(status_code=400, detail="Cada request deve ser um objeto")
+    semaforo = asyncio.Semaphore(CONCORRENCIA)
+    respostas = await asyncio.gather(*(_executar(request, item, semaforo) for item in itens))
+    return {"responses": respostas}
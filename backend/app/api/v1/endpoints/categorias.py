@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.session import get_db
+from app.services.versoes_service import checar_condicional
 
 router = APIRouter(tags=["categorias"])
 
@@ -36,7 +37,11 @@ async def ensure_categorias_tables(db: AsyncSession):
 
 
 @router.get("/categorias")
-async def listar_categorias(db: AsyncSession = Depends(get_db)):
+async def listar_categorias(request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    headers, nao_modificada = await checar_condicional(request, "categorias")
+    if nao_modificada:
+        return nao_modificada
+    response.headers.update(headers)
     await ensure_categorias_tables(db)
     rows = (
         await db.execute(
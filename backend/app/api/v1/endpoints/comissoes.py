@@ -8,6 +8,7 @@ from app.db.session import get_db
 from app.models.entities import Aula, RegraComissao, ContaPagar, Profissional, Usuario
 from app.api.v1.endpoints.contas_pagar import ensure_contas_pagar_columns
 from app.api.v1.endpoints.regras_comissao import ensure_regras_comissao_columns
+from app.services.jobs_service import enfileirar_job, registrar_job, resposta_job
 
 router = APIRouter(prefix="/comissoes", tags=["comissoes"])
 
@@ -35,7 +36,9 @@ def parse_ym(s: str) -> tuple[date, date]:
 
 
 @router.post("/gerar-contas-pagar")
-async def gerar_contas_pagar_comissao(payload: dict, db: AsyncSession = Depends(get_db)):
+async def gerar_contas_pagar_comissao(payload: dict, db: AsyncSession = Depends(get_db), assincrono: bool = False):
+    if assincrono:
+        return resposta_job(await enfileirar_job(db, "comissoes.gerar_contas_pagar", payload))
     await ensure_regras_comissao_columns(db)
     await ensure_contas_pagar_columns(db)
 
@@ -133,3 +136,8 @@ async def gerar_contas_pagar_comissao(payload: dict, db: AsyncSession = Depends(
     await db.commit()
     return {"ok": True, "mes_referencia": str(mes_ref), "vencimento": vencimento.strftime("%Y-%m-%d"), "criadas": criadas, "ignoradas": ignoradas}
 
+
+
+@registrar_job("comissoes.gerar_contas_pagar")
+async def _job_gerar_contas_pagar(db: AsyncSession, payload: dict):
+    return await gerar_contas_pagar_comissao(payload, db=db)
@@ -1,11 +1,13 @@
 from datetime import date, datetime
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, text
+from sqlalchemy import text
 
 from app.db.session import get_db
 from app.models.entities import ContaPagar
+from app.services.bulk_service import inserir_em_lote
+from app.services.pagination import decode_cursor, encode_cursor
 
 router = APIRouter(prefix="/contas-pagar", tags=["contas-pagar"])
 
@@ -56,6 +58,10 @@ async def ensure_contas_pagar_columns(db: AsyncSession):
             """
         )
     )
+    await db.execute(text("CREATE INDEX IF NOT EXISTS ix_contas_pagar_vencimento_id ON contas_pagar (vencimento, id)"))
+    await db.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_contas_pagar_profissional_ref ON contas_pagar (profissional_id, referencia_mes)")
+    )
     await db.commit()
 
 
@@ -71,24 +77,116 @@ def add_months(d: date, months: int) -> date:
 
 
 @router.get("")
-async def listar_contas_pagar(db: AsyncSession = Depends(get_db)):
+async def listar_contas_pagar(
+    data_inicio: date | None = Query(default=None, description="Vencimento a partir de (YYYY-MM-DD)"),
+    data_fim: date | None = Query(default=None, description="Vencimento ate (YYYY-MM-DD)"),
+    status: str | None = Query(default=None, description="Filtra por status: aberto/pago"),
+    categoria: str | None = None,
+    profissional_id: int | None = None,
+    referencia_mes: str | None = Query(default=None, description="YYYY-MM"),
+    cursor: str | None = Query(default=None, description="next_cursor da pagina anterior"),
+    limit: int = Query(default=50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
     await ensure_contas_pagar_columns(db)
-    rows = (await db.execute(select(ContaPagar).order_by(ContaPagar.vencimento.desc(), ContaPagar.id.desc()))).scalars().all()
-    return [
-        {
-            "id": r.id,
-            "descricao": r.descricao,
-            "valor": float(r.valor or 0),
-            "vencimento": r.vencimento.strftime("%Y-%m-%d") if r.vencimento else None,
-            "vencimento_br": r.vencimento.strftime("%d/%m/%Y") if r.vencimento else "--",
-            "categoria": getattr(r, "categoria", None),
-            "subcategoria": getattr(r, "subcategoria", None),
-            "status": getattr(r, "status", "aberto"),
-            "data_pagamento": r.data_pagamento.strftime("%Y-%m-%d") if getattr(r, "data_pagamento", None) else None,
-            "data_pagamento_br": r.data_pagamento.strftime("%d/%m/%Y") if getattr(r, "data_pagamento", None) else None,
-        }
-        for r in rows
-    ]
+    filtros = ""
+    params: dict[str, object] = {}
+    if data_inicio:
+        filtros += " AND cp.vencimento >= :data_inicio "
+        params["data_inicio"] = data_inicio
+    if data_fim:
+        filtros += " AND cp.vencimento <= :data_fim "
+        params["data_fim"] = data_fim
+    if status:
+        filtros += " AND LOWER(COALESCE(cp.status, 'aberto')) = LOWER(:status) "
+        params["status"] = status
+    if categoria:
+        filtros += " AND cp.categoria = :categoria "
+        params["categoria"] = categoria
+    if profissional_id:
+        filtros += " AND cp.profissional_id = :profissional_id "
+        params["profissional_id"] = profissional_id
+    if referencia_mes:
+        filtros += " AND cp.referencia_mes = :referencia_mes "
+        params["referencia_mes"] = referencia_mes
+
+    keyset = ""
+    page_params = dict(params, limit=limit + 1)
+    if cursor:
+        cursor_venc, cursor_id = decode_cursor(cursor, date, int)
+        keyset = " AND (cp.vencimento, cp.id) < (:cursor_venc, :cursor_id) "
+        page_params["cursor_venc"] = cursor_venc
+        page_params["cursor_id"] = cursor_id
+
+    rows = (
+        await db.execute(
+            text(
+                f"""
+                SELECT cp.id, cp.descricao, cp.valor, cp.vencimento, cp.categoria, cp.subcategoria,
+                       COALESCE(cp.status, 'aberto') AS status, cp.data_pagamento
+                FROM contas_pagar cp
+                WHERE 1=1
+                {filtros}
+                {keyset}
+                ORDER BY cp.vencimento DESC, cp.id DESC
+                LIMIT :limit
+                """
+            ),
+            page_params,
+        )
+    ).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
+
+    # Um unico agregado com GROUPING SETS devolve os totais por categoria e por status.
+    totais_rows = (
+        await db.execute(
+            text(
+                f"""
+                SELECT GROUPING(cp.categoria) AS g_categoria,
+                       COALESCE(cp.categoria, 'Sem categoria') AS categoria,
+                       LOWER(COALESCE(cp.status, 'aberto')) AS status,
+                       COALESCE(SUM(cp.valor), 0) AS total,
+                       COUNT(*) AS quantidade
+                FROM contas_pagar cp
+                WHERE 1=1
+                {filtros}
+                GROUP BY GROUPING SETS ((cp.categoria), (LOWER(COALESCE(cp.status, 'aberto'))))
+                ORDER BY total DESC
+                """
+            ),
+            params,
+        )
+    ).all()
+
+    return {
+        "items": [
+            {
+                "id": r[0],
+                "descricao": r[1],
+                "valor": float(r[2] or 0),
+                "vencimento": r[3].strftime("%Y-%m-%d") if r[3] else None,
+                "vencimento_br": r[3].strftime("%d/%m/%Y") if r[3] else "--",
+                "categoria": r[4],
+                "subcategoria": r[5],
+                "status": r[6],
+                "data_pagamento": r[7].strftime("%Y-%m-%d") if r[7] else None,
+                "data_pagamento_br": r[7].strftime("%d/%m/%Y") if r[7] else None,
+            }
+            for r in rows
+        ],
+        "next_cursor": next_cursor,
+        "totais": {
+            "por_categoria": [
+                {"categoria": t[1], "total": float(t[3] or 0), "quantidade": int(t[4] or 0)} for t in totais_rows if t[0] == 0
+            ],
+            "por_status": [
+                {"status": t[2], "total": float(t[3] or 0), "quantidade": int(t[4] or 0)} for t in totais_rows if t[0] == 1
+            ],
+        },
+    }
 
 
 @router.post("")
@@ -117,19 +215,21 @@ async def criar_conta_pagar(payload: dict, db: AsyncSession = Depends(get_db)):
     qtd = int(payload.get("quantidade_recorrencias") or payload.get("qtd_recorrencias") or 1)
     if recorrencia in ("mensal", "monthly"):
         qtd = max(1, min(qtd, 60))
-        ids: list[int] = []
-        for i in range(qtd):
-            row = ContaPagar(
-                descricao=descricao,
-                valor=valor,
-                vencimento=add_months(venc, i),
-                categoria=categoria,
-                subcategoria=subcategoria,
-                status="aberto",
-            )
-            db.add(row)
-            await db.flush()
-            ids.append(row.id)
+        ids = await inserir_em_lote(
+            db,
+            ContaPagar,
+            [
+                {
+                    "descricao": descricao,
+                    "valor": valor,
+                    "vencimento": add_months(venc, i),
+                    "categoria": categoria,
+                    "subcategoria": subcategoria,
+                    "status": "aberto",
+                }
+                for i in range(qtd)
+            ],
+        )
         await db.commit()
         return {"ok": True, "ids": ids, "criadas": len(ids)}
 
@@ -1,34 +1,33 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from datetime import date, datetime
 
 from app.db.session import get_db
+from app.api.v1.endpoints.alunos import (
+    ensure_contracts_table,
+    ensure_details_table,
+    ensure_finance_columns as ensure_alunos_finance_columns,
+)
+from app.api.v1.endpoints.planos import ensure_planos_table
+from app.services.categorizacao_service import categorizar
+from app.services.finance_service import (
+    ensure_contas_receber_columns,
+    liquidar_contas_receber,
+    marcar_contas_vencidas,
+)
+from app.services.ledger_service import ensure_ledger_schema
+from app.services.pagination import decode_cursor, encode_cursor
 
 router = APIRouter(prefix="/contas-receber", tags=["contas-receber"])
 
 async def ensure_finance_columns(db: AsyncSession):
-    # Keep in sync with alunos.ensure_finance_columns (minimal subset used here).
+    # Colunas (data_pagamento, conta_bancaria_id, em_atraso) e saldo_devedor ficam em finance_service.
+    await ensure_contas_receber_columns(db)
+    # Indices da listagem paginada por (vencimento, id), geral e por aluno.
+    await db.execute(text("CREATE INDEX IF NOT EXISTS ix_contas_receber_vencimento_id ON contas_receber (vencimento, id)"))
     await db.execute(
-        text(
-            """
-            DO $$
-            BEGIN
-              IF NOT EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name = 'contas_receber' AND column_name = 'data_pagamento'
-              ) THEN
-                ALTER TABLE contas_receber ADD COLUMN data_pagamento DATE;
-              END IF;
-              IF NOT EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name = 'contas_receber' AND column_name = 'conta_bancaria_id'
-              ) THEN
-                ALTER TABLE contas_receber ADD COLUMN conta_bancaria_id INTEGER;
-              END IF;
-            END $$;
-            """
-        )
+        text("CREATE INDEX IF NOT EXISTS ix_contas_receber_aluno_vencimento_id ON contas_receber (aluno_id, vencimento, id)")
     )
     await db.commit()
 
@@ -36,61 +35,281 @@ async def ensure_finance_columns(db: AsyncSession):
 @router.get("")
 async def listar_contas_receber(
     status: str | None = Query(default=None, description="Filtra por status: aberto/pago"),
+    data_inicio: date | None = Query(default=None, description="Vencimento a partir de (YYYY-MM-DD)"),
+    data_fim: date | None = Query(default=None, description="Vencimento ate (YYYY-MM-DD)"),
+    aluno_id: int | None = None,
+    contrato_id: int | None = None,
+    unidade_id: int | None = Query(default=None, description="Unidade do cadastro do aluno"),
+    cursor: str | None = Query(default=None, description="next_cursor da pagina anterior"),
+    limit: int = Query(default=50, ge=1, le=500),
     db: AsyncSession = Depends(get_db),
 ):
     await ensure_finance_columns(db)
-    where_status = ""
-    params: dict[str, object] = {}
+    # Monta os filtros dinamicamente: ":param IS NULL" em SQL raw gera AmbiguousParameterError no asyncpg.
+    filtros = ""
+    params: dict[str, object] = {"limit": limit + 1}
     if status:
-        where_status = " AND LOWER(COALESCE(cr.status, 'aberto')) = LOWER(:status) "
-        params["status"] = status
+        # status e gravado normalizado (trigger em finance_service): compara a coluna direto.
+        filtros += " AND cr.status = :status "
+        params["status"] = status.strip().lower()
+    if data_inicio:
+        filtros += " AND cr.vencimento >= :data_inicio "
+        params["data_inicio"] = data_inicio
+    if data_fim:
+        filtros += " AND cr.vencimento <= :data_fim "
+        params["data_fim"] = data_fim
+    if aluno_id:
+        filtros += " AND cr.aluno_id = :aluno_id "
+        params["aluno_id"] = aluno_id
+    if contrato_id:
+        filtros += " AND cr.contrato_id = :contrato_id "
+        params["contrato_id"] = contrato_id
+    if unidade_id:
+        await ensure_details_table(db)
+        filtros += " AND EXISTS (SELECT 1 FROM aluno_detalhes d WHERE d.aluno_id = cr.aluno_id AND d.unidade_id = :unidade_id) "
+        params["unidade_id"] = unidade_id
+
+    keyset = ""
+    if cursor:
+        cursor_venc, cursor_id = decode_cursor(cursor, date, int)
+        keyset = " AND (cr.vencimento, cr.id) < (:cursor_venc, :cursor_id) "
+        params["cursor_venc"] = cursor_venc
+        params["cursor_id"] = cursor_id
 
     rows = (
         await db.execute(
             text(
                 f"""
                 SELECT
-                  cr.id,
-                  cr.aluno_id,
+                  p.id,
+                  p.aluno_id,
                   u.nome AS aluno_nome,
-                  cr.contrato_id,
+                  p.contrato_id,
                   COALESCE(c.plano_nome, '') AS plano_nome,
-                  cr.valor,
-                  cr.vencimento,
-                  COALESCE(cr.status, 'aberto') AS status,
-                  cr.data_pagamento
+                  p.valor,
+                  p.vencimento,
+                  p.status,
+                  p.data_pagamento,
+                  p.em_atraso
+                FROM (
+                  SELECT cr.id, cr.aluno_id, cr.contrato_id, cr.valor, cr.vencimento, cr.status, cr.data_pagamento, cr.em_atraso
+                  FROM contas_receber cr
+                  WHERE 1=1
+                  {filtros}
+                  {keyset}
+                  ORDER BY cr.vencimento DESC, cr.id DESC
+                  LIMIT :limit
+                ) p
+                LEFT JOIN alunos a ON a.id = p.aluno_id
+                LEFT JOIN usuarios u ON u.id = a.usuario_id
+                LEFT JOIN aluno_contratos c ON c.id = p.contrato_id
+                ORDER BY p.vencimento DESC, p.id DESC
+                """
+            ),
+            params,
+        )
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][6], rows[-1][0])
+
+    # Totais do filtro inteiro so na primeira pagina; as seguintes nao reagregam tudo.
+    totais = None
+    if not cursor:
+        params.pop("limit")
+        t = (
+            await db.execute(
+                text(
+                    f"""
+                    SELECT
+                      COALESCE(SUM(cr.valor) FILTER (WHERE cr.status = 'aberto'), 0),
+                      COALESCE(SUM(cr.valor) FILTER (WHERE cr.status = 'pago'), 0),
+                      COUNT(*)
+                    FROM contas_receber cr
+                    WHERE 1=1
+                    {filtros}
+                    """
+                ),
+                params,
+            )
+        ).one()
+        totais = {"aberto": float(t[0] or 0), "pago": float(t[1] or 0), "quantidade": int(t[2] or 0)}
+
+    return {
+        "items": [
+            {
+                "id": r[0],
+                "aluno_id": r[1],
+                "aluno_nome": r[2] or "",
+                "contrato_id": r[3],
+                "plano_nome": r[4],
+                "valor": float(r[5] or 0),
+                "vencimento": r[6].strftime("%d/%m/%Y") if r[6] else "--",
+                "status": r[7],
+                "data_pagamento": r[8].strftime("%d/%m/%Y") if r[8] else None,
+                "em_atraso": bool(r[9]),
+            }
+            for r in rows
+        ],
+        "next_cursor": next_cursor,
+        # None a partir da segunda pagina (com cursor).
+        "totais": totais,
+    }
+
+
+@router.get("/por-aluno")
+async def contas_receber_por_aluno(
+    status: str = Query(default="aberto", description="Status das contas agregadas"),
+    unidade_id: int | None = Query(default=None, description="Unidade do cadastro do aluno"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Total, quantidade e proxima conta (vencimento mais antigo) por aluno, agregados no banco
+    sobre todas as contas do status, e nao sobre uma pagina da listagem.
+    """
+    await ensure_finance_columns(db)
+    filtros = ""
+    params: dict[str, object] = {"status": status.strip().lower()}
+    if unidade_id:
+        await ensure_details_table(db)
+        filtros += " AND EXISTS (SELECT 1 FROM aluno_detalhes d WHERE d.aluno_id = cr.aluno_id AND d.unidade_id = :unidade_id) "
+        params["unidade_id"] = unidade_id
+
+    rows = (
+        await db.execute(
+            text(
+                f"""
+                SELECT g.aluno_id, COALESCE(u.nome, '') AS aluno_nome, g.total, g.quantidade,
+                       p.id, p.valor, p.vencimento, p.status, COALESCE(c.plano_nome, '') AS plano_nome
+                FROM (
+                  SELECT cr.aluno_id, SUM(cr.valor) AS total, COUNT(*) AS quantidade
+                  FROM contas_receber cr
+                  WHERE cr.status = :status
+                  {filtros}
+                  GROUP BY cr.aluno_id
+                ) g
+                JOIN LATERAL (
+                  SELECT cr.id, cr.valor, cr.vencimento, cr.status, cr.contrato_id
+                  FROM contas_receber cr
+                  WHERE cr.aluno_id IS NOT DISTINCT FROM g.aluno_id
+                    AND cr.status = :status
+                  ORDER BY cr.vencimento, cr.id
+                  LIMIT 1
+                ) p ON TRUE
+                LEFT JOIN alunos a ON a.id = g.aluno_id
+                LEFT JOIN usuarios u ON u.id = a.usuario_id
+                LEFT JOIN aluno_contratos c ON c.id = p.contrato_id
+                ORDER BY p.vencimento, g.total DESC, g.aluno_id
+                """
+            ),
+            params,
+        )
+    ).all()
+
+    items = []
+    for r in rows:
+        vencimento = r[6].strftime("%d/%m/%Y") if r[6] else "--"
+        items.append(
+            {
+                "aluno_id": r[0],
+                "aluno_nome": r[1],
+                "total": float(r[2] or 0),
+                "qtd": int(r[3] or 0),
+                "proximo_vencimento": vencimento,
+                "proxima_conta": {
+                    "id": r[4],
+                    "aluno_id": r[0],
+                    "aluno_nome": r[1],
+                    "plano_nome": r[8],
+                    "valor": float(r[5] or 0),
+                    "vencimento": vencimento,
+                    "status": r[7],
+                },
+            }
+        )
+    return {"items": items}
+
+
+@router.get("/inadimplencia")
+async def relatorio_inadimplencia(
+    unidade_id: int | None = Query(default=None, description="Unidade do cadastro do aluno"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Aging por aluno das contas marcadas em atraso (em_atraso, mantido pelo job noturno),
+    em faixas de dias de atraso: 0-30, 31-60, 61-90 e 90+. Uma unica passada agregada.
+    """
+    await ensure_contas_receber_columns(db)
+    hoje = date.today()
+    filtros = ""
+    params: dict[str, object] = {"hoje": hoje}
+    if unidade_id:
+        await ensure_details_table(db)
+        filtros += " AND EXISTS (SELECT 1 FROM aluno_detalhes d WHERE d.aluno_id = cr.aluno_id AND d.unidade_id = :unidade_id) "
+        params["unidade_id"] = unidade_id
+
+    rows = (
+        await db.execute(
+            text(
+                f"""
+                SELECT
+                  cr.aluno_id,
+                  COALESCE(u.nome, '') AS aluno_nome,
+                  COUNT(*) AS quantidade,
+                  SUM(cr.valor) AS total,
+                  COALESCE(SUM(cr.valor) FILTER (WHERE CAST(:hoje AS DATE) - cr.vencimento <= 30), 0) AS ate_30,
+                  COALESCE(SUM(cr.valor) FILTER (WHERE CAST(:hoje AS DATE) - cr.vencimento BETWEEN 31 AND 60), 0) AS de_31_60,
+                  COALESCE(SUM(cr.valor) FILTER (WHERE CAST(:hoje AS DATE) - cr.vencimento BETWEEN 61 AND 90), 0) AS de_61_90,
+                  COALESCE(SUM(cr.valor) FILTER (WHERE CAST(:hoje AS DATE) - cr.vencimento > 90), 0) AS acima_90,
+                  MIN(cr.vencimento) AS vencimento_mais_antigo
                 FROM contas_receber cr
-                JOIN alunos a ON a.id = cr.aluno_id
-                JOIN usuarios u ON u.id = a.usuario_id
-                LEFT JOIN aluno_contratos c ON c.id = cr.contrato_id
-                WHERE 1=1
-                {where_status}
-                ORDER BY cr.vencimento DESC, cr.id DESC
+                LEFT JOIN alunos a ON a.id = cr.aluno_id
+                LEFT JOIN usuarios u ON u.id = a.usuario_id
+                WHERE cr.em_atraso
+                {filtros}
+                GROUP BY cr.aluno_id, u.nome
+                ORDER BY total DESC, cr.aluno_id
                 """
             ),
             params,
         )
     ).all()
 
-    return [
-        {
-            "id": r[0],
-            "aluno_id": r[1],
-            "aluno_nome": r[2],
-            "contrato_id": r[3],
-            "plano_nome": r[4],
-            "valor": float(r[5] or 0),
-            "vencimento": r[6].strftime("%d/%m/%Y") if r[6] else "--",
-            "status": r[7],
-            "data_pagamento": r[8].strftime("%d/%m/%Y") if r[8] else None,
-        }
-        for r in rows
-    ]
+    faixas = ("0_30", "31_60", "61_90", "90_mais")
+    totais = {f: 0.0 for f in faixas}
+    totais["total"] = 0.0
+    items = []
+    for r in rows:
+        valores = dict(zip(faixas, (float(r[4] or 0), float(r[5] or 0), float(r[6] or 0), float(r[7] or 0))))
+        for f in faixas:
+            totais[f] += valores[f]
+        totais["total"] += float(r[3] or 0)
+        items.append(
+            {
+                "aluno_id": r[0],
+                "aluno_nome": r[1],
+                "quantidade": int(r[2] or 0),
+                "total": float(r[3] or 0),
+                "faixas": valores,
+                "dias_atraso_max": (hoje - r[8]).days if r[8] else 0,
+            }
+        )
+    return {"items": items, "totais": {k: round(v, 2) for k, v in totais.items()}}
+
+
+@router.post("/marcar-vencidas")
+async def marcar_vencidas(db: AsyncSession = Depends(get_db)):
+    """Recalcula a marcacao em_atraso (mesmo job executado de madrugada)."""
+    await ensure_contas_receber_columns(db)
+    return {"ok": True, **(await marcar_contas_vencidas(db))}
 
 
 @router.post("/{conta_id}/pagar")
 async def pagar_conta_receber(conta_id: int, payload: dict, db: AsyncSession = Depends(get_db)):
     await ensure_finance_columns(db)
+    await ensure_ledger_schema(db)
     data_pagamento_txt = payload.get("data_pagamento") or date.today().strftime("%Y-%m-%d")
     conta_bancaria_id = payload.get("conta_bancaria_id")
     try:
@@ -132,37 +351,85 @@ async def pagar_conta_receber(conta_id: int, payload: dict, db: AsyncSession = D
                 categoria = p[0]
                 subcategoria = p[1]
 
+    descricao_movimento = f"{row[4]} + {plano_nome}"
     await db.execute(
         text(
             """
             UPDATE contas_receber
-            SET status = 'pago', data_pagamento = :data_pagamento, conta_bancaria_id = :conta_bancaria_id
+            SET status = 'pago', data_pagamento = :data_pagamento, conta_bancaria_id = :conta_bancaria_id, em_atraso = FALSE
             WHERE id = :id
             """
         ),
         {"data_pagamento": data_pagamento, "conta_bancaria_id": conta_bancaria_id, "id": conta_id},
     )
 
-    if conta_bancaria_id:
-        await db.execute(
-            text("UPDATE contas_bancarias SET saldo = COALESCE(saldo, 0) + :valor WHERE id = :id"),
-            {"valor": float(row[1] or 0), "id": int(conta_bancaria_id)},
-        )
+    if not categoria:
+        categoria, subcategoria = await categorizar(db, descricao_movimento)
 
+    # Saldo bancario e derivado do razao: basta o movimento referenciar a conta.
     await db.execute(
         text(
             """
-            INSERT INTO movimentos_bancarios (data_movimento, tipo, valor, descricao, categoria, subcategoria, created_at, updated_at)
-            VALUES (:data_movimento, 'entrada', :valor, :descricao, :categoria, :subcategoria, NOW(), NOW())
+            INSERT INTO movimentos_bancarios (data_movimento, tipo, valor, descricao, categoria, subcategoria, conta_bancaria_id, created_at, updated_at)
+            VALUES (:data_movimento, 'entrada', :valor, :descricao, :categoria, :subcategoria, :conta_bancaria_id, NOW(), NOW())
             """
         ),
         {
+            "conta_bancaria_id": int(conta_bancaria_id) if conta_bancaria_id else None,
             "data_movimento": data_pagamento,
             "valor": float(row[1] or 0),
-            "descricao": f"{row[4]} + {plano_nome}",
+            "descricao": descricao_movimento,
             "categoria": categoria,
             "subcategoria": subcategoria,
         },
     )
     await db.commit()
     return {"ok": True}
+
+
+@router.post("/pagar-lote")
+async def pagar_contas_receber_lote(payload: dict, db: AsyncSession = Depends(get_db)):
+    """
+    Liquida varias contas de uma vez, numa transacao.
+
+    Body: {"conta_ids": [1, 2], "data_pagamento": "YYYY-MM-DD", "conta_bancaria_id": 1}
+    ou {"itens": [{"conta_id": 1, "data_pagamento": "...", "conta_bancaria_id": 2}, ...]}
+    (campos do item sobrepoem os do topo).
+    """
+    await ensure_alunos_finance_columns(db)
+    await ensure_contracts_table(db)
+    await ensure_planos_table(db)
+    await ensure_ledger_schema(db)
+
+    data_padrao_txt = payload.get("data_pagamento") or date.today().strftime("%Y-%m-%d")
+    banco_padrao = payload.get("conta_bancaria_id")
+    brutos = payload.get("itens") or [{"conta_id": cid} for cid in (payload.get("conta_ids") or [])]
+    if not isinstance(brutos, list) or not brutos:
+        raise HTTPException(status_code=400, detail="Informe conta_ids ou itens")
+    if len(brutos) > 500:
+        raise HTTPException(status_code=400, detail="Maximo de 500 contas por lote")
+
+    itens: list[dict] = []
+    vistos: set[int] = set()
+    for item in brutos:
+        if not isinstance(item, dict):
+            raise HTTPException(status_code=400, detail="Item invalido")
+        try:
+            conta_id = int(item.get("conta_id"))
+            data_pagamento = datetime.strptime(item.get("data_pagamento") or data_padrao_txt, "%Y-%m-%d").date()
+        except Exception:
+            raise HTTPException(status_code=400, detail="conta_id ou data de pagamento invalida")
+        if conta_id in vistos:
+            continue
+        vistos.add(conta_id)
+        itens.append(
+            {
+                "conta_id": conta_id,
+                "data_pagamento": data_pagamento,
+                "conta_bancaria_id": item.get("conta_bancaria_id") or banco_padrao,
+            }
+        )
+
+    resultado = await liquidar_contas_receber(db, itens)
+    await db.commit()
+    return {"ok": True, **resultado}
@@ -1,10 +1,24 @@
-﻿from fastapi import APIRouter, Depends, HTTPException
+﻿from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.db.session import get_db
 from app.models.entities import Aula, MovimentoBancario, ContaReceber, ContaPagar
 from app.schemas.domain import AulaIn, FinanceiroIn
-from app.services.finance_service import gerar_comissao, dre
+from app.api.v1.endpoints.alunos import ensure_contracts_table
+from app.api.v1.endpoints.contas_pagar import ensure_contas_pagar_columns
+from app.services.finance_service import (
+    dre,
+    ensure_contas_receber_columns,
+    gerar_comissao,
+    listar_movimentos,
+    projecao_fluxo_caixa,
+)
+from app.services.categorizacao_service import categorizar
+from app.services.jobs_service import enfileirar_job, registrar_job, resposta_job
+from app.services.ledger_service import ensure_ledger_schema
+from app.services.versoes_service import ensure_versao_recurso
 
 router = APIRouter(tags=["core"])
 
@@ -46,29 +60,35 @@ async def delete_aula(aula_id: int, db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/financeiro")
-async def list_financeiro(db: AsyncSession = Depends(get_db)):
-    movimentos = (
-        (
-            await db.execute(
-                select(MovimentoBancario).order_by(
-                    MovimentoBancario.data_movimento.desc(), MovimentoBancario.id.desc()
-                )
-            )
-        )
-        .scalars()
-        .all()
+async def list_financeiro(
+    tipo: str | None = None,
+    categoria: str | None = None,
+    data_inicio: date | None = None,
+    data_fim: date | None = None,
+    cursor: str | None = Query(default=None, description="next_cursor da pagina anterior"),
+    limit: int = Query(default=50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    # Mesmo feed paginado de /movimentacoes-financeiras (com saldo corrente por linha).
+    return await listar_movimentos(
+        db, tipo=tipo, categoria=categoria, data_inicio=data_inicio, data_fim=data_fim, cursor=cursor, limit=limit
     )
-    return [
-        {
-            "id": m.id,
-            "tipo": m.tipo,
-            "valor": float(m.valor),
-            "data": m.data_movimento.strftime("%Y-%m-%d") if m.data_movimento else None,
-            "data_br": m.data_movimento.strftime("%d/%m/%Y") if m.data_movimento else "--",
-            "descricao": m.descricao or "",
-        }
-        for m in movimentos
-    ]
+
+
+@router.get("/financeiro/projecao")
+async def projecao_financeiro(
+    meses: int = Query(default=3, ge=1, le=24),
+    agrupamento: str = Query(default="mensal", description="semanal ou mensal"),
+    db: AsyncSession = Depends(get_db),
+):
+    agrupamento = (agrupamento or "mensal").strip().lower()
+    if agrupamento not in ("semanal", "mensal"):
+        raise HTTPException(status_code=400, detail="Agrupamento deve ser semanal ou mensal")
+    await ensure_contas_receber_columns(db)
+    await ensure_contas_pagar_columns(db)
+    await ensure_contracts_table(db)
+    await ensure_versao_recurso(db, "financeiro")
+    return await projecao_fluxo_caixa(db, meses=meses, agrupamento=agrupamento)
 
 
 @router.post("/financeiro")
@@ -83,7 +103,17 @@ async def create_financeiro(payload: FinanceiroIn, db: AsyncSession = Depends(ge
     else:
         tipo = tipo_in or "entrada"
 
-    row = MovimentoBancario(data_movimento=payload.data, tipo=tipo, valor=payload.valor, descricao=payload.descricao)
+    await ensure_ledger_schema(db)
+    categoria, subcategoria = await categorizar(db, payload.descricao)
+    row = MovimentoBancario(
+        data_movimento=payload.data,
+        tipo=tipo,
+        valor=payload.valor,
+        descricao=payload.descricao,
+        categoria=categoria,
+        subcategoria=subcategoria,
+        conta_bancaria_id=payload.conta_bancaria_id,
+    )
     db.add(row)
     await db.commit()
     await db.refresh(row)
@@ -92,6 +122,7 @@ async def create_financeiro(payload: FinanceiroIn, db: AsyncSession = Depends(ge
 
 @router.delete("/financeiro/{movimento_id}")
 async def delete_financeiro(movimento_id: int, db: AsyncSession = Depends(get_db)):
+    await ensure_ledger_schema(db)
     row = await db.get(MovimentoBancario, movimento_id)
     if not row:
         raise HTTPException(status_code=404, detail="Movimento nao encontrado")
@@ -106,7 +137,15 @@ async def gerar_comissao_endpoint(db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/dre")
-async def dre_endpoint(db: AsyncSession = Depends(get_db)):
+async def dre_endpoint(db: AsyncSession = Depends(get_db), assincrono: bool = False):
+    # DRE percorre todo o historico: com assincrono=true roda na fila e o resultado fica no job.
+    if assincrono:
+        return resposta_job(await enfileirar_job(db, "financeiro.dre"))
+    return await dre(db)
+
+
+@registrar_job("financeiro.dre")
+async def _job_dre(db: AsyncSession, payload: dict):
     return await dre(db)
 
 
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date
+from decimal import Decimal
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+
+from app.db.session import SessionLocal
+from app.api.v1.endpoints.contas_pagar import ensure_contas_pagar_columns
+from app.services.finance_service import ensure_contas_receber_columns, ensure_movimentos_columns
+
+router = APIRouter(prefix="/exportacoes", tags=["exportacoes"])
+
+# Linhas buscadas por vez no cursor server-side e escritas por chunk na resposta.
+YIELD_PER = 1000
+
+EXPORTS = {
+    "contas_receber": {
+        "ensure": ensure_contas_receber_columns,
+        "coluna_data": "cr.vencimento",
+        "sql": """
+            SELECT cr.id, cr.aluno_id, u.nome AS aluno_nome, cr.contrato_id, cr.vencimento, cr.valor,
+                   COALESCE(cr.status, 'aberto') AS status, cr.data_pagamento, cr.conta_bancaria_id
+            FROM contas_receber cr
+            LEFT JOIN alunos a ON a.id = cr.aluno_id
+            LEFT JOIN usuarios u ON u.id = a.usuario_id
+            WHERE 1=1
+            {filtros}
+            ORDER BY cr.vencimento, cr.id
+        """,
+    },
+    "contas_pagar": {
+        "ensure": ensure_contas_pagar_columns,
+        "coluna_data": "cp.vencimento",
+        "sql": """
+            SELECT cp.id, cp.descricao, cp.categoria, cp.subcategoria, cp.vencimento, cp.valor,
+                   COALESCE(cp.status, 'aberto') AS status, cp.data_pagamento, cp.profissional_id, cp.referencia_mes
+            FROM contas_pagar cp
+            WHERE 1=1
+            {filtros}
+            ORDER BY cp.vencimento, cp.id
+        """,
+    },
+    "movimentos_bancarios": {
+        "ensure": ensure_movimentos_columns,
+        "coluna_data": "m.data_movimento",
+        "sql": """
+            SELECT m.id, m.data_movimento, m.tipo, m.valor, m.descricao, m.categoria, m.subcategoria
+            FROM movimentos_bancarios m
+            WHERE 1=1
+            {filtros}
+            ORDER BY m.data_movimento, m.id
+        """,
+    },
+}
+
+
+def _valor_export(v):
+    if isinstance(v, date):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return v
+
+
+async def _linhas_export(tabela: str, formato: str, data_inicio: date | None, data_fim: date | None):
+    cfg = EXPORTS[tabela]
+    filtros = ""
+    params: dict[str, object] = {}
+    if data_inicio:
+        filtros += f" AND {cfg['coluna_data']} >= :data_inicio "
+        params["data_inicio"] = data_inicio
+    if data_fim:
+        filtros += f" AND {cfg['coluna_data']} <= :data_fim "
+        params["data_fim"] = data_fim
+
+    # Sessao propria: o gerador roda depois que o endpoint retornou, fora do ciclo de vida do get_db.
+    async with SessionLocal() as db:
+        await cfg["ensure"](db)
+        stmt = text(cfg["sql"].format(filtros=filtros)).execution_options(yield_per=YIELD_PER)
+        result = await db.stream(stmt, params)
+        colunas = list(result.keys())
+        buf = io.StringIO()
+        writer = csv.writer(buf, delimiter=";") if formato == "csv" else None
+        if writer:
+            writer.writerow(colunas)
+        async for partition in result.partitions():
+            for r in partition:
+                if writer:
+                    writer.writerow([_valor_export(v) for v in r])
+                else:
+                    buf.write(json.dumps(dict(zip(colunas, map(_valor_export, r))), ensure_ascii=False))
+                    buf.write("\n")
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate(0)
+        if buf.tell():
+            yield buf.getvalue().encode("utf-8")
+
+
+async def _gzip_stream(chunks):
+    comp = zlib.compressobj(wbits=31)  # 31 = container gzip
+    async for chunk in chunks:
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
+
+
+@router.get("/{tabela}")
+async def exportar_tabela(
+    tabela: str,
+    formato: str = Query(default="csv", description="csv ou ndjson"),
+    gzip: bool = Query(default=False, description="Compacta o arquivo (.gz)"),
+    data_inicio: date | None = None,
+    data_fim: date | None = None,
+):
+    if tabela not in EXPORTS:
+        raise HTTPException(status_code=404, detail="Tabela de exportacao nao encontrada")
+    formato = (formato or "csv").strip().lower()
+    if formato not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Formato deve ser csv ou ndjson")
+
+    media_type = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    filename = f"{tabela}.{formato}"
+    body = _linhas_export(tabela, formato, data_inicio, data_fim)
+    if gzip:
+        body = _gzip_stream(body)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import get_db
+from app.api.v1.endpoints.alunos import ensure_contracts_table, ensure_finance_columns
+from app.services.faturamento_service import (
+    ensure_faturamento_tables,
+    executar_faturamento,
+    iniciar_execucao,
+    obter_execucao,
+    retomar_execucao,
+    simular_faturamento,
+)
+from app.services.jobs_service import enfileirar_job, registrar_job, resposta_job
+
+router = APIRouter(prefix="/faturamento", tags=["faturamento"])
+
+
+@router.post("/execucoes")
+async def criar_execucao_faturamento(payload: dict, db: AsyncSession = Depends(get_db), assincrono: bool = False):
+    """
+    Renova em lote os contratos ativos que terminam ate hoje + janela_dias e gera as parcelas
+    do proximo periodo. Body: {"janela_dias": 7, "dry_run": false}.
+    """
+    await ensure_contracts_table(db)
+    await ensure_finance_columns(db)
+    await ensure_faturamento_tables(db)
+    try:
+        janela_dias = int(payload.get("janela_dias") if payload.get("janela_dias") is not None else 7)
+    except Exception:
+        raise HTTPException(status_code=400, detail="janela_dias invalido")
+    if janela_dias < 0 or janela_dias > 90:
+        raise HTTPException(status_code=400, detail="janela_dias deve estar entre 0 e 90")
+    janela_fim = date.today() + timedelta(days=janela_dias)
+
+    if payload.get("dry_run"):
+        return await simular_faturamento(db, janela_fim)
+    execucao_id = await iniciar_execucao(db, janela_fim)
+    if assincrono:
+        job_id = await enfileirar_job(db, "faturamento.executar", {"execucao_id": execucao_id}, prioridade=50)
+        return resposta_job(job_id)
+    return await executar_faturamento(db, execucao_id)
+
+
+@registrar_job("faturamento.executar")
+async def _job_executar_faturamento(db: AsyncSession, payload: dict):
+    return await executar_faturamento(db, int(payload["execucao_id"]))
+
+
+@router.get("/execucoes/{execucao_id}")
+async def status_execucao_faturamento(execucao_id: int, db: AsyncSession = Depends(get_db)):
+    await ensure_faturamento_tables(db)
+    execucao = await obter_execucao(db, execucao_id)
+    if not execucao:
+        raise HTTPException(status_code=404, detail="Execucao nao encontrada")
+    return execucao
+
+
+@router.post("/execucoes/{execucao_id}/retomar")
+async def retomar_execucao_faturamento(execucao_id: int, db: AsyncSession = Depends(get_db)):
+    await ensure_contracts_table(db)
+    await ensure_finance_columns(db)
+    await ensure_faturamento_tables(db)
+    return await retomar_execucao(db, execucao_id)
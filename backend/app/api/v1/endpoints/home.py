@@ -2,7 +2,7 @@ from datetime import date, datetime, timedelta
 import calendar
 
 from fastapi import APIRouter, Depends
-from sqlalchemy import select, func
+from sqlalchemy import select, func, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_current_user
@@ -51,6 +51,10 @@ async def home_kpis(user: Usuario = Depends(get_current_user), db: AsyncSession
         a_receber = float(
             (await db.scalar(select(func.sum(ContaReceber.valor)).where(ContaReceber.status == "aberto"))) or 0
         )
+        # em_atraso e mantido pelo job noturno (marcar_contas_vencidas): sem comparar datas aqui.
+        em_atraso = float(
+            (await db.scalar(select(func.sum(ContaReceber.valor)).where(ContaReceber.em_atraso.is_(True)))) or 0
+        )
         alunos_ativos = int(
             (await db.scalar(select(func.count(Aluno.id)).where(Aluno.status == "ativo"))) or 0
         )
@@ -61,6 +65,7 @@ async def home_kpis(user: Usuario = Depends(get_current_user), db: AsyncSession
                 {"label": "Receita Hoje", "value": brl(receita_hoje)},
                 {"label": "Recebido (Mes)", "value": brl(recebido_mes)},
                 {"label": "A Receber", "value": brl(a_receber)},
+                {"label": "Em Atraso", "value": brl(em_atraso)},
                 {"label": "Alunos Ativos", "value": str(alunos_ativos)},
             ],
         }
@@ -112,8 +117,9 @@ async def home_kpis(user: Usuario = Depends(get_current_user), db: AsyncSession
     aulas_semana = int(
         (await db.scalar(select(func.count(Aula.id)).where(Aula.aluno_id == aluno_id, func.date(Aula.inicio) >= inicio_semana, func.date(Aula.inicio) <= fim_semana))) or 0
     ) if aluno_id else 0
+    # Saldo devedor denormalizado (finance_service.ensure_saldo_devedor), sem agregar contas_receber.
     pendencias = float(
-        (await db.scalar(select(func.sum(ContaReceber.valor)).where(ContaReceber.aluno_id == aluno_id, ContaReceber.status == "aberto"))) or 0
+        (await db.scalar(text("SELECT saldo_devedor FROM alunos WHERE id = :id"), {"id": aluno_id})) or 0
     ) if aluno_id else 0
     return {
         "role": user.role,
@@ -0,0 +1,62 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import get_db
+from app.services.jobs_service import JOB_COLUNAS, ensure_jobs_table, job_to_dict
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+@router.get("")
+async def listar_jobs(
+    status: str | None = Query(default=None, description="pendente/executando/concluido/erro"),
+    tipo: str | None = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    await ensure_jobs_table(db)
+    filtros = ""
+    params: dict[str, object] = {"limit": limit}
+    if status:
+        filtros += " AND status = :status "
+        params["status"] = status.strip().lower()
+    if tipo:
+        filtros += " AND tipo = :tipo "
+        params["tipo"] = tipo
+    rows = (
+        await db.execute(
+            text(f"SELECT {JOB_COLUNAS} FROM jobs WHERE 1=1 {filtros} ORDER BY id DESC LIMIT :limit"),
+            params,
+        )
+    ).all()
+    return [job_to_dict(r) for r in rows]
+
+
+@router.get("/{job_id}")
+async def status_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    await ensure_jobs_table(db)
+    row = (await db.execute(text(f"SELECT {JOB_COLUNAS} FROM jobs WHERE id = :id"), {"id": job_id})).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Job nao encontrado")
+    return job_to_dict(row)
+
+
+@router.post("/{job_id}/reprocessar")
+async def reprocessar_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Devolve para a fila um job que terminou em erro (zera as tentativas)."""
+    await ensure_jobs_table(db)
+    res = await db.execute(
+        text(
+            """
+            UPDATE jobs
+            SET status = 'pendente', tentativas = 0, erro = NULL, executar_em = NOW(), finalizado_em = NULL
+            WHERE id = :id AND status = 'erro'
+            """
+        ),
+        {"id": job_id},
+    )
+    await db.commit()
+    if res.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Job nao encontrado ou nao esta em erro")
+    return {"ok": True}
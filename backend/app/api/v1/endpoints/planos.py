@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.session import get_db
+from app.services.versoes_service import checar_condicional
 
 router = APIRouter(prefix="/planos", tags=["planos"])
 
@@ -49,7 +50,11 @@ async def ensure_planos_table(db: AsyncSession):
 
 
 @router.get("")
-async def listar_planos(db: AsyncSession = Depends(get_db)):
+async def listar_planos(request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    headers, nao_modificada = await checar_condicional(request, "planos")
+    if nao_modificada:
+        return nao_modificada
+    response.headers.update(headers)
     await ensure_planos_table(db)
     rows = (
         await db.execute(
@@ -1,16 +1,21 @@
-﻿from fastapi import APIRouter, Depends, HTTPException
+﻿from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from urllib.request import urlopen
 import json
 from app.db.session import get_db
 from app.models.entities import EmpresaConfig
+from app.services.versoes_service import checar_condicional
 
 router = APIRouter(tags=["public"])
 
 
 @router.get("/public/branding")
-async def branding(db: AsyncSession = Depends(get_db)):
+async def branding(request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    headers, nao_modificada = await checar_condicional(request, "branding")
+    if nao_modificada:
+        return nao_modificada
+    response.headers.update(headers)
     cfg = await db.scalar(select(EmpresaConfig).limit(1))
     if not cfg:
         return {"nome_fantasia": "Next Level Assessoria Esportiva", "logo_url": None, "cor_primaria": "#0A84FF"}
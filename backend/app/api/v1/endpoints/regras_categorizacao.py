@@ -0,0 +1,132 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import get_db
+from app.api.v1.endpoints.categorias import ensure_categorias_tables
+from app.services.categorizacao_service import backfill_categorias, ensure_regras_categorizacao_table
+from app.services.finance_service import ensure_movimentos_columns
+from app.services.jobs_service import enfileirar_job, registrar_job, resposta_job
+
+router = APIRouter(prefix="/regras-categorizacao", tags=["regras-categorizacao"])
+
+
+async def validar_regra(db: AsyncSession, payload: dict) -> dict:
+    padrao = (payload.get("padrao") or "").strip()
+    categoria = (payload.get("categoria") or "").strip()
+    subcategoria = (payload.get("subcategoria") or "").strip() or None
+    if not padrao:
+        raise HTTPException(status_code=400, detail="Padrao da descricao e obrigatorio")
+    if not categoria:
+        raise HTTPException(status_code=400, detail="Categoria e obrigatoria")
+    try:
+        prioridade = int(payload.get("prioridade") or 100)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Prioridade invalida")
+
+    await ensure_categorias_tables(db)
+    cat = (await db.execute(text("SELECT id FROM categorias WHERE nome = :nome"), {"nome": categoria})).first()
+    if not cat:
+        raise HTTPException(status_code=404, detail="Categoria nao encontrada")
+    if subcategoria:
+        sub = (
+            await db.execute(
+                text("SELECT id FROM subcategorias WHERE nome = :nome AND categoria_id = :categoria_id"),
+                {"nome": subcategoria, "categoria_id": cat[0]},
+            )
+        ).first()
+        if not sub:
+            raise HTTPException(status_code=404, detail="Subcategoria nao encontrada nesta categoria")
+    return {
+        "padrao": padrao,
+        "categoria": categoria,
+        "subcategoria": subcategoria,
+        "prioridade": prioridade,
+        "status": (payload.get("status") or "ativo").strip().lower(),
+    }
+
+
+@router.get("")
+async def listar_regras_categorizacao(db: AsyncSession = Depends(get_db)):
+    await ensure_regras_categorizacao_table(db)
+    rows = (
+        await db.execute(
+            text(
+                """
+                SELECT id, padrao, categoria, subcategoria, prioridade, status
+                FROM regras_categorizacao
+                ORDER BY prioridade ASC, id ASC
+                """
+            )
+        )
+    ).all()
+    return [
+        {"id": r[0], "padrao": r[1], "categoria": r[2], "subcategoria": r[3], "prioridade": r[4], "status": r[5]}
+        for r in rows
+    ]
+
+
+@router.post("")
+async def criar_regra_categorizacao(payload: dict, db: AsyncSession = Depends(get_db)):
+    await ensure_regras_categorizacao_table(db)
+    dados = await validar_regra(db, payload)
+    row = (
+        await db.execute(
+            text(
+                """
+                INSERT INTO regras_categorizacao (padrao, categoria, subcategoria, prioridade, status, updated_at)
+                VALUES (:padrao, :categoria, :subcategoria, :prioridade, :status, NOW())
+                RETURNING id
+                """
+            ),
+            dados,
+        )
+    ).first()
+    await db.commit()
+    return {"id": row[0]}
+
+
+@router.put("/{regra_id}")
+async def atualizar_regra_categorizacao(regra_id: int, payload: dict, db: AsyncSession = Depends(get_db)):
+    await ensure_regras_categorizacao_table(db)
+    dados = await validar_regra(db, payload)
+    res = await db.execute(
+        text(
+            """
+            UPDATE regras_categorizacao
+            SET padrao = :padrao, categoria = :categoria, subcategoria = :subcategoria,
+                prioridade = :prioridade, status = :status, updated_at = NOW()
+            WHERE id = :id
+            """
+        ),
+        {**dados, "id": regra_id},
+    )
+    await db.commit()
+    if res.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Regra nao encontrada")
+    return {"ok": True}
+
+
+@router.delete("/{regra_id}")
+async def excluir_regra_categorizacao(regra_id: int, db: AsyncSession = Depends(get_db)):
+    await ensure_regras_categorizacao_table(db)
+    res = await db.execute(text("DELETE FROM regras_categorizacao WHERE id = :id"), {"id": regra_id})
+    await db.commit()
+    if res.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Regra nao encontrada")
+    return {"ok": True}
+
+
+@router.post("/aplicar")
+async def aplicar_regras_categorizacao(db: AsyncSession = Depends(get_db), assincrono: bool = False):
+    """Backfill: categoriza movimentos historicos ainda sem categoria."""
+    if assincrono:
+        return resposta_job(await enfileirar_job(db, "categorizacao.backfill"))
+    await ensure_movimentos_columns(db)
+    total = await backfill_categorias(db)
+    return {"ok": True, "movimentos_categorizados": total}
+
+
+@registrar_job("categorizacao.backfill")
+async def _job_backfill_categorias(db: AsyncSession, payload: dict):
+    return await aplicar_regras_categorizacao(db=db)
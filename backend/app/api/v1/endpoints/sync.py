@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import get_db
+from app.services.sync_service import ensure_sync, montar_sync
+
+router = APIRouter(tags=["sync"])
+
+
+@router.get("/sync")
+async def sync(since: datetime | None = None, db: AsyncSession = Depends(get_db)):
+    """
+    Sync incremental para a replica local do PWA.
+
+    Sem since: snapshot completo. Com since (o "cursor" da resposta anterior): so as linhas
+    criadas/alteradas desde entao e os ids excluidos, por tabela. O cliente aplica "alterados"
+    por id, remove "excluidos" e guarda o novo cursor. completo=true pede para substituir a
+    replica inteira (cursor mais antigo que a retencao das exclusoes).
+    """
+    await ensure_sync(db)
+    if since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    corpo = await montar_sync(db, since)
+    return Response(content=corpo.encode(), media_type="application/json")
@@ -14,6 +14,13 @@ from app.api.v1.endpoints.contas_pagar import router as contas_pagar_router
 from app.api.v1.endpoints.regras_comissao import router as regras_comissao_router
 from app.api.v1.endpoints.comissoes import router as comissoes_router
 from app.api.v1.endpoints.home import router as home_router
+from app.api.v1.endpoints.exportacoes import router as exportacoes_router
+from app.api.v1.endpoints.regras_categorizacao import router as regras_categorizacao_router
+from app.api.v1.endpoints.faturamento import router as faturamento_router
+from app.api.v1.endpoints.jobs import router as jobs_router
+from app.api.v1.endpoints.agendador import router as agendador_router
+from app.api.v1.endpoints.sync import router as sync_router
+from app.api.v1.endpoints.batch import router as batch_router
 
 router = APIRouter(prefix="/api/v1")
 router.include_router(auth_router)
@@ -31,3 +38,10 @@ router.include_router(contas_pagar_router)
 router.include_router(regras_comissao_router)
 router.include_router(comissoes_router)
 router.include_router(home_router)
+router.include_router(exportacoes_router)
+router.include_router(regras_categorizacao_router)
+router.include_router(faturamento_router)
+router.include_router(jobs_router)
+router.include_router(agendador_router)
+router.include_router(sync_router)
+router.include_router(batch_router)
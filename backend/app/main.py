@@ -1,9 +1,13 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.v1.router import router
 from app.core.config import settings
 from app.core.startup import ensure_admin_user
+from app.services.agenda_eventos_service import parar_eventos
+from app.services.agendador_service import iniciar_agendador, parar_agendador
+from app.services.jobs_service import iniciar_workers, parar_workers
+from app.services.versoes_service import invalidar_versoes
 
 app = FastAPI(title=settings.app_name)
 
@@ -17,10 +21,28 @@ app.add_middleware(
 app.include_router(router)
 
 
+@app.middleware("http")
+async def invalidar_versoes_apos_escrita(request: Request, call_next):
+    response = await call_next(request)
+    # A escrita ja foi commitada: o proximo GET condicional deste processo reconsulta a versao.
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        invalidar_versoes()
+    return response
+
+
 @app.on_event("startup")
 async def startup():
     # Prevent being locked out after deploys due to empty/changed DB.
     await ensure_admin_user()
+    await iniciar_workers(settings.job_workers)
+    await iniciar_agendador(settings.agendador_ativo)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await parar_eventos()
+    await parar_agendador()
+    await parar_workers()
 
 
 @app.get("/health")
@@ -74,6 +74,7 @@ class ContaReceber(Base, TimestampMixin):
     status: Mapped[str] = mapped_column(String(20), default="aberto")
     data_pagamento: Mapped[date | None] = mapped_column(Date, nullable=True)
     conta_bancaria_id: Mapped[int | None] = mapped_column(nullable=True)
+    em_atraso: Mapped[bool] = mapped_column(Boolean, server_default="false")
 
 
 class ContaPagar(Base, TimestampMixin):
@@ -99,6 +100,7 @@ class MovimentoBancario(Base, TimestampMixin):
     descricao: Mapped[str | None] = mapped_column(String(255), nullable=True)
     categoria: Mapped[str | None] = mapped_column(String(120), nullable=True)
     subcategoria: Mapped[str | None] = mapped_column(String(120), nullable=True)
+    conta_bancaria_id: Mapped[int | None] = mapped_column(nullable=True)
 
 
 class RegraComissao(Base, TimestampMixin):
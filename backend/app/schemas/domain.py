@@ -45,4 +45,5 @@ class FinanceiroIn(BaseModel):
     data: date
     valor: float
     descricao: str | None = None
+    conta_bancaria_id: int | None = None
 
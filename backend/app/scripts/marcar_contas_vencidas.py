@@ -0,0 +1,15 @@
+import asyncio
+
+from app.db.session import SessionLocal
+from app.services.finance_service import ensure_contas_receber_columns, marcar_contas_vencidas
+
+
+async def main():
+    async with SessionLocal() as db:
+        await ensure_contas_receber_columns(db)
+        resultado = await marcar_contas_vencidas(db)
+    print(f"Contas marcadas em atraso: {resultado['marcadas']}, desmarcadas: {resultado['desmarcadas']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
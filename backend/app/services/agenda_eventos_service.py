@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app.db.session import engine
+from app.services.ddl_service import FuncaoSql, TriggerSql, garantir_ddl
+from app.services.versoes_service import invalidar_versoes
+
+logger = logging.getLogger(__name__)
+
+CANAL = "agenda_eventos"
+# Comentario SSE periodico: mantem proxies/tablets com a conexao aberta e detecta cliente que caiu.
+HEARTBEAT_SEGUNDOS = 25
+# Eventos pendentes por cliente; cliente lento demais recebe "resync" e recarrega a agenda.
+FILA_MAXIMA = 200
+
+
+@dataclass(eq=False)
+class Assinante:
+    unidade_id: int | None
+    profissional_id: int | None
+    fila: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=FILA_MAXIMA))
+
+    def interessa(self, evento: dict) -> bool:
+        # Evento sem unidade/professor (ex.: bloqueio geral) vale para todos os filtros.
+        if self.unidade_id is not None:
+            unidades = {evento.get("unidade_id"), evento.get("unidade_anterior_id")}
+            if evento.get("unidade_id") is not None and self.unidade_id not in unidades:
+                return False
+        if self.profissional_id is not None:
+            professores = {evento.get("professor_id"), evento.get("professor_anterior_id")}
+            if evento.get("professor_id") is not None and self.profissional_id not in professores:
+                return False
+        return True
+
+
+_assinantes: set[Assinante] = set()
+_conexao: AsyncConnection | None = None
+# Conexao cujo socket caiu: continua fora do pool ate ser invalidada.
+_conexao_perdida: AsyncConnection | None = None
+_lock = asyncio.Lock()
+
+
+AULAS_FUNCAO = FuncaoSql(
+    "agenda_eventos_aulas",
+    "1",
+    """
+    CREATE OR REPLACE FUNCTION agenda_eventos_aulas() RETURNS trigger AS $fn$
+    DECLARE
+      linha aulas%ROWTYPE;
+      tipo TEXT;
+    BEGIN
+      IF TG_OP = 'DELETE' THEN
+        linha := OLD;
+        tipo := 'aula_removida';
+      ELSE
+        linha := NEW;
+        IF TG_OP = 'INSERT' THEN
+          tipo := 'aula_criada';
+        ELSIF NEW.inicio IS DISTINCT FROM OLD.inicio OR NEW.fim IS DISTINCT FROM OLD.fim
+           OR NEW.professor_id IS DISTINCT FROM OLD.professor_id OR NEW.agenda_id IS DISTINCT FROM OLD.agenda_id THEN
+          tipo := 'aula_remarcada';
+        ELSIF NEW.status IS DISTINCT FROM OLD.status THEN
+          tipo := 'aula_status';
+        ELSE
+          RETURN NULL;
+        END IF;
+      END IF;
+      PERFORM pg_notify('agenda_eventos', json_build_object(
+        'tipo', tipo,
+        'id', linha.id,
+        'status', linha.status,
+        'aluno_id', linha.aluno_id,
+        'professor_id', linha.professor_id,
+        'unidade_id', (SELECT ag.unidade_id FROM agendas ag WHERE ag.id = linha.agenda_id),
+        'professor_anterior_id',
+          CASE WHEN TG_OP = 'UPDATE' AND OLD.professor_id IS DISTINCT FROM NEW.professor_id THEN OLD.professor_id END,
+        'unidade_anterior_id',
+          CASE WHEN TG_OP = 'UPDATE' AND OLD.agenda_id IS DISTINCT FROM NEW.agenda_id
+               THEN (SELECT ag.unidade_id FROM agendas ag WHERE ag.id = OLD.agenda_id) END,
+        'data', to_char(linha.inicio AT TIME ZONE 'America/Sao_Paulo', 'YYYY-MM-DD'),
+        'hora_br', to_char(linha.inicio AT TIME ZONE 'America/Sao_Paulo', 'HH24:MI'),
+        'hora_fim_br', to_char(linha.fim AT TIME ZONE 'America/Sao_Paulo', 'HH24:MI')
+      )::text);
+      RETURN NULL;
+    END
+    $fn$ LANGUAGE plpgsql
+    """,
+)
+BLOQUEIOS_FUNCAO = FuncaoSql(
+    "agenda_eventos_bloqueios",
+    "1",
+    """
+    CREATE OR REPLACE FUNCTION agenda_eventos_bloqueios() RETURNS trigger AS $fn$
+    DECLARE
+      linha agenda_bloqueios%ROWTYPE;
+      tipo TEXT;
+    BEGIN
+      IF TG_OP = 'DELETE' THEN
+        linha := OLD;
+        tipo := 'bloqueio_removido';
+      ELSE
+        linha := NEW;
+        IF TG_OP = 'UPDATE' AND NEW.status IS NOT DISTINCT FROM OLD.status THEN
+          RETURN NULL;
+        END IF;
+        tipo := CASE WHEN NEW.status = 'ativo' THEN 'bloqueio_criado' ELSE 'bloqueio_removido' END;
+      END IF;
+      PERFORM pg_notify('agenda_eventos', json_build_object(
+        'tipo', tipo,
+        'id', linha.id,
+        'professor_id', linha.profissional_id,
+        'unidade_id', linha.unidade_id,
+        'data', to_char(linha.data, 'YYYY-MM-DD'),
+        'data_fim', to_char(linha.data_fim, 'YYYY-MM-DD'),
+        'hora_inicio', linha.hora_inicio,
+        'hora_fim', linha.hora_fim,
+        'motivo', linha.motivo
+      )::text);
+      RETURN NULL;
+    END
+    $fn$ LANGUAGE plpgsql
+    """,
+)
+TRIGGERS = (
+    TriggerSql(
+        "tg_agenda_eventos_aulas",
+        "aulas",
+        "1",
+        """
+        CREATE TRIGGER tg_agenda_eventos_aulas
+        AFTER INSERT OR DELETE OR UPDATE OF inicio, fim, status, professor_id, agenda_id ON aulas
+        FOR EACH ROW EXECUTE FUNCTION agenda_eventos_aulas()
+        """,
+    ),
+    TriggerSql(
+        "tg_agenda_eventos_bloqueios",
+        "agenda_bloqueios",
+        "1",
+        """
+        CREATE TRIGGER tg_agenda_eventos_bloqueios
+        AFTER INSERT OR DELETE OR UPDATE OF status ON agenda_bloqueios
+        FOR EACH ROW EXECUTE FUNCTION agenda_eventos_bloqueios()
+        """,
+    ),
+)
+
+
+async def ensure_agenda_eventos(db: AsyncSession):
+    """
+    Triggers de linha em aulas e agenda_bloqueios publicam cada mudanca em pg_notify. O NOTIFY so
+    e entregue no commit, e chega a todos os workers que estao em LISTEN, venha a escrita de
+    endpoint, job ou SQL em lote.
+    """
+    await garantir_ddl(db, AULAS_FUNCAO, BLOQUEIOS_FUNCAO, *TRIGGERS)
+    await db.commit()
+
+
+def _publicar(evento: dict):
+    for assinante in list(_assinantes):
+        if not assinante.interessa(evento):
+            continue
+        try:
+            assinante.fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Perdeu eventos: descarta o atraso e pede para o cliente recarregar tudo.
+            while not assinante.fila.empty():
+                assinante.fila.get_nowait()
+            assinante.fila.put_nowait({"tipo": "resync"})
+
+
+def _ao_notificar(_conn, _pid, _canal, payload: str):
+    try:
+        evento = json.loads(payload)
+    except ValueError:
+        logger.warning("Agenda eventos: payload invalido %r", payload[:200])
+        return
+    # A escrita pode ter vindo de outro processo: o proximo GET condicional reconsulta a versao.
+    invalidar_versoes("agenda")
+    _publicar(evento)
+
+
+def _ao_perder_conexao(_conn):
+    global _conexao, _conexao_perdida
+    logger.warning("Agenda eventos: conexao LISTEN perdida")
+    _conexao, _conexao_perdida = None, _conexao
+    # Eventos podem ter se perdido ate o LISTEN voltar.
+    invalidar_versoes("agenda")
+    _publicar({"tipo": "resync"})
+
+
+async def _descartar_conexao_perdida():
+    """Devolve ao pool a vaga da conexao LISTEN que caiu (o socket nao e reaproveitado)."""
+    global _conexao_perdida
+    if _conexao_perdida is None:
+        return
+    conn, _conexao_perdida = _conexao_perdida, None
+    try:
+        await conn.invalidate()
+        await conn.close()
+    except Exception:
+        logger.exception("Agenda eventos: falha ao descartar conexao LISTEN perdida")
+
+
+async def garantir_listener():
+    """Uma conexao dedicada em LISTEN por processo, aberta no primeiro assinante."""
+    global _conexao
+    if _conexao is not None and not _conexao.closed:
+        return
+    async with _lock:
+        if _conexao is not None and not _conexao.closed:
+            return
+        await _descartar_conexao_perdida()
+        conn = await engine.connect()
+        try:
+            raw = (await conn.get_raw_connection()).driver_connection
+            await raw.add_listener(CANAL, _ao_notificar)
+            raw.add_termination_listener(_ao_perder_conexao)
+        except Exception:
+            await conn.close()
+            raise
+        _conexao = conn
+
+
+async def assinar(unidade_id: int | None, profissional_id: int | None) -> Assinante:
+    await garantir_listener()
+    assinante = Assinante(unidade_id=unidade_id, profissional_id=profissional_id)
+    _assinantes.add(assinante)
+    return assinante
+
+
+async def stream_eventos(assinante: Assinante):
+    """Server-Sent Events: um evento por delta da agenda, com heartbeat entre eles."""
+    try:
+        yield f"retry: 3000\nevent: pronto\ndata: {json.dumps({'assinantes': len(_assinantes)})}\n\n"
+        while True:
+            try:
+                evento = await asyncio.wait_for(assinante.fila.get(), timeout=HEARTBEAT_SEGUNDOS)
+            except asyncio.TimeoutError:
+                try:
+                    await garantir_listener()
+                except Exception:
+                    logger.exception("Agenda eventos: falha ao reabrir LISTEN")
+                yield ": ping\n\n"
+                continue
+            yield f"event: {evento.get('tipo', 'mensagem')}\ndata: {json.dumps(evento)}\n\n"
+    finally:
+        _assinantes.discard(assinante)
+
+
+async def parar_eventos():
+    global _conexao
+    _assinantes.clear()
+    await _descartar_conexao_perdida()
+    if _conexao is not None:
+        conn, _conexao = _conexao, None
+        await conn.close()
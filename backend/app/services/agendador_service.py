@@ -0,0 +1,274 @@
+import asyncio
+import json
+import logging
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import SessionLocal, engine
+from app.api.v1.endpoints.contas_pagar import ensure_contas_pagar_columns
+from app.api.v1.endpoints.regras_comissao import ensure_regras_comissao_columns
+from app.services.finance_service import ensure_contas_receber_columns, marcar_contas_vencidas, verificar_saldo_devedor
+from app.services.ledger_service import ensure_ledger_schema, gerar_checkpoints
+from app.services.sync_service import limpar_exclusoes
+
+logger = logging.getLogger(__name__)
+
+BR_TZ = ZoneInfo("America/Sao_Paulo")
+# Intervalo entre verificacoes de jobs devidos.
+TICK_SEGUNDOS = 60
+# classid dos advisory locks do agendador; o objid e o crc32 do nome do job.
+ADVISORY_AGENDADOR = 40001
+# Folga para o professor lancar a presenca antes do agendador decidir pela aula.
+PRAZO_PRESENCA = timedelta(hours=24)
+
+_tarefa: asyncio.Task | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class JobAgendado:
+    nome: str
+    horario: str  # HH:MM, horario de Brasilia
+    executar: Callable[[AsyncSession], Awaitable[dict]]
+    dia_mes: int | None = None  # None = diario
+
+    def ultimo_slot(self, agora_br: datetime) -> datetime:
+        """Instante (BR) da execucao mais recente que ja deveria ter acontecido."""
+        hh, mm = (int(x) for x in self.horario.split(":"))
+        slot = agora_br.replace(hour=hh, minute=mm, second=0, microsecond=0)
+        if self.dia_mes is None:
+            return slot if slot <= agora_br else slot - timedelta(days=1)
+        slot = slot.replace(day=self.dia_mes)
+        if slot > agora_br:
+            anterior = slot.replace(day=1) - timedelta(days=1)
+            slot = slot.replace(year=anterior.year, month=anterior.month)
+        return slot
+
+
+async def ensure_agendador_table(db: AsyncSession):
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS agendador_jobs (
+              nome VARCHAR(80) PRIMARY KEY,
+              ultima_execucao TIMESTAMPTZ,
+              ultimo_status VARCHAR(20),
+              ultima_duracao_ms INTEGER,
+              ultimo_resultado JSONB,
+              ultimo_erro TEXT,
+              execucoes INTEGER NOT NULL DEFAULT 0,
+              falhas INTEGER NOT NULL DEFAULT 0,
+              duracao_total_ms BIGINT NOT NULL DEFAULT 0
+            )
+            """
+        )
+    )
+    await db.execute(text("CREATE INDEX IF NOT EXISTS ix_aulas_agendadas_fim ON aulas (fim) WHERE status = 'agendada'"))
+    await db.commit()
+
+
+async def job_aulas_passadas(db: AsyncSession) -> dict:
+    res = await db.execute(
+        text(
+            """
+            UPDATE aulas
+            SET status = :status, updated_at = NOW()
+            WHERE status = 'agendada' AND fim < NOW() - CAST(:prazo AS INTERVAL)
+            """
+        ),
+        {"status": settings.aula_passada_status, "prazo": PRAZO_PRESENCA},
+    )
+    await db.commit()
+    return {"aulas_atualizadas": int(res.rowcount or 0)}
+
+
+async def job_contas_vencidas(db: AsyncSession) -> dict:
+    await ensure_contas_receber_columns(db)
+    return await marcar_contas_vencidas(db, datetime.now(BR_TZ).date())
+
+
+async def job_comissoes_mensais(db: AsyncSession) -> dict:
+    """
+    Contas a pagar de comissao do mes anterior num unico INSERT ... SELECT: agrega as aulas
+    realizadas por professor, aplica a regra vigente e ignora quem ja tem a comissao do mes.
+    Mesma regra de comissoes.gerar_contas_pagar_comissao.
+    """
+    await ensure_regras_comissao_columns(db)
+    await ensure_contas_pagar_columns(db)
+    hoje = datetime.now(BR_TZ).date()
+    fim = hoje.replace(day=1) - timedelta(days=1)
+    inicio = fim.replace(day=1)
+    mes_ref = f"{fim.year:04d}-{fim.month:02d}"
+    rows = (
+        await db.execute(
+            text(
+                """
+                INSERT INTO contas_pagar (vencimento, valor, descricao, categoria, subcategoria, status,
+                                          profissional_id, referencia_mes, created_at, updated_at)
+                SELECT CAST(:vencimento AS DATE), c.valor,
+                       'Comissao ' || COALESCE(NULLIF(c.nome, ''), 'Professor ' || c.professor_id)
+                         || ' - ' || :mes_ref || ' (' || c.tipo || ')',
+                       'Comissao', NULLIF(c.nome, ''), 'aberto', c.professor_id, :mes_ref, NOW(), NOW()
+                FROM (
+                  SELECT s.professor_id, u.nome, r.tipo,
+                         ROUND(CASE WHEN r.tipo = 'valor_aula' THEN s.qtd * r.valor_por_aula
+                                    ELSE s.total * r.percentual / 100 END, 2) AS valor
+                  FROM (
+                    SELECT professor_id, SUM(valor) AS total, COUNT(*) AS qtd
+                    FROM aulas
+                    WHERE status = 'realizada'
+                      AND CAST(inicio AS DATE) BETWEEN :inicio AND :fim
+                    GROUP BY professor_id
+                  ) s
+                  JOIN (
+                    SELECT DISTINCT ON (profissional_id) profissional_id,
+                           LOWER(COALESCE(tipo, 'percentual')) AS tipo,
+                           COALESCE(percentual, 0) AS percentual,
+                           COALESCE(valor_por_aula, 0) AS valor_por_aula
+                    FROM regras_comissao
+                    ORDER BY profissional_id, id DESC
+                  ) r ON r.profissional_id = s.professor_id
+                  LEFT JOIN profissionais p ON p.id = s.professor_id
+                  LEFT JOIN usuarios u ON u.id = p.usuario_id
+                ) c
+                WHERE c.valor > 0
+                  AND NOT EXISTS (
+                    SELECT 1 FROM contas_pagar cp
+                    WHERE cp.profissional_id = c.professor_id
+                      AND cp.referencia_mes = :mes_ref
+                      AND cp.categoria = 'Comissao'
+                  )
+                RETURNING id
+                """
+            ),
+            {"vencimento": hoje.replace(day=5), "mes_ref": mes_ref, "inicio": inicio, "fim": fim},
+        )
+    ).all()
+    await db.commit()
+    return {"mes_referencia": mes_ref, "contas_criadas": len(rows)}
+
+
+async def job_snapshots(db: AsyncSession) -> dict:
+    """Checkpoints de saldo bancario de ontem + verificacao do saldo devedor denormalizado."""
+    await ensure_ledger_schema(db)
+    checkpoints = await gerar_checkpoints(db)
+    await db.commit()
+    await ensure_contas_receber_columns(db)
+    divergencias = await verificar_saldo_devedor(db, corrigir=True)
+    return {"checkpoints": checkpoints, "saldos_devedores_corrigidos": len(divergencias)}
+
+
+JOBS: tuple[JobAgendado, ...] = (
+    JobAgendado("aulas_passadas", "00:30", job_aulas_passadas),
+    JobAgendado("contas_vencidas", "01:00", job_contas_vencidas),
+    JobAgendado("snapshots", "01:30", job_snapshots),
+    JobAgendado("sync_exclusoes", "02:00", limpar_exclusoes),
+    JobAgendado("comissoes_mensais", "03:00", job_comissoes_mensais, dia_mes=1),
+)
+JOBS_POR_NOME = {j.nome: j for j in JOBS}
+
+
+async def executar_job_agendado(job: JobAgendado, forcar: bool = False) -> dict | None:
+    """
+    Executa o job se ele estiver devido e se este processo vencer a eleicao: pg_try_advisory_lock
+    numa conexao dedicada, mantida durante a execucao (o job faz commits na propria sessao).
+    Devolve None quando outro processo e o lider ou o job nao esta devido.
+    """
+    chave = zlib.crc32(job.nome.encode()) & 0x7FFFFFFF
+    async with engine.connect() as conn:
+        lider = (
+            await conn.execute(text("SELECT pg_try_advisory_lock(:classe, :chave)"), {"classe": ADVISORY_AGENDADOR, "chave": chave})
+        ).scalar_one()
+        await conn.commit()
+        if not lider:
+            return None
+        try:
+            async with SessionLocal() as db:
+                slot = job.ultimo_slot(datetime.now(BR_TZ))
+                ultima = (
+                    await db.execute(text("SELECT ultima_execucao FROM agendador_jobs WHERE nome = :nome"), {"nome": job.nome})
+                ).scalar()
+                await db.commit()
+                if not forcar and ultima is not None and ultima >= slot:
+                    return None
+
+                inicio_exec = datetime.now(BR_TZ)
+                t0 = time.perf_counter()
+                status, resultado, erro = "ok", None, None
+                try:
+                    resultado = await job.executar(db)
+                except Exception as exc:
+                    await db.rollback()
+                    status, erro = "erro", f"{type(exc).__name__}: {exc}"
+                    logger.exception("Agendador: job %s falhou", job.nome)
+                duracao_ms = int((time.perf_counter() - t0) * 1000)
+                logger.info("Agendador: job %s %s em %dms", job.nome, status, duracao_ms)
+                await db.execute(
+                    text(
+                        """
+                        INSERT INTO agendador_jobs (nome, ultima_execucao, ultimo_status, ultima_duracao_ms, ultimo_resultado,
+                                                    ultimo_erro, execucoes, falhas, duracao_total_ms)
+                        VALUES (:nome, :quando, :status, :duracao, CAST(:resultado AS JSONB), :erro, 1, :falha, :duracao)
+                        ON CONFLICT (nome) DO UPDATE SET
+                          ultima_execucao = excluded.ultima_execucao,
+                          ultimo_status = excluded.ultimo_status,
+                          ultima_duracao_ms = excluded.ultima_duracao_ms,
+                          ultimo_resultado = excluded.ultimo_resultado,
+                          ultimo_erro = excluded.ultimo_erro,
+                          execucoes = agendador_jobs.execucoes + 1,
+                          falhas = agendador_jobs.falhas + excluded.falhas,
+                          duracao_total_ms = agendador_jobs.duracao_total_ms + excluded.duracao_total_ms
+                        """
+                    ),
+                    {
+                        "nome": job.nome,
+                        "quando": inicio_exec,
+                        "status": status,
+                        "duracao": duracao_ms,
+                        "resultado": json.dumps(resultado, default=str),
+                        "erro": erro,
+                        "falha": 1 if erro else 0,
+                    },
+                )
+                await db.commit()
+                return {"nome": job.nome, "status": status, "duracao_ms": duracao_ms, "resultado": resultado, "erro": erro}
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:classe, :chave)"), {"classe": ADVISORY_AGENDADOR, "chave": chave})
+            await conn.commit()
+
+
+async def _loop():
+    while True:
+        try:
+            for job in JOBS:
+                await executar_job_agendado(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Agendador: erro no ciclo")
+        await asyncio.sleep(TICK_SEGUNDOS)
+
+
+async def iniciar_agendador(ativo: bool = True):
+    global _tarefa
+    if not ativo or _tarefa is not None:
+        return
+    async with SessionLocal() as db:
+        await ensure_agendador_table(db)
+    _tarefa = asyncio.create_task(_loop())
+
+
+async def parar_agendador():
+    global _tarefa
+    if _tarefa is None:
+        return
+    _tarefa.cancel()
+    await asyncio.gather(_tarefa, return_exceptions=True)
+    _tarefa = None
@@ -0,0 +1,22 @@
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Postgres aceita ate 32767 parametros por statement; o lote e dimensionado pelo numero de colunas.
+MAX_PARAMETROS = 30000
+
+
+async def inserir_em_lote(db: AsyncSession, model, linhas: list[dict]) -> list[int]:
+    """
+    Insere as linhas com INSERT multi-row ... RETURNING id e devolve os ids na ordem de entrada.
+    Um round trip por lote (na pratica, um unico para parcelas/recorrencias). Nao faz commit.
+    """
+    if not linhas:
+        return []
+    colunas = max(len(l) for l in linhas)
+    tamanho = max(1, MAX_PARAMETROS // max(1, colunas))
+    ids: list[int] = []
+    for inicio in range(0, len(linhas), tamanho):
+        lote = linhas[inicio : inicio + tamanho]
+        res = await db.execute(insert(model).values(lote).returning(model.id))
+        ids.extend(int(r[0]) for r in res.all())
+    return ids
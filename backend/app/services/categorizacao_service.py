@@ -0,0 +1,153 @@
+import re
+import unicodedata
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+BACKFILL_CHUNK = 1000
+
+# Matcher compilado por processo; a versao vem do banco para que todos os workers
+# enxerguem alteracoes feitas por qualquer um deles.
+_cache: dict = {"versao": None, "regex": None, "regras": {}}
+
+
+def normalizar(s: str | None) -> str:
+    return unicodedata.normalize("NFKD", s or "").encode("ascii", "ignore").decode("ascii").lower()
+
+
+async def ensure_regras_categorizacao_table(db: AsyncSession):
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS regras_categorizacao (
+              id SERIAL PRIMARY KEY,
+              padrao VARCHAR(120) NOT NULL,
+              categoria VARCHAR(120) NOT NULL,
+              subcategoria VARCHAR(120),
+              prioridade INTEGER NOT NULL DEFAULT 100,
+              status VARCHAR(20) NOT NULL DEFAULT 'ativo',
+              updated_at TIMESTAMP DEFAULT NOW()
+            )
+            """
+        )
+    )
+    await db.commit()
+
+
+async def _versao_regras(db: AsyncSession) -> tuple:
+    row = (await db.execute(text("SELECT COUNT(*), MAX(updated_at) FROM regras_categorizacao"))).first()
+    return (int(row[0] or 0), row[1])
+
+
+async def obter_matcher(db: AsyncSession):
+    """
+    Compila todas as regras ativas numa unica regex de alternancia com um grupo nomeado por regra
+    (r<id>), cada um dentro de um lookahead: o match tem largura zero, entao o finditer testa todas
+    as posicoes e um padrao que comeca antes nao consome o texto de outro que se sobrepoe.
+    Recompila apenas quando a versao (quantidade + ultimo updated_at) muda.
+    """
+    versao = await _versao_regras(db)
+    if _cache["versao"] == versao:
+        return _cache["regex"], _cache["regras"]
+
+    rows = (
+        await db.execute(
+            text(
+                """
+                SELECT id, padrao, categoria, subcategoria, prioridade
+                FROM regras_categorizacao
+                WHERE LOWER(COALESCE(status, 'ativo')) = 'ativo'
+                ORDER BY prioridade ASC, id ASC
+                """
+            )
+        )
+    ).all()
+    regras = {}
+    partes = []
+    for ordem, r in enumerate(rows):
+        padrao = normalizar(r[1]).strip()
+        if not padrao:
+            continue
+        regras[f"r{r[0]}"] = {"ordem": ordem, "categoria": r[2], "subcategoria": r[3]}
+        partes.append(f"(?=(?P<r{r[0]}>{re.escape(padrao)}))")
+    regex = re.compile("|".join(partes)) if partes else None
+    _cache.update(versao=versao, regex=regex, regras=regras)
+    return regex, regras
+
+
+def aplicar_matcher(regex, regras: dict, descricao: str | None) -> tuple[str, str | None] | None:
+    """
+    Entre as regras que casam na descricao, vence a de menor prioridade (ordem). As alternativas
+    estao em ordem de prioridade, entao em cada posicao o grupo reportado ja e o melhor dali.
+    """
+    if regex is None or not descricao:
+        return None
+    melhor = None
+    for m in regex.finditer(normalizar(descricao)):
+        regra = regras[m.lastgroup]
+        if melhor is None or regra["ordem"] < melhor["ordem"]:
+            melhor = regra
+            if regra["ordem"] == 0:
+                break
+    return (melhor["categoria"], melhor["subcategoria"]) if melhor else None
+
+
+async def categorizar(db: AsyncSession, descricao: str | None) -> tuple[str | None, str | None]:
+    # Nao roda DDL aqui (ensure_* faz commit): e chamado no meio de transacoes de pagamento.
+    # A tabela e garantida por ledger_service.ensure_ledger_schema.
+    regex, regras = await obter_matcher(db)
+    return aplicar_matcher(regex, regras, descricao) or (None, None)
+
+
+async def backfill_categorias(db: AsyncSession) -> int:
+    """
+    Categoriza movimentos historicos sem categoria em lotes por id (keyset), com um
+    UPDATE ... FROM unnest por lote e commit a cada lote para nao segurar locks longos.
+    """
+    await ensure_regras_categorizacao_table(db)
+    regex, regras = await obter_matcher(db)
+    if regex is None:
+        return 0
+    ultimo_id = 0
+    total = 0
+    while True:
+        rows = (
+            await db.execute(
+                text(
+                    """
+                    SELECT id, descricao
+                    FROM movimentos_bancarios
+                    WHERE categoria IS NULL AND id > :ultimo_id
+                    ORDER BY id
+                    LIMIT :limite
+                    """
+                ),
+                {"ultimo_id": ultimo_id, "limite": BACKFILL_CHUNK},
+            )
+        ).all()
+        if not rows:
+            break
+        ultimo_id = int(rows[-1][0])
+        ids, categorias, subcategorias = [], [], []
+        for r in rows:
+            res = aplicar_matcher(regex, regras, r[1])
+            if res:
+                ids.append(int(r[0]))
+                categorias.append(res[0])
+                subcategorias.append(res[1])
+        if ids:
+            await db.execute(
+                text(
+                    """
+                    UPDATE movimentos_bancarios m
+                    SET categoria = v.categoria, subcategoria = v.subcategoria, updated_at = NOW()
+                    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:categorias AS VARCHAR[]), CAST(:subcategorias AS VARCHAR[]))
+                         AS v(id, categoria, subcategoria)
+                    WHERE m.id = v.id AND m.categoria IS NULL
+                    """
+                ),
+                {"ids": ids, "categorias": categorias, "subcategorias": subcategorias},
+            )
+            total += len(ids)
+        await db.commit()
+    return total
@@ -0,0 +1,326 @@
+import codecs
+import csv
+import hashlib
+import re
+import unicodedata
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+CHUNK_SIZE = 64 * 1024
+# classid do advisory lock que serializa importacoes de extrato da mesma conta bancaria.
+ADVISORY_EXTRATO = 40003
+
+
+@dataclass(slots=True)
+class LinhaExtrato:
+    data: date
+    valor: float
+    descricao: str
+    fitid: str | None = None
+
+
+async def ensure_extrato_linhas_table(db: AsyncSession):
+    """Linhas de extrato ja importadas por conta: reimportar o mesmo arquivo nao liquida de novo."""
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS extrato_linhas_importadas (
+              conta_bancaria_id INTEGER NOT NULL REFERENCES contas_bancarias(id) ON DELETE CASCADE,
+              fitid VARCHAR(120) NOT NULL,
+              data DATE NOT NULL,
+              valor NUMERIC(12,2) NOT NULL,
+              importado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+              PRIMARY KEY (conta_bancaria_id, fitid)
+            )
+            """
+        )
+    )
+    await db.commit()
+
+
+def identificar_linhas(linhas: list[LinhaExtrato]):
+    """
+    Preenche fitid nas linhas sem identificador do banco (CSV, OFX incompleto) com um hash de
+    data/valor/descricao + ordem da repeticao no arquivo: duas linhas iguais no mesmo extrato
+    continuam distintas, e o mesmo arquivo reimportado gera os mesmos ids.
+    """
+    repeticoes: dict[str, int] = {}
+    for linha in linhas:
+        if linha.fitid:
+            continue
+        base = f"{linha.data.isoformat()}|{linha.valor:.2f}|{linha.descricao.strip().lower()}"
+        repeticoes[base] = repeticoes.get(base, 0) + 1
+        linha.fitid = "h:" + hashlib.sha1(f"{base}|{repeticoes[base]}".encode("utf-8")).hexdigest()
+
+
+async def separar_ja_importadas(
+    db: AsyncSession, conta_bancaria_id: int, linhas: list[LinhaExtrato]
+) -> tuple[list[LinhaExtrato], list[LinhaExtrato]]:
+    """
+    (novas, duplicadas) pelo par (conta, fitid), so lendo: a linha so e gravada como importada
+    quando liquida uma conta ou e ignorada de proposito (registrar_linhas), e a que nao casou
+    volta na proxima importacao.
+    """
+    if not linhas:
+        return [], []
+    gravadas = set(
+        (
+            await db.execute(
+                text(
+                    """
+                    SELECT fitid FROM extrato_linhas_importadas
+                    WHERE conta_bancaria_id = :conta AND fitid = ANY(CAST(:fitids AS TEXT[]))
+                    """
+                ),
+                {"conta": conta_bancaria_id, "fitids": [l.fitid for l in linhas]},
+            )
+        ).scalars().all()
+    )
+    novas: list[LinhaExtrato] = []
+    duplicadas: list[LinhaExtrato] = []
+    vistas: set[str] = set()
+    for linha in linhas:
+        if linha.fitid in gravadas or linha.fitid in vistas:
+            duplicadas.append(linha)
+        else:
+            vistas.add(linha.fitid)
+            novas.append(linha)
+    return novas, duplicadas
+
+
+async def registrar_linhas(db: AsyncSession, conta_bancaria_id: int, linhas: list[LinhaExtrato]):
+    """Grava as linhas como importadas; sem commit, na mesma transacao da liquidacao."""
+    if not linhas:
+        return
+    await db.execute(
+        text(
+            """
+            INSERT INTO extrato_linhas_importadas (conta_bancaria_id, fitid, data, valor)
+            SELECT CAST(:conta AS INTEGER), e.fitid, e.data, e.valor
+            FROM unnest(CAST(:fitids AS TEXT[]), CAST(:datas AS DATE[]), CAST(:valores AS NUMERIC[])) AS e(fitid, data, valor)
+            ON CONFLICT (conta_bancaria_id, fitid) DO NOTHING
+            """
+        ),
+        {
+            "conta": conta_bancaria_id,
+            "fitids": [l.fitid for l in linhas],
+            "datas": [l.data for l in linhas],
+            "valores": [l.valor for l in linhas],
+        },
+    )
+
+
+def normalizar_texto(s: str | None) -> set[str]:
+    """Tokens sem acento/caixa/pontuacao; ignora tokens muito curtos (de, da, pg...)."""
+    s = unicodedata.normalize("NFKD", s or "").encode("ascii", "ignore").decode("ascii").lower()
+    return {t for t in re.split(r"[^a-z0-9]+", s) if len(t) > 2}
+
+
+def parse_valor(raw: str) -> float:
+    v = (raw or "").strip().replace("R$", "").replace(" ", "")
+    if "," in v and "." in v:
+        # 1.234,56 (BR) ou 1,234.56 (US): o ultimo separador e o decimal
+        v = v.replace(".", "").replace(",", ".") if v.rfind(",") > v.rfind(".") else v.replace(",", "")
+    elif "," in v:
+        v = v.replace(",", ".")
+    return float(v)
+
+
+def parse_data(raw: str) -> date:
+    v = (raw or "").strip()
+    for fmt in ("%Y%m%d", "%d/%m/%Y", "%Y-%m-%d", "%d/%m/%y"):
+        try:
+            return datetime.strptime(v[:10] if fmt != "%Y%m%d" else v[:8], fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"data invalida: {raw}")
+
+
+async def _ler_texto(arquivo: UploadFile):
+    """Le o upload em blocos, decodificando incrementalmente (OFX antigo costuma vir em cp1252)."""
+    primeiro = await arquivo.read(CHUNK_SIZE)
+    encoding = "cp1252" if b"CHARSET:1252" in primeiro.upper() else "utf-8"
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    chunk = primeiro
+    while chunk:
+        yield decoder.decode(chunk)
+        chunk = await arquivo.read(CHUNK_SIZE)
+    yield decoder.decode(b"", final=True)
+
+
+async def _linhas_texto(arquivo: UploadFile):
+    resto = ""
+    async for bloco in _ler_texto(arquivo):
+        resto += bloco
+        *linhas, resto = resto.split("\n")
+        for linha in linhas:
+            yield linha.rstrip("\r")
+    if resto:
+        yield resto.rstrip("\r")
+
+
+async def parse_ofx(arquivo: UploadFile):
+    """
+    Tokeniza por '<' em streaming, aceitando tanto OFX SGML (tags sem fechamento)
+    quanto XML. Emite uma LinhaExtrato a cada </STMTTRN>.
+    """
+    atual: dict[str, str] | None = None
+    resto = ""
+    async for bloco in _ler_texto(arquivo):
+        resto += bloco
+        *tokens, resto = resto.split("<")
+        for tok in tokens:
+            tag, _, valor = tok.partition(">")
+            tag = tag.strip().upper()
+            if tag == "STMTTRN":
+                atual = {}
+            elif tag == "/STMTTRN" and atual is not None:
+                try:
+                    yield LinhaExtrato(
+                        data=parse_data(atual.get("DTPOSTED", "")),
+                        valor=parse_valor(atual.get("TRNAMT", "")),
+                        descricao=" ".join(v for v in (atual.get("NAME"), atual.get("MEMO")) if v),
+                        fitid=atual.get("FITID"),
+                    )
+                except ValueError:
+                    pass
+                atual = None
+            elif atual is not None and tag and not tag.startswith("/"):
+                atual[tag] = valor.strip()
+
+
+async def parse_csv(arquivo: UploadFile):
+    """CSV com cabecalho contendo data, descricao/historico e valor (separador ; ou ,)."""
+    linhas = _linhas_texto(arquivo)
+    cabecalho = None
+    async for linha in linhas:
+        if linha.strip():
+            cabecalho = linha
+            break
+    if cabecalho is None:
+        return
+    delim = ";" if cabecalho.count(";") >= cabecalho.count(",") else ","
+    colunas = [c.strip().lower() for c in next(csv.reader([cabecalho], delimiter=delim))]
+
+    def idx(*nomes):
+        for i, c in enumerate(colunas):
+            if any(n in c for n in nomes):
+                return i
+        return None
+
+    i_data, i_valor, i_desc = idx("data"), idx("valor"), idx("descri", "hist", "memo")
+    if i_data is None or i_valor is None:
+        raise HTTPException(status_code=400, detail="CSV deve ter colunas data e valor")
+    async for linha in linhas:
+        if not linha.strip():
+            continue
+        campos = next(csv.reader([linha], delimiter=delim))
+        try:
+            yield LinhaExtrato(
+                data=parse_data(campos[i_data]),
+                valor=parse_valor(campos[i_valor]),
+                descricao=campos[i_desc] if i_desc is not None and i_desc < len(campos) else "",
+            )
+        except (ValueError, IndexError):
+            continue
+
+
+def _melhor_candidato(linha: LinhaExtrato, candidatos: list[dict], janela_dias: int, usados: set[int]):
+    tokens = normalizar_texto(linha.descricao)
+    melhor = None
+    melhor_chave = None
+    validos = 0
+    for c in candidatos:
+        if c["id"] in usados:
+            continue
+        distancia = abs((c["data"] - linha.data).days)
+        if distancia > janela_dias:
+            continue
+        validos += 1
+        score = len(tokens & c["tokens"]) / len(c["tokens"]) if c["tokens"] else 0.0
+        chave = (score, -distancia)
+        if melhor_chave is None or chave > melhor_chave:
+            melhor, melhor_chave = c, chave
+    if melhor is None:
+        return None
+    # Aceita por descricao parecida; sem pista textual, so quando o candidato e unico na janela.
+    if melhor_chave[0] >= 0.5 or validos == 1:
+        return melhor
+    return None
+
+
+async def conciliar(db: AsyncSession, linhas: list[LinhaExtrato], janela_dias: int = 5) -> dict:
+    """
+    Casa as linhas do extrato com contas em aberto: creditos -> contas_receber, debitos -> contas_pagar.
+    Indice em memoria por valor em centavos; dentro do balde filtra pela janela de datas e
+    desempata por similaridade da descricao (nome do aluno / descricao da conta a pagar).
+    """
+    if not linhas:
+        return {"receber": [], "pagar": [], "nao_conciliadas": []}
+    data_min = min(l.data for l in linhas) - timedelta(days=janela_dias)
+    data_max = max(l.data for l in linhas) + timedelta(days=janela_dias)
+
+    receber_rows = (
+        await db.execute(
+            text(
+                """
+                SELECT cr.id, cr.valor, cr.vencimento, COALESCE(u.nome, '') AS nome
+                FROM contas_receber cr
+                LEFT JOIN alunos a ON a.id = cr.aluno_id
+                LEFT JOIN usuarios u ON u.id = a.usuario_id
+                WHERE LOWER(COALESCE(cr.status, 'aberto')) = 'aberto'
+                  AND cr.vencimento BETWEEN :data_min AND :data_max
+                """
+            ),
+            {"data_min": data_min, "data_max": data_max},
+        )
+    ).all()
+    pagar_rows = (
+        await db.execute(
+            text(
+                """
+                SELECT id, valor, vencimento, COALESCE(descricao, '') AS descricao
+                FROM contas_pagar
+                WHERE LOWER(COALESCE(status, 'aberto')) = 'aberto'
+                  AND vencimento BETWEEN :data_min AND :data_max
+                """
+            ),
+            {"data_min": data_min, "data_max": data_max},
+        )
+    ).all()
+
+    indice_receber: dict[int, list[dict]] = {}
+    for r in receber_rows:
+        indice_receber.setdefault(round(float(r[1] or 0) * 100), []).append(
+            {"id": int(r[0]), "data": r[2], "tokens": normalizar_texto(r[3])}
+        )
+    indice_pagar: dict[int, list[dict]] = {}
+    for r in pagar_rows:
+        indice_pagar.setdefault(round(float(r[1] or 0) * 100), []).append(
+            {"id": int(r[0]), "data": r[2], "tokens": normalizar_texto(r[3])}
+        )
+
+    receber: list[dict] = []
+    pagar: list[dict] = []
+    nao_conciliadas: list[dict] = []
+    usados_receber: set[int] = set()
+    usados_pagar: set[int] = set()
+    for linha in linhas:
+        centavos = round(abs(linha.valor) * 100)
+        if linha.valor > 0:
+            match = _melhor_candidato(linha, indice_receber.get(centavos, []), janela_dias, usados_receber)
+            destino, usados = receber, usados_receber
+        else:
+            match = _melhor_candidato(linha, indice_pagar.get(centavos, []), janela_dias, usados_pagar)
+            destino, usados = pagar, usados_pagar
+        item = {"data": linha.data.strftime("%Y-%m-%d"), "valor": linha.valor, "descricao": linha.descricao, "fitid": linha.fitid}
+        if match is None:
+            nao_conciliadas.append(item)
+            continue
+        usados.add(match["id"])
+        destino.append({**item, "conta_id": match["id"], "data_pagamento": linha.data})
+    return {"receber": receber, "pagar": pagar, "nao_conciliadas": nao_conciliadas}
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# classid do advisory lock que serializa a (re)criacao de funcoes/triggers entre sessoes.
+ADVISORY_DDL = 40002
+
+
+@dataclass(frozen=True, slots=True)
+class FuncaoSql:
+    nome: str
+    versao: str
+    ddl: str  # CREATE OR REPLACE FUNCTION nome() ...
+
+
+@dataclass(frozen=True, slots=True)
+class TriggerSql:
+    nome: str
+    tabela: str
+    versao: str
+    ddl: str  # CREATE [CONSTRAINT] TRIGGER nome ... ON tabela ...
+
+
+# (tipo, nome, versao) ja conferidos no catalogo por este processo.
+_conferidos: set[tuple[str, str, str]] = set()
+
+
+def _chave(objeto: FuncaoSql | TriggerSql) -> tuple[str, str, str]:
+    return ("trigger" if isinstance(objeto, TriggerSql) else "funcao", objeto.nome, objeto.versao)
+
+
+async def _versoes_instaladas(db: AsyncSession, objetos: list) -> dict[tuple[str, str], str | None]:
+    """Versao gravada no COMMENT de cada objeto existente."""
+    rows = (
+        await db.execute(
+            text(
+                """
+                SELECT 'funcao', p.proname, obj_description(p.oid, 'pg_proc')
+                FROM pg_proc p
+                WHERE p.proname = ANY(CAST(:funcoes AS TEXT[]))
+                UNION ALL
+                SELECT 'trigger', t.tgname, obj_description(t.oid, 'pg_trigger')
+                FROM pg_trigger t
+                WHERE t.tgname = ANY(CAST(:triggers AS TEXT[]))
+                """
+            ),
+            {
+                "funcoes": [o.nome for o in objetos if isinstance(o, FuncaoSql)],
+                "triggers": [o.nome for o in objetos if isinstance(o, TriggerSql)],
+            },
+        )
+    ).all()
+    return {(r[0], r[1]): r[2] for r in rows}
+
+
+async def garantir_ddl(db: AsyncSession, *objetos: FuncaoSql | TriggerSql) -> list[str]:
+    """
+    Cria ou atualiza as funcoes/triggers cuja versao instalada (COMMENT do objeto) difere da
+    pedida e devolve os nomes aplicados. Trigger com definicao nova e recriado (DROP + CREATE).
+    Conferido uma vez, o objeto nao volta ao catalogo neste processo: CREATE OR REPLACE a cada
+    request invalida planos e, concorrente, falha com "tuple concurrently updated".
+    Nao faz commit: o chamador commita junto com o que depende dos objetos.
+    """
+    pendentes = [o for o in objetos if _chave(o) not in _conferidos]
+    if not pendentes:
+        return []
+    instaladas = await _versoes_instaladas(db, pendentes)
+    desatualizados = [o for o in pendentes if instaladas.get(_chave(o)[:2]) != o.versao]
+    _conferidos.update(_chave(o) for o in pendentes if o not in desatualizados)
+    if not desatualizados:
+        return []
+
+    await db.execute(text("SELECT pg_advisory_xact_lock(:classe, 0)"), {"classe": ADVISORY_DDL})
+    # Outra sessao pode ter aplicado enquanto esperavamos o lock.
+    instaladas = await _versoes_instaladas(db, desatualizados)
+    aplicados = []
+    for objeto in desatualizados:
+        if instaladas.get(_chave(objeto)[:2]) == objeto.versao:
+            continue
+        if isinstance(objeto, TriggerSql):
+            await db.execute(text(f"DROP TRIGGER IF EXISTS {objeto.nome} ON {objeto.tabela}"))
+            await db.execute(text(objeto.ddl))
+            await db.execute(text(f"COMMENT ON TRIGGER {objeto.nome} ON {objeto.tabela} IS '{objeto.versao}'"))
+        else:
+            await db.execute(text(objeto.ddl))
+            await db.execute(text(f"COMMENT ON FUNCTION {objeto.nome} IS '{objeto.versao}'"))
+        aplicados.append(objeto.nome)
+    return aplicados
@@ -0,0 +1,319 @@
+from datetime import date, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Contratos renovados por transacao; o progresso e gravado junto com cada lote.
+LOTE_CONTRATOS = 1000
+# Execucao "executando" sem heartbeat ha mais que isso e considerada interrompida (pode ser retomada).
+EXECUCAO_ORFA_APOS = timedelta(minutes=10)
+# Chave (classid) dos advisory locks do faturamento; o objid e o id da execucao.
+ADVISORY_FATURAMENTO = 38001
+
+# Mesmo mapeamento de alunos.recorrencia_to_meses, em SQL.
+MESES_RECORRENCIA_SQL = """
+    CASE LOWER(COALESCE(c.recorrencia, ''))
+      WHEN 'trimestral' THEN 3
+      WHEN 'semestral' THEN 6
+      WHEN 'anual' THEN 12
+      ELSE 1
+    END
+"""
+
+CONTRATOS_ELEGIVEIS_SQL = """
+    FROM aluno_contratos c
+    JOIN alunos a ON a.id = c.aluno_id
+    WHERE LOWER(COALESCE(c.status, 'ativo')) = 'ativo'
+      AND LOWER(COALESCE(a.status, 'ativo')) = 'ativo'
+      AND c.data_fim <= :janela_fim
+"""
+
+
+async def ensure_faturamento_tables(db: AsyncSession):
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS faturamento_execucoes (
+              id SERIAL PRIMARY KEY,
+              janela_fim DATE NOT NULL,
+              status VARCHAR(20) NOT NULL DEFAULT 'executando',
+              ultimo_contrato_id INTEGER NOT NULL DEFAULT 0,
+              contratos_renovados INTEGER NOT NULL DEFAULT 0,
+              contas_criadas INTEGER NOT NULL DEFAULT 0,
+              valor_total NUMERIC(14,2) NOT NULL DEFAULT 0,
+              erro TEXT,
+              iniciado_em TIMESTAMP DEFAULT NOW(),
+              atualizado_em TIMESTAMP DEFAULT NOW(),
+              finalizado_em TIMESTAMP
+            )
+            """
+        )
+    )
+    # No maximo uma execucao em andamento.
+    await db.execute(
+        text(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_faturamento_execucao_ativa
+            ON faturamento_execucoes ((1)) WHERE status = 'executando'
+            """
+        )
+    )
+    await db.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS ix_aluno_contratos_ativos_fim
+            ON aluno_contratos (data_fim, id)
+            WHERE LOWER(COALESCE(status, 'ativo')) = 'ativo'
+            """
+        )
+    )
+    await db.commit()
+
+
+def _execucao_to_dict(r) -> dict:
+    return {
+        "id": r[0],
+        "janela_fim": r[1].strftime("%Y-%m-%d") if r[1] else None,
+        "status": r[2],
+        "ultimo_contrato_id": r[3],
+        "contratos_renovados": int(r[4] or 0),
+        "contas_criadas": int(r[5] or 0),
+        "valor_total": float(r[6] or 0),
+        "erro": r[7],
+        "iniciado_em": r[8].strftime("%d/%m/%Y %H:%M:%S") if r[8] else None,
+        "finalizado_em": r[9].strftime("%d/%m/%Y %H:%M:%S") if r[9] else None,
+    }
+
+
+async def obter_execucao(db: AsyncSession, execucao_id: int) -> dict | None:
+    r = (
+        await db.execute(
+            text(
+                """
+                SELECT id, janela_fim, status, ultimo_contrato_id, contratos_renovados, contas_criadas,
+                       valor_total, erro, iniciado_em, finalizado_em
+                FROM faturamento_execucoes
+                WHERE id = :id
+                """
+            ),
+            {"id": execucao_id},
+        )
+    ).first()
+    return _execucao_to_dict(r) if r else None
+
+
+async def simular_faturamento(db: AsyncSession, janela_fim: date, amostra: int = 50) -> dict:
+    """Dry-run: o que uma execucao geraria agora, sem gravar nada."""
+    params = {"janela_fim": janela_fim}
+    tot = (
+        await db.execute(
+            text(
+                f"""
+                SELECT COUNT(*), COALESCE(SUM({MESES_RECORRENCIA_SQL}), 0), COALESCE(SUM(c.valor * {MESES_RECORRENCIA_SQL}), 0)
+                {CONTRATOS_ELEGIVEIS_SQL}
+                """
+            ),
+            params,
+        )
+    ).first()
+    rows = (
+        await db.execute(
+            text(
+                f"""
+                SELECT c.id, c.aluno_id, c.plano_nome, c.valor, c.data_fim,
+                       CAST(c.data_fim + make_interval(months => {MESES_RECORRENCIA_SQL}) AS DATE) AS novo_fim
+                {CONTRATOS_ELEGIVEIS_SQL}
+                ORDER BY c.id
+                LIMIT :amostra
+                """
+            ),
+            {**params, "amostra": amostra},
+        )
+    ).all()
+    return {
+        "dry_run": True,
+        "janela_fim": janela_fim.strftime("%Y-%m-%d"),
+        "contratos": int(tot[0] or 0),
+        "contas_a_criar": int(tot[1] or 0),
+        "valor_total": float(tot[2] or 0),
+        "amostra": [
+            {
+                "contrato_id": r[0],
+                "aluno_id": r[1],
+                "plano_nome": r[2],
+                "valor": float(r[3] or 0),
+                "novo_inicio": r[4].strftime("%Y-%m-%d"),
+                "novo_fim": r[5].strftime("%Y-%m-%d"),
+            }
+            for r in rows
+        ],
+    }
+
+
+async def iniciar_execucao(db: AsyncSession, janela_fim: date) -> int:
+    """
+    Cria a execucao, ou devolve a que ficou orfa (sem heartbeat) para ser retomada.
+    Uma execucao viva em andamento bloqueia outra (409).
+    """
+    ativa = (
+        await db.execute(
+            text("SELECT id, atualizado_em < NOW() - CAST(:orfa AS INTERVAL) FROM faturamento_execucoes WHERE status = 'executando'"),
+            {"orfa": EXECUCAO_ORFA_APOS},
+        )
+    ).first()
+    if ativa:
+        if not ativa[1]:
+            raise HTTPException(status_code=409, detail="Faturamento ja em execucao")
+        return int(ativa[0])
+    try:
+        row = (
+            await db.execute(
+                text("INSERT INTO faturamento_execucoes (janela_fim) VALUES (:janela_fim) RETURNING id"),
+                {"janela_fim": janela_fim},
+            )
+        ).first()
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Faturamento ja em execucao")
+    return int(row[0])
+
+
+async def executar_faturamento(db: AsyncSession, execucao_id: int) -> dict:
+    """
+    Renova os contratos ativos que terminam ate janela_fim: o periodo avanca (inicio = fim anterior)
+    e as parcelas mensais do novo periodo sao criadas. Cada lote e um unico statement
+    (SELECT ... FOR UPDATE SKIP LOCKED -> UPDATE contratos -> INSERT parcelas via generate_series)
+    commitado junto com o progresso, entao a execucao pode ser retomada de onde parou.
+    SKIP LOCKED nao espera contratos sendo editados; eles continuam elegiveis na proxima execucao.
+    """
+    while True:
+        # Dois processos nao avancam a mesma execucao ao mesmo tempo.
+        travou = (
+            await db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:classe, :id)"),
+                {"classe": ADVISORY_FATURAMENTO, "id": execucao_id},
+            )
+        ).scalar_one()
+        if not travou:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Faturamento ja em execucao")
+        execucao = (
+            await db.execute(
+                text(
+                    """
+                    SELECT janela_fim, ultimo_contrato_id, status
+                    FROM faturamento_execucoes
+                    WHERE id = :id
+                    FOR UPDATE
+                    """
+                ),
+                {"id": execucao_id},
+            )
+        ).first()
+        if not execucao:
+            raise HTTPException(status_code=404, detail="Execucao nao encontrada")
+        if execucao[2] != "executando":
+            await db.rollback()
+            break
+
+        try:
+            lote = (
+                await db.execute(
+                    text(
+                        f"""
+                        WITH alvo AS (
+                          SELECT c.id, {MESES_RECORRENCIA_SQL} AS meses
+                          {CONTRATOS_ELEGIVEIS_SQL}
+                            AND c.id > :ultimo_id
+                          ORDER BY c.id
+                          LIMIT :lote
+                          FOR UPDATE OF c SKIP LOCKED
+                        ),
+                        renovados AS (
+                          UPDATE aluno_contratos c
+                          SET data_inicio = c.data_fim,
+                              data_fim = CAST(c.data_fim + make_interval(months => alvo.meses) AS DATE)
+                          FROM alvo
+                          WHERE c.id = alvo.id
+                          RETURNING c.id, c.aluno_id, c.valor, c.data_inicio, alvo.meses
+                        ),
+                        contas AS (
+                          INSERT INTO contas_receber (contrato_id, aluno_id, vencimento, valor, status, created_at, updated_at)
+                          SELECT r.id, r.aluno_id, CAST(r.data_inicio + make_interval(months => g.i) AS DATE), r.valor, 'aberto', NOW(), NOW()
+                          FROM renovados r
+                          CROSS JOIN LATERAL generate_series(0, r.meses - 1) AS g(i)
+                          RETURNING valor
+                        )
+                        SELECT (SELECT MAX(id) FROM alvo),
+                               (SELECT COUNT(*) FROM renovados),
+                               (SELECT COUNT(*) FROM contas),
+                               (SELECT COALESCE(SUM(valor), 0) FROM contas)
+                        """
+                    ),
+                    {"janela_fim": execucao[0], "ultimo_id": int(execucao[1]), "lote": LOTE_CONTRATOS},
+                )
+            ).first()
+        except Exception as exc:
+            await db.rollback()
+            await db.execute(
+                text("UPDATE faturamento_execucoes SET status = 'erro', erro = :erro, atualizado_em = NOW() WHERE id = :id"),
+                {"erro": str(exc)[:2000], "id": execucao_id},
+            )
+            await db.commit()
+            raise
+
+        if lote[0] is None:
+            await db.execute(
+                text(
+                    """
+                    UPDATE faturamento_execucoes
+                    SET status = 'concluido', atualizado_em = NOW(), finalizado_em = NOW()
+                    WHERE id = :id
+                    """
+                ),
+                {"id": execucao_id},
+            )
+            await db.commit()
+            break
+
+        await db.execute(
+            text(
+                """
+                UPDATE faturamento_execucoes
+                SET ultimo_contrato_id = :ultimo_id,
+                    contratos_renovados = contratos_renovados + :renovados,
+                    contas_criadas = contas_criadas + :contas,
+                    valor_total = valor_total + :valor,
+                    atualizado_em = NOW()
+                WHERE id = :id
+                """
+            ),
+            {"ultimo_id": int(lote[0]), "renovados": int(lote[1]), "contas": int(lote[2]), "valor": lote[3], "id": execucao_id},
+        )
+        await db.commit()
+    return await obter_execucao(db, execucao_id)
+
+
+async def retomar_execucao(db: AsyncSession, execucao_id: int) -> dict:
+    """Reabre uma execucao interrompida (erro) a partir do ultimo lote gravado."""
+    try:
+        res = await db.execute(
+            text(
+                """
+                UPDATE faturamento_execucoes
+                SET status = 'executando', erro = NULL, atualizado_em = NOW()
+                WHERE id = :id AND status IN ('erro', 'executando')
+                """
+            ),
+            {"id": execucao_id},
+        )
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Outra execucao de faturamento esta em andamento")
+    if res.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Execucao nao encontrada ou ja concluida")
+    return await executar_faturamento(db, execucao_id)
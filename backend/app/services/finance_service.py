@@ -1,7 +1,105 @@
 ﻿from sqlalchemy import select, func, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import date, timedelta
-from app.models.entities import Aula, ContaReceber, ContaPagar, RegraComissao
+import time
+from app.models.entities import Aula, ContaReceber, ContaPagar, RegraComissao, MovimentoBancario
+from app.services.bulk_service import inserir_em_lote
+from app.services.categorizacao_service import aplicar_matcher, obter_matcher
+from app.services.ddl_service import FuncaoSql, TriggerSql, garantir_ddl
+from app.services.pagination import decode_cursor, encode_cursor
+from app.services.versoes_service import obter_versao
+
+# Valor com sinal de um movimento: entradas somam, qualquer outro tipo subtrai do saldo.
+MOVIMENTO_VALOR_SINAL = "CASE WHEN LOWER(COALESCE(m.tipo, '')) = 'entrada' THEN m.valor ELSE -m.valor END"
+
+# Checkpoints de saldo, unicos para o extrato geral e para o saldo por conta: acumulado dos
+# movimentos (sem saldos de abertura) de cada conta ao fim de uma data, com conta 0 para os
+# movimentos sem conta. Toda data tem uma linha por conta, entao o extrato soma as linhas da
+# data. Escrita retroativa apaga os checkpoints a partir da menor data afetada; o job regrava.
+SEM_CONTA = 0
+EXTRATO_CHECKPOINT_FUNCAO = FuncaoSql(
+    "movimentos_invalida_saldo_checkpoint",
+    "2",
+    """
+    CREATE OR REPLACE FUNCTION movimentos_invalida_saldo_checkpoint() RETURNS trigger AS $fn$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        DELETE FROM saldos_checkpoint WHERE data >= (SELECT MIN(data_movimento) FROM novas);
+      ELSIF TG_OP = 'DELETE' THEN
+        DELETE FROM saldos_checkpoint WHERE data >= (SELECT MIN(data_movimento) FROM antigas);
+      ELSE
+        DELETE FROM saldos_checkpoint
+        WHERE data >= (
+          SELECT MIN(LEAST(a.data_movimento, n.data_movimento))
+          FROM antigas a
+          JOIN novas n ON n.id = a.id
+          WHERE (a.data_movimento, a.tipo, a.valor, a.conta_bancaria_id)
+                IS DISTINCT FROM (n.data_movimento, n.tipo, n.valor, n.conta_bancaria_id)
+        );
+      END IF;
+      RETURN NULL;
+    END
+    $fn$ LANGUAGE plpgsql
+    """,
+)
+EXTRATO_CHECKPOINT_TRIGGERS = (
+    TriggerSql(
+        "tg_movimentos_saldo_checkpoint_ins",
+        "movimentos_bancarios",
+        "1",
+        """
+        CREATE TRIGGER tg_movimentos_saldo_checkpoint_ins
+        AFTER INSERT ON movimentos_bancarios REFERENCING NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION movimentos_invalida_saldo_checkpoint()
+        """,
+    ),
+    TriggerSql(
+        "tg_movimentos_saldo_checkpoint_upd",
+        "movimentos_bancarios",
+        "1",
+        """
+        CREATE TRIGGER tg_movimentos_saldo_checkpoint_upd
+        AFTER UPDATE ON movimentos_bancarios REFERENCING OLD TABLE AS antigas NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION movimentos_invalida_saldo_checkpoint()
+        """,
+    ),
+    TriggerSql(
+        "tg_movimentos_saldo_checkpoint_del",
+        "movimentos_bancarios",
+        "1",
+        """
+        CREATE TRIGGER tg_movimentos_saldo_checkpoint_del
+        AFTER DELETE ON movimentos_bancarios REFERENCING OLD TABLE AS antigas
+        FOR EACH STATEMENT EXECUTE FUNCTION movimentos_invalida_saldo_checkpoint()
+        """,
+    ),
+)
+
+
+# contas_receber.status gravado sempre minusculo e sem NULL ('aberto'), para os filtros
+# compararem a coluna direto e usarem os indices.
+STATUS_RECEBER_FUNCAO = FuncaoSql(
+    "contas_receber_normaliza_status",
+    "1",
+    """
+    CREATE OR REPLACE FUNCTION contas_receber_normaliza_status() RETURNS trigger AS $fn$
+    BEGIN
+      NEW.status := LOWER(COALESCE(NULLIF(TRIM(NEW.status), ''), 'aberto'));
+      RETURN NEW;
+    END
+    $fn$ LANGUAGE plpgsql
+    """,
+)
+STATUS_RECEBER_TRIGGER = TriggerSql(
+    "tg_contas_receber_normaliza_status",
+    "contas_receber",
+    "1",
+    """
+    CREATE TRIGGER tg_contas_receber_normaliza_status
+    BEFORE INSERT OR UPDATE OF status ON contas_receber
+    FOR EACH ROW EXECUTE FUNCTION contas_receber_normaliza_status()
+    """,
+)
 
 
 async def ensure_contas_receber_columns(db: AsyncSession):
@@ -22,6 +120,268 @@ async def ensure_contas_receber_columns(db: AsyncSession):
               ) THEN
                 ALTER TABLE contas_receber ADD COLUMN conta_bancaria_id INTEGER;
               END IF;
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'contas_receber' AND column_name = 'em_atraso'
+              ) THEN
+                ALTER TABLE contas_receber ADD COLUMN em_atraso BOOLEAN NOT NULL DEFAULT FALSE;
+              END IF;
+            END $$;
+            """
+        )
+    )
+    aplicados = await garantir_ddl(db, STATUS_RECEBER_FUNCAO, STATUS_RECEBER_TRIGGER)
+    if STATUS_RECEBER_TRIGGER.nome in aplicados:
+        # Linhas antigas ('Aberto', NULL...) normalizadas uma vez, junto com o trigger.
+        await db.execute(
+            text(
+                """
+                UPDATE contas_receber SET status = LOWER(COALESCE(NULLIF(TRIM(status), ''), 'aberto'))
+                WHERE status IS DISTINCT FROM LOWER(COALESCE(NULLIF(TRIM(status), ''), 'aberto'))
+                """
+            )
+        )
+        await db.execute(text("ALTER TABLE contas_receber ALTER COLUMN status SET DEFAULT 'aberto'"))
+    # Listagem filtrada por status na ordem do keyset (vencimento DESC, id DESC).
+    await db.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_contas_receber_status_vencimento_id ON contas_receber (status, vencimento, id)")
+    )
+    # Parciais: contas em aberto (marcacao noturna) e contas ja marcadas em atraso (aging / KPIs).
+    await db.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS ix_contas_receber_abertas_vencimento
+            ON contas_receber (vencimento)
+            WHERE LOWER(COALESCE(status, 'aberto')) = 'aberto'
+            """
+        )
+    )
+    await db.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS ix_contas_receber_em_atraso
+            ON contas_receber (aluno_id, vencimento) INCLUDE (valor)
+            WHERE em_atraso
+            """
+        )
+    )
+    await db.commit()
+    await ensure_saldo_devedor(db)
+
+
+async def marcar_contas_vencidas(db: AsyncSession, hoje: date | None = None) -> dict:
+    """
+    Job noturno: marca em_atraso nas contas em aberto vencidas e desmarca as que deixaram de estar
+    (pagas, ou com vencimento remarcado). Dois UPDATEs set-based, cada um servido por um indice parcial.
+    """
+    hoje = hoje or date.today()
+    marcadas = await db.execute(
+        text(
+            """
+            UPDATE contas_receber
+            SET em_atraso = TRUE
+            WHERE LOWER(COALESCE(status, 'aberto')) = 'aberto'
+              AND vencimento < :hoje
+              AND NOT em_atraso
+            """
+        ),
+        {"hoje": hoje},
+    )
+    desmarcadas = await db.execute(
+        text(
+            """
+            UPDATE contas_receber
+            SET em_atraso = FALSE
+            WHERE em_atraso
+              AND (LOWER(COALESCE(status, 'aberto')) <> 'aberto' OR vencimento >= :hoje)
+            """
+        ),
+        {"hoje": hoje},
+    )
+    await db.commit()
+    return {"marcadas": int(marcadas.rowcount or 0), "desmarcadas": int(desmarcadas.rowcount or 0)}
+
+
+CONTA_ABERTA = "LOWER(COALESCE(status, 'aberto')) = 'aberto'"
+
+# Saldo devedor real por aluno (fonte da verdade para o valor denormalizado em alunos.saldo_devedor).
+SALDO_DEVEDOR_REAL_SQL = """
+    SELECT a.id AS aluno_id, COALESCE(SUM(cr.valor), 0) AS saldo
+    FROM alunos a
+    LEFT JOIN contas_receber cr ON cr.aluno_id = a.id AND LOWER(COALESCE(cr.status, 'aberto')) = 'aberto'
+    GROUP BY a.id
+"""
+
+SALDO_DEVEDOR_FUNCAO = FuncaoSql(
+    "contas_receber_saldo_devedor",
+    "1",
+    f"""
+    CREATE OR REPLACE FUNCTION contas_receber_saldo_devedor() RETURNS trigger AS $fn$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        UPDATE alunos a SET saldo_devedor = a.saldo_devedor + d.delta
+        FROM (
+          SELECT aluno_id, SUM(COALESCE(valor, 0)) AS delta
+          FROM novas WHERE {CONTA_ABERTA} GROUP BY aluno_id
+        ) d
+        WHERE a.id = d.aluno_id AND d.delta <> 0;
+      ELSIF TG_OP = 'DELETE' THEN
+        UPDATE alunos a SET saldo_devedor = a.saldo_devedor - d.delta
+        FROM (
+          SELECT aluno_id, SUM(COALESCE(valor, 0)) AS delta
+          FROM antigas WHERE {CONTA_ABERTA} GROUP BY aluno_id
+        ) d
+        WHERE a.id = d.aluno_id AND d.delta <> 0;
+      ELSE
+        UPDATE alunos a SET saldo_devedor = a.saldo_devedor + d.delta
+        FROM (
+          SELECT aluno_id, SUM(delta) AS delta
+          FROM (
+            SELECT aluno_id, COALESCE(valor, 0) AS delta FROM novas WHERE {CONTA_ABERTA}
+            UNION ALL
+            SELECT aluno_id, -COALESCE(valor, 0) FROM antigas WHERE {CONTA_ABERTA}
+          ) x
+          GROUP BY aluno_id
+        ) d
+        WHERE a.id = d.aluno_id AND d.delta <> 0;
+      END IF;
+      RETURN NULL;
+    END
+    $fn$ LANGUAGE plpgsql
+    """,
+)
+SALDO_DEVEDOR_TRIGGERS = (
+    TriggerSql(
+        "tg_contas_receber_saldo_devedor_ins",
+        "contas_receber",
+        "1",
+        """
+        CREATE TRIGGER tg_contas_receber_saldo_devedor_ins
+        AFTER INSERT ON contas_receber REFERENCING NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION contas_receber_saldo_devedor()
+        """,
+    ),
+    TriggerSql(
+        "tg_contas_receber_saldo_devedor_upd",
+        "contas_receber",
+        "1",
+        """
+        CREATE TRIGGER tg_contas_receber_saldo_devedor_upd
+        AFTER UPDATE ON contas_receber REFERENCING OLD TABLE AS antigas NEW TABLE AS novas
+        FOR EACH STATEMENT EXECUTE FUNCTION contas_receber_saldo_devedor()
+        """,
+    ),
+    TriggerSql(
+        "tg_contas_receber_saldo_devedor_del",
+        "contas_receber",
+        "1",
+        """
+        CREATE TRIGGER tg_contas_receber_saldo_devedor_del
+        AFTER DELETE ON contas_receber REFERENCING OLD TABLE AS antigas
+        FOR EACH STATEMENT EXECUTE FUNCTION contas_receber_saldo_devedor()
+        """,
+    ),
+)
+
+
+async def ensure_saldo_devedor(db: AsyncSession):
+    """
+    alunos.saldo_devedor = soma das contas a receber em aberto do aluno, mantida por triggers de
+    statement em contas_receber (com transition tables): qualquer caminho de escrita (contrato,
+    pagamento, desconto, exclusao, inserts em lote) aplica o delta agregado por aluno.
+    """
+    await db.execute(
+        text(
+            """
+            DO $$
+            BEGIN
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'alunos' AND column_name = 'saldo_devedor'
+              ) THEN
+                ALTER TABLE alunos ADD COLUMN saldo_devedor NUMERIC(12,2) NOT NULL DEFAULT 0;
+              END IF;
+            END $$;
+            """
+        )
+    )
+    aplicados = await garantir_ddl(db, SALDO_DEVEDOR_FUNCAO, *SALDO_DEVEDOR_TRIGGERS)
+    if any(t.nome in aplicados for t in SALDO_DEVEDOR_TRIGGERS):
+        # Triggers e carga inicial na mesma transacao: CREATE TRIGGER bloqueia escritas em
+        # contas_receber ate o commit, entao a carga nao perde lancamentos concorrentes.
+        await db.execute(
+            text(
+                f"""
+                UPDATE alunos a SET saldo_devedor = r.saldo
+                FROM ({SALDO_DEVEDOR_REAL_SQL}) r
+                WHERE a.id = r.aluno_id
+                """
+            )
+        )
+    await db.execute(text("CREATE INDEX IF NOT EXISTS ix_alunos_saldo_devedor ON alunos (saldo_devedor) WHERE saldo_devedor > 0"))
+    await db.commit()
+
+
+async def verificar_saldo_devedor(db: AsyncSession, corrigir: bool = True) -> list[dict]:
+    """
+    Verificador de consistencia: recalcula o saldo devedor de todos os alunos numa passada e
+    devolve as divergencias; com corrigir=True grava o valor real no mesmo statement.
+    """
+    if corrigir:
+        # Sem isso, um pagamento concorrente aplicaria seu delta e seria sobrescrito pela foto antiga.
+        await db.execute(text("LOCK TABLE contas_receber IN SHARE MODE"))
+    divergentes_sql = f"""
+        SELECT a.id, a.saldo_devedor AS armazenado, r.saldo AS calculado
+        FROM alunos a
+        JOIN ({SALDO_DEVEDOR_REAL_SQL}) r ON r.aluno_id = a.id
+        WHERE a.saldo_devedor <> r.saldo
+    """
+    if corrigir:
+        sql = f"""
+            WITH divergentes AS ({divergentes_sql})
+            UPDATE alunos a SET saldo_devedor = d.calculado
+            FROM divergentes d
+            WHERE a.id = d.id
+            RETURNING d.id, d.armazenado, d.calculado
+        """
+    else:
+        sql = divergentes_sql
+    rows = (await db.execute(text(sql))).all()
+    await db.commit()
+    return [{"aluno_id": r[0], "armazenado": float(r[1] or 0), "calculado": float(r[2] or 0)} for r in rows]
+
+
+async def ensure_contas_bancarias_table(db: AsyncSession):
+    """
+    contas_bancarias.saldo era o saldo atual, somado a cada pagamento. Com o livro-razao o saldo
+    atual e derivado dos movimentos e o valor gravado e so o de abertura: a coluna e renomeada
+    para saldo_abertura, e quem ainda le "saldo" falha em vez de receber outro significado.
+    """
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS contas_bancarias (
+              id SERIAL PRIMARY KEY,
+              nome_conta VARCHAR(120) NOT NULL,
+              banco VARCHAR(120) NOT NULL,
+              agencia VARCHAR(40) NOT NULL,
+              cc VARCHAR(40) NOT NULL,
+              saldo_abertura NUMERIC(12,2) NOT NULL DEFAULT 0
+            )
+            """
+        )
+    )
+    await db.execute(
+        text(
+            """
+            DO $$
+            BEGIN
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'contas_bancarias' AND column_name = 'saldo_abertura'
+              ) THEN
+                ALTER TABLE contas_bancarias RENAME COLUMN saldo TO saldo_abertura;
+              END IF;
             END $$;
             """
         )
@@ -30,6 +390,7 @@ async def ensure_contas_receber_columns(db: AsyncSession):
 
 
 async def ensure_movimentos_columns(db: AsyncSession):
+    await ensure_contas_bancarias_table(db)
     await db.execute(
         text(
             """
@@ -47,13 +408,104 @@ async def ensure_movimentos_columns(db: AsyncSession):
               ) THEN
                 ALTER TABLE movimentos_bancarios ADD COLUMN subcategoria VARCHAR(120);
               END IF;
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'movimentos_bancarios' AND column_name = 'conta_bancaria_id'
+              ) THEN
+                ALTER TABLE movimentos_bancarios ADD COLUMN conta_bancaria_id INTEGER;
+              END IF;
             END $$;
             """
         )
     )
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS movimentos_saldo_inicial (
+              id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+              valor NUMERIC(12,2) NOT NULL DEFAULT 0,
+              updated_at TIMESTAMP DEFAULT NOW()
+            )
+            """
+        )
+    )
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS saldos_checkpoint (
+              conta_bancaria_id INTEGER NOT NULL,
+              data DATE NOT NULL,
+              acumulado NUMERIC(14,2) NOT NULL,
+              created_at TIMESTAMP DEFAULT NOW(),
+              PRIMARY KEY (conta_bancaria_id, data)
+            )
+            """
+        )
+    )
+    await db.execute(text("CREATE INDEX IF NOT EXISTS ix_saldos_checkpoint_data ON saldos_checkpoint (data)"))
+    # Cobre o extrato paginado e o acumulado anterior a pagina (index-only scan).
+    await db.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_movimentos_data_id ON movimentos_bancarios (data_movimento, id) INCLUDE (tipo, valor)"
+        )
+    )
+    aplicados = await garantir_ddl(db, EXTRATO_CHECKPOINT_FUNCAO, *EXTRATO_CHECKPOINT_TRIGGERS)
+    if EXTRATO_CHECKPOINT_FUNCAO.nome in aplicados:
+        # Substitui os dois sistemas anteriores (extrato geral e saldo por conta); sao so caches,
+        # o job de checkpoints regrava tudo em saldos_checkpoint.
+        await db.execute(text("DROP TRIGGER IF EXISTS tg_movimentos_invalida_checkpoint ON movimentos_bancarios"))
+        await db.execute(text("DROP FUNCTION IF EXISTS movimentos_invalida_checkpoint()"))
+        await db.execute(text("DROP TABLE IF EXISTS saldos_bancarios_checkpoint"))
+        await db.execute(text("DROP TABLE IF EXISTS movimentos_saldo_checkpoint"))
     await db.commit()
 
 
+async def gerar_checkpoints_extrato(db: AsyncSession, data_ref: date | None = None) -> int:
+    """
+    (Re)grava o acumulado de cada conta (e dos movimentos sem conta) no fim de cada mes ate
+    data_ref e em data_ref (por padrao ontem), numa passada agregada por conta e mes. Toda data
+    recebe uma linha por conta, mesmo sem movimento no mes, para o extrato somar a data inteira.
+    """
+    data_ref = data_ref or (date.today() - timedelta(days=1))
+    res = await db.execute(
+        text(
+            f"""
+            WITH deltas AS (
+              SELECT COALESCE(m.conta_bancaria_id, {SEM_CONTA}) AS conta,
+                     LEAST(CAST(date_trunc('month', m.data_movimento) + INTERVAL '1 month - 1 day' AS DATE),
+                           CAST(:data AS DATE)) AS data,
+                     SUM({MOVIMENTO_VALOR_SINAL}) AS delta
+              FROM movimentos_bancarios m
+              WHERE m.data_movimento <= :data
+              GROUP BY 1, 2
+            ),
+            datas AS (
+              SELECT data FROM deltas
+              UNION
+              SELECT CAST(:data AS DATE)
+            ),
+            contas AS (
+              SELECT conta FROM deltas
+              UNION
+              SELECT id FROM contas_bancarias
+              UNION
+              SELECT {SEM_CONTA}
+            )
+            INSERT INTO saldos_checkpoint (conta_bancaria_id, data, acumulado, created_at)
+            SELECT c.conta, d.data,
+                   SUM(COALESCE(x.delta, 0)) OVER (PARTITION BY c.conta ORDER BY d.data),
+                   NOW()
+            FROM contas c
+            CROSS JOIN datas d
+            LEFT JOIN deltas x ON x.conta = c.conta AND x.data = d.data
+            ON CONFLICT (conta_bancaria_id, data) DO UPDATE SET acumulado = excluded.acumulado, created_at = NOW()
+            """
+        ),
+        {"data": data_ref},
+    )
+    return int(res.rowcount or 0)
+
+
 async def gerar_comissao(db: AsyncSession):
     hoje = date.today()
     inicio_mes_atual = hoje.replace(day=1)
@@ -145,3 +597,401 @@ async def dre(db: AsyncSession):
             {"categoria": r[0], "subcategoria": r[1], "total": float(r[2] or 0)} for r in detalhamento_receitas
         ],
     }
+
+
+async def listar_movimentos(
+    db: AsyncSession,
+    tipo: str | None = None,
+    categoria: str | None = None,
+    data_inicio: date | None = None,
+    data_fim: date | None = None,
+    cursor: str | None = None,
+    limit: int = 50,
+):
+    """
+    Extrato paginado (mais recentes primeiro) com saldo corrente por linha.
+
+    O saldo e sempre o do extrato completo (saldos de abertura das contas + saldo inicial dos
+    movimentos sem conta + todos os movimentos ate a linha), mesmo quando ha filtro por
+    tipo/categoria, e bate com a soma de saldos_em das contas: o acumulado anterior a pagina
+    parte da ultima data de saldos_checkpoint antes dela (soma das contas) e soma so o que vem
+    depois; a janela SUM() OVER percorre apenas o intervalo coberto pela pagina.
+
+    A primeira pagina (sem cursor) traz tambem os totais de entradas/saidas do filtro inteiro.
+    """
+    await ensure_movimentos_columns(db)
+    filtros = ""
+    params: dict[str, object] = {"limit": limit + 1}
+    if tipo:
+        filtros += " AND LOWER(COALESCE(m.tipo, '')) = LOWER(:tipo) "
+        params["tipo"] = tipo
+    if categoria:
+        filtros += " AND m.categoria = :categoria "
+        params["categoria"] = categoria
+    if data_inicio:
+        filtros += " AND m.data_movimento >= :data_inicio "
+        params["data_inicio"] = data_inicio
+    if data_fim:
+        filtros += " AND m.data_movimento <= :data_fim "
+        params["data_fim"] = data_fim
+    keyset = ""
+    if cursor:
+        cursor_data, cursor_id = decode_cursor(cursor, date, int)
+        keyset = " AND (m.data_movimento, m.id) < (:cursor_data, :cursor_id) "
+        params["cursor_data"] = cursor_data
+        params["cursor_id"] = cursor_id
+
+    rows = (
+        await db.execute(
+            text(
+                f"""
+                WITH pagina AS (
+                  SELECT m.id, m.data_movimento, m.tipo, m.valor, m.descricao, m.categoria, m.subcategoria
+                  FROM movimentos_bancarios m
+                  WHERE 1=1
+                  {filtros}
+                  {keyset}
+                  ORDER BY m.data_movimento DESC, m.id DESC
+                  LIMIT :limit
+                ),
+                limites AS (
+                  SELECT MIN(data_movimento) AS data_min, MAX(data_movimento) AS data_max FROM pagina
+                ),
+                checkpoint AS (
+                  SELECT c.data, SUM(c.acumulado) AS acumulado
+                  FROM saldos_checkpoint c
+                  WHERE c.data = (
+                    SELECT MAX(c2.data) FROM saldos_checkpoint c2, limites l WHERE c2.data < l.data_min
+                  )
+                  GROUP BY c.data
+                ),
+                anterior AS (
+                  SELECT COALESCE((SELECT acumulado FROM checkpoint), 0)
+                           + COALESCE(SUM({MOVIMENTO_VALOR_SINAL}), 0) AS acumulado
+                  FROM movimentos_bancarios m, limites l
+                  WHERE m.data_movimento < l.data_min
+                    AND m.data_movimento > COALESCE((SELECT data FROM checkpoint), CAST('-infinity' AS DATE))
+                ),
+                janela AS (
+                  SELECT m.id,
+                         SUM({MOVIMENTO_VALOR_SINAL}) OVER (ORDER BY m.data_movimento, m.id) AS acumulado
+                  FROM movimentos_bancarios m, limites l
+                  WHERE m.data_movimento BETWEEN l.data_min AND l.data_max
+                )
+                SELECT p.id, p.data_movimento, p.tipo, p.valor, p.descricao, p.categoria, p.subcategoria,
+                       COALESCE((SELECT valor FROM movimentos_saldo_inicial WHERE id = 1), 0)
+                         + COALESCE((SELECT SUM(saldo_abertura) FROM contas_bancarias), 0)
+                         + (SELECT acumulado FROM anterior) + j.acumulado AS saldo
+                FROM pagina p
+                JOIN janela j ON j.id = p.id
+                ORDER BY p.data_movimento DESC, p.id DESC
+                """
+            ),
+            params,
+        )
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+
+    totais = None
+    if not cursor:
+        t = (
+            await db.execute(
+                text(
+                    f"""
+                    SELECT COALESCE(SUM(m.valor) FILTER (WHERE LOWER(COALESCE(m.tipo, '')) = 'entrada'), 0),
+                           COALESCE(SUM(m.valor) FILTER (WHERE LOWER(COALESCE(m.tipo, '')) <> 'entrada'), 0),
+                           COUNT(*)
+                    FROM movimentos_bancarios m
+                    WHERE 1=1
+                    {filtros}
+                    """
+                ),
+                {k: v for k, v in params.items() if k != "limit"},
+            )
+        ).one()
+        entradas, saidas = float(t[0] or 0), float(t[1] or 0)
+        totais = {"entradas": entradas, "saidas": saidas, "resultado": round(entradas - saidas, 2), "quantidade": int(t[2] or 0)}
+    return {
+        "items": [
+            {
+                "id": r[0],
+                "data": r[1].strftime("%Y-%m-%d") if r[1] else None,
+                "data_br": r[1].strftime("%d/%m/%Y") if r[1] else "--",
+                "data_movimento": r[1].strftime("%d/%m/%Y") if r[1] else "--",
+                "tipo": r[2],
+                "valor": float(r[3] or 0),
+                "descricao": r[4] or "",
+                "categoria": r[5] or "",
+                "subcategoria": r[6] or "",
+                "saldo": float(r[7] or 0),
+            }
+            for r in rows
+        ],
+        "next_cursor": next_cursor,
+        "totais": totais,
+    }
+
+
+async def preencher_categorias(db: AsyncSession, movimentos: list[dict]):
+    """
+    Aplica as regras de categorizacao nos movimentos (dicts) que ainda nao tem categoria.
+    Requer a tabela de regras (ensure_ledger_schema) criada antes da transacao.
+    """
+    if all(m.get("categoria") for m in movimentos):
+        return
+    regex, regras = await obter_matcher(db)
+    for m in movimentos:
+        if not m.get("categoria"):
+            res = aplicar_matcher(regex, regras, m.get("descricao"))
+            if res:
+                m["categoria"], m["subcategoria"] = res
+
+
+async def liquidar_contas_receber(db: AsyncSession, itens: list[dict]) -> dict:
+    """
+    Liquida varias contas a receber numa unica transacao (sem commit: fica a cargo do chamador).
+
+    Cada item: {"conta_id", "data_pagamento" (date), "conta_bancaria_id" (int|None)}.
+    Apenas contas em aberto sao liquidadas; as demais voltam em "ignoradas".
+    Custo fixo: 1 UPDATE ... RETURNING com joins de aluno/plano e 1 INSERT multi-row de
+    movimentos. O saldo bancario e derivado dos movimentos (ver ledger_service).
+    """
+    if not itens:
+        return {"liquidadas": [], "ignoradas": [], "total": 0.0}
+
+    ids = [int(i["conta_id"]) for i in itens]
+    rows = (
+        await db.execute(
+            text(
+                """
+                WITH entrada AS (
+                  SELECT *
+                  FROM unnest(CAST(:ids AS INTEGER[]), CAST(:datas AS DATE[]), CAST(:bancos AS INTEGER[]))
+                       AS e(conta_id, data_pagamento, conta_bancaria_id)
+                ),
+                alvo AS (
+                  UPDATE contas_receber cr
+                  SET status = 'pago', data_pagamento = e.data_pagamento, conta_bancaria_id = e.conta_bancaria_id, em_atraso = FALSE
+                  FROM entrada e
+                  WHERE cr.id = e.conta_id
+                    AND LOWER(COALESCE(cr.status, 'aberto')) = 'aberto'
+                  RETURNING cr.id, cr.valor, cr.contrato_id, cr.aluno_id, cr.data_pagamento, cr.conta_bancaria_id
+                )
+                SELECT alvo.id, alvo.valor, alvo.data_pagamento, alvo.conta_bancaria_id,
+                       COALESCE(u.nome, '') AS aluno_nome,
+                       COALESCE(c.plano_nome, 'Sem plano') AS plano_nome,
+                       p.categoria, p.subcategoria
+                FROM alvo
+                LEFT JOIN alunos a ON a.id = alvo.aluno_id
+                LEFT JOIN usuarios u ON u.id = a.usuario_id
+                LEFT JOIN aluno_contratos c ON c.id = alvo.contrato_id
+                LEFT JOIN LATERAL (
+                  SELECT pl.categoria, pl.subcategoria
+                  FROM planos pl
+                  WHERE pl.nome = c.plano_nome
+                  ORDER BY pl.id DESC
+                  LIMIT 1
+                ) p ON TRUE
+                ORDER BY alvo.id
+                """
+            ),
+            {
+                "ids": ids,
+                "datas": [i["data_pagamento"] for i in itens],
+                "bancos": [int(i["conta_bancaria_id"]) if i.get("conta_bancaria_id") else None for i in itens],
+            },
+        )
+    ).all()
+    if not rows:
+        return {"liquidadas": [], "ignoradas": ids, "total": 0.0}
+
+    movimentos = [
+        {
+            "data_movimento": r[2],
+            "tipo": "entrada",
+            "valor": float(r[1] or 0),
+            "descricao": f"{r[4]} + {r[5]}",
+            "categoria": r[6],
+            "subcategoria": r[7],
+            "conta_bancaria_id": int(r[3]) if r[3] else None,
+        }
+        for r in rows
+    ]
+    await preencher_categorias(db, movimentos)
+    await inserir_em_lote(db, MovimentoBancario, movimentos)
+
+    liquidadas = [int(r[0]) for r in rows]
+    pagas = set(liquidadas)
+    return {
+        "liquidadas": liquidadas,
+        "ignoradas": [i for i in ids if i not in pagas],
+        "total": round(sum(float(r[1] or 0) for r in rows), 2),
+    }
+
+
+async def liquidar_contas_pagar(db: AsyncSession, itens: list[dict]) -> dict:
+    """Contraparte de liquidar_contas_receber para contas a pagar: 1 UPDATE ... RETURNING + 1 INSERT multi-row (saidas)."""
+    if not itens:
+        return {"liquidadas": [], "ignoradas": [], "total": 0.0}
+
+    ids = [int(i["conta_id"]) for i in itens]
+    rows = (
+        await db.execute(
+            text(
+                """
+                UPDATE contas_pagar cp
+                SET status = 'pago', data_pagamento = e.data_pagamento
+                FROM unnest(CAST(:ids AS INTEGER[]), CAST(:datas AS DATE[])) AS e(conta_id, data_pagamento)
+                WHERE cp.id = e.conta_id
+                  AND LOWER(COALESCE(cp.status, 'aberto')) = 'aberto'
+                RETURNING cp.id, cp.valor, cp.data_pagamento, cp.descricao, cp.categoria, cp.subcategoria
+                """
+            ),
+            {"ids": ids, "datas": [i["data_pagamento"] for i in itens]},
+        )
+    ).all()
+    if not rows:
+        return {"liquidadas": [], "ignoradas": ids, "total": 0.0}
+
+    bancos = {int(i["conta_id"]): (int(i["conta_bancaria_id"]) if i.get("conta_bancaria_id") else None) for i in itens}
+    movimentos = [
+        {
+            "data_movimento": r[2],
+            "tipo": "saida",
+            "valor": float(r[1] or 0),
+            "descricao": r[3],
+            "categoria": r[4],
+            "subcategoria": r[5],
+            "conta_bancaria_id": bancos.get(int(r[0])),
+        }
+        for r in rows
+    ]
+    await preencher_categorias(db, movimentos)
+    await inserir_em_lote(db, MovimentoBancario, movimentos)
+    pagas = {int(r[0]) for r in rows}
+    return {
+        "liquidadas": sorted(pagas),
+        "ignoradas": [i for i in ids if i not in pagas],
+        "total": round(sum(float(r[1] or 0) for r in rows), 2),
+    }
+
+
+# Projecao em cache por processo: (params) -> (versao financeira, expira_em, resultado).
+# A versao invalida na proxima escrita; o TTL limita a janela em que uma leitura concorrente
+# com uma transacao ainda nao commitada possa ter guardado dado velho com a versao nova.
+_projecao_cache: dict[tuple, tuple[int, float, dict]] = {}
+PROJECAO_CACHE_TTL = 300
+# meses (1-24) x agrupamento (2) por dia; acima disso descarta as entradas mais antigas.
+PROJECAO_CACHE_MAX = 64
+
+
+async def projecao_fluxo_caixa(db: AsyncSession, meses: int = 3, agrupamento: str = "mensal") -> dict:
+    """
+    Fluxo de caixa projetado por periodo (semana/mes) para os proximos N meses:
+    contas a receber e a pagar em aberto + parcelas de renovacao dos contratos ativos
+    (uma por mes a partir de data_fim, expandidas com generate_series).
+    Tudo em um SELECT agrupado; o acumulado sai de SUM() OVER.
+    """
+    hoje = date.today()
+    chave = (hoje, meses, agrupamento)
+    versao = await obter_versao(db, "financeiro")
+    cache = _projecao_cache.get(chave)
+    if cache and cache[0] == versao and cache[1] > time.monotonic():
+        return cache[2]
+
+    unidade, passo = ("week", "1 week") if agrupamento == "semanal" else ("month", "1 month")
+    rows = (
+        await db.execute(
+            text(
+                """
+                WITH params AS (
+                  SELECT date_trunc(CAST(:unidade AS TEXT), CAST(:hoje AS DATE))::date AS inicio,
+                         (CAST(:hoje AS DATE) + make_interval(months => CAST(:meses AS INTEGER)))::date AS fim
+                ),
+                periodos AS (
+                  SELECT gs::date AS periodo
+                  FROM params p, generate_series(p.inicio::timestamp, (p.fim - 1)::timestamp, CAST(:passo AS INTERVAL)) gs
+                ),
+                receber AS (
+                  SELECT date_trunc(CAST(:unidade AS TEXT), cr.vencimento)::date AS periodo, SUM(cr.valor) AS total
+                  FROM contas_receber cr, params p
+                  WHERE LOWER(COALESCE(cr.status, 'aberto')) = 'aberto'
+                    AND cr.vencimento >= CAST(:hoje AS DATE) AND cr.vencimento < p.fim
+                  GROUP BY 1
+                ),
+                pagar AS (
+                  SELECT date_trunc(CAST(:unidade AS TEXT), cp.vencimento)::date AS periodo, SUM(cp.valor) AS total
+                  FROM contas_pagar cp, params p
+                  WHERE LOWER(COALESCE(cp.status, 'aberto')) = 'aberto'
+                    AND cp.vencimento >= CAST(:hoje AS DATE) AND cp.vencimento < p.fim
+                  GROUP BY 1
+                ),
+                contratos AS (
+                  SELECT date_trunc(CAST(:unidade AS TEXT), gs)::date AS periodo, SUM(c.valor) AS total
+                  FROM aluno_contratos c
+                  CROSS JOIN params p
+                  CROSS JOIN LATERAL generate_series(c.data_fim::timestamp, (p.fim - 1)::timestamp, INTERVAL '1 month') gs
+                  WHERE LOWER(COALESCE(c.status, 'ativo')) = 'ativo'
+                    AND c.data_fim < p.fim
+                    AND gs >= CAST(:hoje AS DATE)
+                  GROUP BY 1
+                )
+                SELECT pr.periodo,
+                       COALESCE(r.total, 0) AS receber,
+                       COALESCE(ct.total, 0) AS contratos,
+                       COALESCE(pg.total, 0) AS pagar,
+                       SUM(COALESCE(r.total, 0) + COALESCE(ct.total, 0) - COALESCE(pg.total, 0))
+                         OVER (ORDER BY pr.periodo) AS acumulado
+                FROM periodos pr
+                LEFT JOIN receber r ON r.periodo = pr.periodo
+                LEFT JOIN pagar pg ON pg.periodo = pr.periodo
+                LEFT JOIN contratos ct ON ct.periodo = pr.periodo
+                ORDER BY pr.periodo
+                """
+            ),
+            {"unidade": unidade, "passo": passo, "hoje": hoje, "meses": meses},
+        )
+    ).all()
+    atraso = (
+        await db.execute(
+            text(
+                """
+                SELECT
+                  (SELECT COALESCE(SUM(valor), 0) FROM contas_receber
+                   WHERE LOWER(COALESCE(status, 'aberto')) = 'aberto' AND vencimento < :hoje),
+                  (SELECT COALESCE(SUM(valor), 0) FROM contas_pagar
+                   WHERE LOWER(COALESCE(status, 'aberto')) = 'aberto' AND vencimento < :hoje)
+                """
+            ),
+            {"hoje": hoje},
+        )
+    ).first()
+
+    resultado = {
+        "agrupamento": agrupamento,
+        "meses": meses,
+        "em_atraso": {"receber": float(atraso[0] or 0), "pagar": float(atraso[1] or 0)},
+        "periodos": [
+            {
+                "periodo": r[0].strftime("%Y-%m-%d"),
+                "receber": float(r[1] or 0),
+                "contratos_a_faturar": float(r[2] or 0),
+                "pagar": float(r[3] or 0),
+                "saldo": round(float(r[1] or 0) + float(r[2] or 0) - float(r[3] or 0), 2),
+                "acumulado": float(r[4] or 0),
+            }
+            for r in rows
+        ],
+    }
+    agora = time.monotonic()
+    for k in [k for k, v in _projecao_cache.items() if v[1] <= agora]:
+        del _projecao_cache[k]
+    _projecao_cache.pop(chave, None)
+    while len(_projecao_cache) >= PROJECAO_CACHE_MAX:
+        del _projecao_cache[next(iter(_projecao_cache))]
+    _projecao_cache[chave] = (versao, agora + PROJECAO_CACHE_TTL, resultado)
+    return resultado
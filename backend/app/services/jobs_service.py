@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Intervalo de polling quando a fila esta vazia.
+POLL_SEGUNDOS = 1.0
+# O worker renova heartbeat_em do job a cada HEARTBEAT_SEGUNDOS enquanto o handler roda; job
+# "executando" sem heartbeat ha JOB_TIMEOUT volta para a fila (processo morreu no meio). Job
+# longo e vivo nunca e reenfileirado, entao handlers nao idempotentes nao rodam em dobro.
+HEARTBEAT_SEGUNDOS = 30
+JOB_TIMEOUT = timedelta(minutes=5)
+RECUPERACAO_SEGUNDOS = 60
+# Atraso da n-esima nova tentativa: BACKOFF_BASE * 2^(n-1) segundos.
+BACKOFF_BASE = 10
+
+Handler = Callable[[AsyncSession, dict], Awaitable[object]]
+HANDLERS: dict[str, Handler] = {}
+_workers: list[asyncio.Task] = []
+
+
+def registrar_job(tipo: str):
+    """Registra o handler de um tipo de job. Os modulos de endpoint registram os seus na importacao."""
+
+    def decorator(fn: Handler) -> Handler:
+        HANDLERS[tipo] = fn
+        return fn
+
+    return decorator
+
+
+async def ensure_jobs_table(db: AsyncSession):
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+              id BIGSERIAL PRIMARY KEY,
+              tipo VARCHAR(80) NOT NULL,
+              payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+              status VARCHAR(20) NOT NULL DEFAULT 'pendente',
+              prioridade INTEGER NOT NULL DEFAULT 100,
+              tentativas INTEGER NOT NULL DEFAULT 0,
+              max_tentativas INTEGER NOT NULL DEFAULT 3,
+              executar_em TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              resultado JSONB,
+              erro TEXT,
+              travado_em TIMESTAMPTZ,
+              heartbeat_em TIMESTAMPTZ,
+              criado_em TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+              finalizado_em TIMESTAMPTZ
+            )
+            """
+        )
+    )
+    await db.execute(
+        text(
+            """
+            DO $$
+            BEGIN
+              IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'jobs' AND column_name = 'heartbeat_em'
+              ) THEN
+                ALTER TABLE jobs ADD COLUMN heartbeat_em TIMESTAMPTZ;
+              END IF;
+            END $$;
+            """
+        )
+    )
+    # Fila: so os pendentes, na ordem de consumo (menor prioridade primeiro).
+    await db.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS ix_jobs_fila
+            ON jobs (prioridade, executar_em, id) WHERE status = 'pendente'
+            """
+        )
+    )
+    await db.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_jobs_executando ON jobs (travado_em) WHERE status = 'executando'")
+    )
+    await db.commit()
+
+
+async def enfileirar_job(
+    db: AsyncSession, tipo: str, payload: dict | None = None, prioridade: int = 100, max_tentativas: int = 3
+) -> int:
+    if tipo not in HANDLERS:
+        raise HTTPException(status_code=400, detail="Tipo de job desconhecido")
+    await ensure_jobs_table(db)
+    row = (
+        await db.execute(
+            text(
+                """
+                INSERT INTO jobs (tipo, payload, prioridade, max_tentativas)
+                VALUES (:tipo, CAST(:payload AS JSONB), :prioridade, :max_tentativas)
+                RETURNING id
+                """
+            ),
+            {
+                "tipo": tipo,
+                "payload": json.dumps(payload or {}, default=str),
+                "prioridade": prioridade,
+                "max_tentativas": max_tentativas,
+            },
+        )
+    ).first()
+    await db.commit()
+    return int(row[0])
+
+
+def resposta_job(job_id: int) -> JSONResponse:
+    """202 Accepted com o id do job; o cliente acompanha em GET /jobs/{id}."""
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "pendente", "url": f"/api/v1/jobs/{job_id}"})
+
+
+def job_to_dict(r) -> dict:
+    return {
+        "id": r[0],
+        "tipo": r[1],
+        "status": r[2],
+        "prioridade": r[3],
+        "tentativas": r[4],
+        "max_tentativas": r[5],
+        "resultado": r[6],
+        "erro": r[7],
+        "criado_em": r[8].isoformat() if r[8] else None,
+        "finalizado_em": r[9].isoformat() if r[9] else None,
+    }
+
+
+JOB_COLUNAS = "id, tipo, status, prioridade, tentativas, max_tentativas, resultado, erro, criado_em, finalizado_em"
+
+
+async def _reservar_proximo(db: AsyncSession):
+    row = (
+        await db.execute(
+            text(
+                """
+                UPDATE jobs j
+                SET status = 'executando', tentativas = j.tentativas + 1, travado_em = NOW(), heartbeat_em = NOW()
+                FROM (
+                  SELECT id
+                  FROM jobs
+                  WHERE status = 'pendente' AND executar_em <= NOW()
+                  ORDER BY prioridade, executar_em, id
+                  FOR UPDATE SKIP LOCKED
+                  LIMIT 1
+                ) prox
+                WHERE j.id = prox.id
+                RETURNING j.id, j.tipo, j.payload, j.tentativas, j.max_tentativas
+                """
+            )
+        )
+    ).first()
+    await db.commit()
+    return row
+
+
+async def _recuperar_travados(db: AsyncSession):
+    await db.execute(
+        text(
+            """
+            UPDATE jobs
+            SET status = CASE WHEN tentativas >= max_tentativas THEN 'erro' ELSE 'pendente' END,
+                erro = 'Worker parou de responder (sem heartbeat)',
+                finalizado_em = CASE WHEN tentativas >= max_tentativas THEN NOW() END
+            WHERE status = 'executando' AND COALESCE(heartbeat_em, travado_em) < NOW() - CAST(:timeout AS INTERVAL)
+            """
+        ),
+        {"timeout": JOB_TIMEOUT},
+    )
+    await db.commit()
+
+
+async def _manter_heartbeat(job_id: int):
+    """Roda ao lado do handler, com sessao propria, ate ser cancelado quando ele termina."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_SEGUNDOS)
+        try:
+            async with SessionLocal() as db:
+                await db.execute(
+                    text("UPDATE jobs SET heartbeat_em = NOW() WHERE id = :id AND status = 'executando'"),
+                    {"id": job_id},
+                )
+                await db.commit()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Job %s: falha ao renovar heartbeat", job_id)
+
+
+async def _finalizar(db: AsyncSession, job_id: int, resultado) -> None:
+    await db.execute(
+        text(
+            """
+            UPDATE jobs
+            SET status = 'concluido', resultado = CAST(:resultado AS JSONB), erro = NULL, finalizado_em = NOW()
+            WHERE id = :id
+            """
+        ),
+        {"id": job_id, "resultado": json.dumps(resultado, default=str)},
+    )
+    await db.commit()
+
+
+async def _falhar(db: AsyncSession, job_id: int, erro: str, tentativas: int, max_tentativas: int, definitivo: bool):
+    if definitivo or tentativas >= max_tentativas:
+        sql = "UPDATE jobs SET status = 'erro', erro = :erro, finalizado_em = NOW() WHERE id = :id"
+        params = {"id": job_id, "erro": erro[:4000]}
+    else:
+        sql = """
+            UPDATE jobs
+            SET status = 'pendente', erro = :erro, executar_em = NOW() + make_interval(secs => :atraso)
+            WHERE id = :id
+        """
+        params = {"id": job_id, "erro": erro[:4000], "atraso": float(BACKOFF_BASE * 2 ** (tentativas - 1))}
+    await db.execute(text(sql), params)
+    await db.commit()
+
+
+async def executar_proximo_job() -> bool:
+    """Reserva e executa um job. Devolve False quando a fila esta vazia."""
+    async with SessionLocal() as db:
+        job = await _reservar_proximo(db)
+        if not job:
+            return False
+        job_id, tipo, payload, tentativas, max_tentativas = job
+        handler = HANDLERS.get(tipo)
+        if handler is None:
+            await _falhar(db, job_id, f"Sem handler para o tipo {tipo}", tentativas, max_tentativas, definitivo=True)
+            return True
+
+    inicio = time.perf_counter()
+    heartbeat = asyncio.create_task(_manter_heartbeat(job_id))
+    # Sessao propria para o handler: um rollback dele nao desfaz o controle do job.
+    async with SessionLocal() as db:
+        try:
+            try:
+                resultado = await handler(db, payload or {})
+            finally:
+                heartbeat.cancel()
+                await asyncio.gather(heartbeat, return_exceptions=True)
+        except HTTPException as exc:
+            # Erro de validacao nao melhora com nova tentativa.
+            await db.rollback()
+            erro, definitivo = str(exc.detail), True
+        except Exception as exc:
+            await db.rollback()
+            logger.exception("Job %s (%s) falhou", job_id, tipo)
+            erro, definitivo = f"{type(exc).__name__}: {exc}", False
+        else:
+            await _finalizar(db, job_id, resultado)
+            logger.info("Job %s (%s) concluido em %.2fs", job_id, tipo, time.perf_counter() - inicio)
+            return True
+        await _falhar(db, job_id, erro, tentativas, max_tentativas, definitivo)
+    return True
+
+
+async def _worker(nome: str):
+    ultima_recuperacao = 0.0
+    while True:
+        try:
+            if time.monotonic() - ultima_recuperacao > RECUPERACAO_SEGUNDOS:
+                async with SessionLocal() as db:
+                    await _recuperar_travados(db)
+                ultima_recuperacao = time.monotonic()
+            if not await executar_proximo_job():
+                await asyncio.sleep(POLL_SEGUNDOS)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Banco fora do ar etc.: o worker nao morre, tenta de novo depois.
+            logger.exception("Worker %s: erro no loop da fila", nome)
+            await asyncio.sleep(POLL_SEGUNDOS * 5)
+
+
+async def iniciar_workers(quantidade: int):
+    if quantidade <= 0 or _workers:
+        return
+    async with SessionLocal() as db:
+        await ensure_jobs_table(db)
+    for i in range(quantidade):
+        _workers.append(asyncio.create_task(_worker(f"jobs-{i}")))
+
+
+async def parar_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,73 @@
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.categorizacao_service import ensure_regras_categorizacao_table
+from app.services.finance_service import MOVIMENTO_VALOR_SINAL, ensure_movimentos_columns, gerar_checkpoints_extrato
+
+# Saldo de cada conta numa data: saldo de abertura + acumulado do checkpoint mais recente <= data
+# (saldos_checkpoint, o mesmo do extrato paginado) + delta dos movimentos da conta apos ele.
+SALDO_EM_SQL = f"""
+    SELECT b.id,
+           b.saldo_abertura + COALESCE(cp.acumulado, 0) + COALESCE((
+             SELECT SUM({MOVIMENTO_VALOR_SINAL})
+             FROM movimentos_bancarios m
+             WHERE m.conta_bancaria_id = b.id
+               AND m.data_movimento <= :data
+               AND (cp.data IS NULL OR m.data_movimento > cp.data)
+           ), 0) AS saldo,
+           cp.data AS checkpoint_data
+    FROM contas_bancarias b
+    LEFT JOIN LATERAL (
+      SELECT c.data, c.acumulado
+      FROM saldos_checkpoint c
+      WHERE c.conta_bancaria_id = b.id AND c.data <= :data
+      ORDER BY c.data DESC
+      LIMIT 1
+    ) cp ON TRUE
+"""
+
+
+async def ensure_ledger_schema(db: AsyncSession):
+    """
+    Livro-razao bancario: todo movimento referencia sua conta (movimentos_bancarios.conta_bancaria_id)
+    e o saldo e derivado, nunca atualizado in-place. Tabela de contas (saldo_abertura) e checkpoints
+    ficam em finance_service.ensure_movimentos_columns, compartilhados com o extrato paginado.
+    """
+    await ensure_movimentos_columns(db)
+    # Movimentos novos sao categorizados na insercao (categorizacao_service).
+    await ensure_regras_categorizacao_table(db)
+    await db.execute(
+        text(
+            """
+            CREATE INDEX IF NOT EXISTS ix_movimentos_conta_data
+            ON movimentos_bancarios (conta_bancaria_id, data_movimento) INCLUDE (tipo, valor)
+            WHERE conta_bancaria_id IS NOT NULL
+            """
+        )
+    )
+    await db.commit()
+
+
+async def saldos_em(db: AsyncSession, data_ref: date, conta_bancaria_id: int | None = None) -> dict[int, dict]:
+    """Saldo por conta ao final de data_ref (checkpoint mais proximo + delta)."""
+    sql = SALDO_EM_SQL
+    params: dict[str, object] = {"data": data_ref}
+    if conta_bancaria_id is not None:
+        sql += " WHERE b.id = :conta_bancaria_id"
+        params["conta_bancaria_id"] = int(conta_bancaria_id)
+    rows = (await db.execute(text(sql), params)).all()
+    return {
+        int(r[0]): {"saldo": float(r[1] or 0), "checkpoint": r[2].strftime("%Y-%m-%d") if r[2] else None}
+        for r in rows
+    }
+
+
+async def gerar_checkpoints(db: AsyncSession, data_ref: date | None = None) -> int:
+    """
+    Grava (ou regrava) os checkpoints de todas as contas ate data_ref, por padrao ontem: o dia
+    corrente ainda recebe movimentos e invalidaria o checkpoint logo em seguida. Sao os mesmos
+    checkpoints que semeiam o saldo do extrato paginado.
+    """
+    return await gerar_checkpoints_extrato(db, data_ref)
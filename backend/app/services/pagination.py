@@ -0,0 +1,29 @@
+import base64
+import json
+from datetime import date
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*values) -> str:
+    """Serializa a chave de ordenacao da ultima linha (ex.: vencimento, id) num token opaco."""
+    raw = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """Inverte encode_cursor convertendo cada posicao para o tipo informado (date/int/str)."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("cursor")
+        out = []
+        for v, t in zip(values, types):
+            if t is date:
+                out.append(date.fromisoformat(v))
+            else:
+                out.append(t(v))
+        return tuple(out)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor invalido")
@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.v1.endpoints.alunos import ensure_contract_links, ensure_contracts_table, ensure_finance_columns
+from app.api.v1.endpoints.categorias import ensure_categorias_tables
+from app.api.v1.endpoints.planos import ensure_planos_table
+from app.services.ddl_service import FuncaoSql, TriggerSql, garantir_ddl
+
+# Nome no payload -> tabela. A replica do cliente e indexada por (nome, id).
+TABELAS_SYNC = {
+    "alunos": "alunos",
+    "aulas": "aulas",
+    "contratos": "aluno_contratos",
+    "contas_receber": "contas_receber",
+    "planos": "planos",
+    "categorias": "categorias",
+}
+# Tabelas fora do sync cujo updated_at tambem precisa ser confiavel (nome do aluno vem de usuarios).
+TABELAS_TOCADAS = (*TABELAS_SYNC.values(), "usuarios")
+# Exclusoes guardadas por este periodo; cursor mais antigo recebe um snapshot completo.
+RETENCAO_EXCLUSOES = timedelta(days=30)
+
+TOCAR_UPDATED_AT_FUNCAO = FuncaoSql(
+    "sync_tocar_updated_at",
+    "1",
+    """
+    CREATE OR REPLACE FUNCTION sync_tocar_updated_at() RETURNS trigger AS $fn$
+    BEGIN
+      NEW.updated_at := NOW();
+      RETURN NEW;
+    END
+    $fn$ LANGUAGE plpgsql
+    """,
+)
+REGISTRAR_EXCLUSAO_FUNCAO = FuncaoSql(
+    "sync_registrar_exclusao",
+    "1",
+    """
+    CREATE OR REPLACE FUNCTION sync_registrar_exclusao() RETURNS trigger AS $fn$
+    BEGIN
+      INSERT INTO sync_exclusoes (tabela, registro_id) SELECT TG_TABLE_NAME, id FROM antigas;
+      RETURN NULL;
+    END
+    $fn$ LANGUAGE plpgsql
+    """,
+)
+
+
+async def ensure_sync(db: AsyncSession):
+    """
+    updated_at mantido por trigger (as escritas em SQL cru nao passam pelo onupdate do ORM),
+    indice por updated_at em cada tabela e lapides (sync_exclusoes) para os DELETEs.
+    """
+    await ensure_contracts_table(db)
+    await ensure_contract_links(db)
+    await ensure_finance_columns(db)
+    await ensure_planos_table(db)
+    await ensure_categorias_tables(db)
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS sync_exclusoes (
+              id BIGSERIAL PRIMARY KEY,
+              tabela VARCHAR(40) NOT NULL,
+              registro_id INTEGER NOT NULL,
+              excluido_em TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+    )
+    await db.execute(text("CREATE INDEX IF NOT EXISTS ix_sync_exclusoes_em ON sync_exclusoes (excluido_em, tabela)"))
+    for tabela in TABELAS_TOCADAS:
+        await db.execute(
+            text(
+                f"""
+                DO $$
+                BEGIN
+                  IF NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = '{tabela}' AND column_name = 'updated_at'
+                  ) THEN
+                    ALTER TABLE {tabela} ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+                  END IF;
+                END $$;
+                """
+            )
+        )
+        await db.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{tabela}_updated_at ON {tabela} (updated_at)"))
+    await garantir_ddl(
+        db,
+        TOCAR_UPDATED_AT_FUNCAO,
+        REGISTRAR_EXCLUSAO_FUNCAO,
+        *(
+            TriggerSql(
+                f"tg_sync_updated_at_{tabela}",
+                tabela,
+                "1",
+                f"""
+                CREATE TRIGGER tg_sync_updated_at_{tabela}
+                BEFORE INSERT OR UPDATE ON {tabela}
+                FOR EACH ROW EXECUTE FUNCTION sync_tocar_updated_at()
+                """,
+            )
+            for tabela in TABELAS_TOCADAS
+        ),
+        *(
+            TriggerSql(
+                f"tg_sync_exclusao_{tabela}",
+                tabela,
+                "1",
+                f"""
+                CREATE TRIGGER tg_sync_exclusao_{tabela}
+                AFTER DELETE ON {tabela}
+                REFERENCING OLD TABLE AS antigas
+                FOR EACH STATEMENT EXECUTE FUNCTION sync_registrar_exclusao()
+                """,
+            )
+            for tabela in TABELAS_SYNC.values()
+        ),
+    )
+    await db.commit()
+
+
+def _alterados_sql(nome: str, incremental: bool) -> str:
+    if nome == "alunos":
+        # Nome/email moram em usuarios: mudanca la tambem conta como mudanca do aluno.
+        return f"""
+            SELECT COALESCE(json_agg(to_jsonb(t) || jsonb_build_object('nome', u.nome, 'email', u.email) ORDER BY t.id), '[]'::json)
+            FROM alunos t
+            LEFT JOIN usuarios u ON u.id = t.usuario_id
+            {"WHERE t.updated_at >= :since OR u.updated_at >= :since" if incremental else ""}
+        """
+    return f"""
+        SELECT COALESCE(json_agg(to_jsonb(t) ORDER BY t.id), '[]'::json)
+        FROM {TABELAS_SYNC[nome]} t
+        {"WHERE t.updated_at >= :since" if incremental else ""}
+    """
+
+
+def sync_sql(incremental: bool) -> str:
+    """
+    Um statement com o delta de todas as tabelas, ja em JSON. O cursor devolvido e o inicio da
+    transacao aberta mais antiga: uma escrita ainda nao commitada tem updated_at anterior ao
+    "agora", entao o proximo sync reenvia a partir dali (cliente aplica por id, repetir e inofensivo).
+    """
+    partes = []
+    for nome, tabela in TABELAS_SYNC.items():
+        excluidos = (
+            f"""(SELECT COALESCE(json_agg(DISTINCT e.registro_id), '[]'::json)
+                 FROM sync_exclusoes e WHERE e.tabela = '{tabela}' AND e.excluido_em >= :since)"""
+            if incremental
+            else "'[]'::json"
+        )
+        partes.append(
+            f"""'{nome}', json_build_object(
+                  'alterados', ({_alterados_sql(nome, incremental)}),
+                  'excluidos', {excluidos}
+                )"""
+        )
+    return f"""
+        SELECT json_build_object(
+          'cursor', to_char(
+            (SELECT COALESCE(MIN(xact_start), NOW()) FROM pg_stat_activity
+             WHERE datname = current_database() AND backend_type = 'client backend' AND xact_start IS NOT NULL)
+            AT TIME ZONE 'UTC',
+            'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'),
+          'completo', {"FALSE" if incremental else "TRUE"},
+          'tabelas', json_build_object({", ".join(partes)})
+        )::text
+    """
+
+
+async def montar_sync(db: AsyncSession, since: datetime | None) -> str:
+    """Delta desde o cursor; sem cursor (ou mais velho que as lapides) devolve tudo, completo=true."""
+    incremental = since is not None
+    if incremental:
+        limite = (await db.execute(text("SELECT NOW() - CAST(:retencao AS INTERVAL)"), {"retencao": RETENCAO_EXCLUSOES})).scalar_one()
+        incremental = since >= limite
+    params = {"since": since} if incremental else {}
+    corpo = (await db.execute(text(sync_sql(incremental)), params)).scalar_one()
+    await db.commit()
+    return corpo
+
+
+async def limpar_exclusoes(db: AsyncSession) -> dict:
+    if not (await db.execute(text("SELECT to_regclass('sync_exclusoes') IS NOT NULL"))).scalar():
+        return {"lapides_removidas": 0}
+    res = await db.execute(
+        text("DELETE FROM sync_exclusoes WHERE excluido_em < NOW() - CAST(:retencao AS INTERVAL)"),
+        {"retencao": RETENCAO_EXCLUSOES},
+    )
+    await db.commit()
+    return {"lapides_removidas": int(res.rowcount or 0)}
@@ -0,0 +1,226 @@
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.session import SessionLocal
+from app.services.ddl_service import FuncaoSql, TriggerSql, garantir_ddl
+
+# Recurso -> tabelas cujas escritas mudam a versao do recurso.
+RECURSOS = {
+    "financeiro": ("contas_receber", "contas_pagar", "aluno_contratos"),
+    "agenda": ("aulas", "agendas", "agenda_bloqueios", "profissionais", "usuarios", "alunos", "unidades"),
+    "professores": ("profissionais", "usuarios"),
+    "planos": ("planos",),
+    "categorias": ("categorias", "subcategorias"),
+    "branding": ("empresa_configs",),
+}
+
+# Quanto tempo a versao lida fica valida no processo sem reconsultar o banco. Escritas feitas
+# por este processo invalidam na hora (invalidar_versoes); de outro processo, no maximo isso.
+VERSAO_CACHE_TTL = 2.0
+
+# recurso -> (versao, valido_ate (monotonic), visto_em (Last-Modified))
+_versoes: dict[str, tuple[int, float, datetime]] = {}
+# Recursos com todos os triggers instalados neste processo.
+_garantidos: set[str] = set()
+
+
+# (recurso, tabela) -> unicas colunas cujo UPDATE muda o recurso. A agenda so mostra o nome do
+# aluno (via usuario_id); sem isso, o saldo_devedor que os triggers de contas_receber gravam em
+# alunos mudaria a versao da agenda a cada pagamento.
+COLUNAS_RECURSO = {
+    ("agenda", "alunos"): ("usuario_id",),
+}
+
+# A versao e a soma de VERSAO_FATIAS linhas por recurso; cada conexao incrementa a sua
+# (pid % fatias), entao commits concorrentes raramente disputam a mesma linha.
+VERSAO_FATIAS = 8
+
+REGISTRAR_FUNCAO = FuncaoSql(
+    "versao_recurso_registrar",
+    "1",
+    """
+    CREATE OR REPLACE FUNCTION versao_recurso_registrar() RETURNS trigger AS $fn$
+    DECLARE
+      chave TEXT := 'versao.' || TG_ARGV[0];
+    BEGIN
+      -- Trigger de statement; o GUC local deixa so o primeiro da transacao enfileirar o incremento.
+      IF current_setting(chave, true) IS DISTINCT FROM txid_current()::text THEN
+        PERFORM set_config(chave, txid_current()::text, true);
+        INSERT INTO recursos_versoes_pendentes (recurso, txid) VALUES (TG_ARGV[0], txid_current());
+      END IF;
+      RETURN NULL;
+    END
+    $fn$ LANGUAGE plpgsql
+    """,
+)
+APLICAR_FUNCAO = FuncaoSql(
+    "versao_recurso_aplicar",
+    "1",
+    """
+    CREATE OR REPLACE FUNCTION versao_recurso_aplicar() RETURNS trigger AS $fn$
+    BEGIN
+      UPDATE recursos_versoes_fatias SET versao = versao + 1
+      WHERE recurso = NEW.recurso AND fatia = pg_backend_pid() % TG_ARGV[0]::int;
+      DELETE FROM recursos_versoes_pendentes WHERE recurso = NEW.recurso AND txid = NEW.txid;
+      RETURN NULL;
+    END
+    $fn$ LANGUAGE plpgsql
+    """,
+)
+# Um evento adiado por transacao e recurso (a linha pendente), aplicado no commit.
+APLICAR_TRIGGER = TriggerSql(
+    "tg_recursos_versoes_aplicar",
+    "recursos_versoes_pendentes",
+    "1",
+    f"""
+    CREATE CONSTRAINT TRIGGER tg_recursos_versoes_aplicar
+    AFTER INSERT ON recursos_versoes_pendentes
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION versao_recurso_aplicar('{VERSAO_FATIAS}')
+    """,
+)
+
+
+def _trigger(recurso: str, tabela: str) -> TriggerSql:
+    nome = f"tg_versao_{recurso}_{tabela}"
+    colunas = COLUNAS_RECURSO.get((recurso, tabela))
+    eventos = f"INSERT OR DELETE OR UPDATE OF {', '.join(colunas)}" if colunas else "INSERT OR UPDATE OR DELETE OR TRUNCATE"
+    return TriggerSql(
+        nome,
+        tabela,
+        "3",
+        f"""
+        CREATE TRIGGER {nome}
+        AFTER {eventos} ON {tabela}
+        FOR EACH STATEMENT EXECUTE FUNCTION versao_recurso_registrar('{recurso}')
+        """,
+    )
+
+
+async def ensure_versao_recurso(db: AsyncSession, recurso: str) -> bool:
+    """
+    Versao de um recurso = soma das fatias em recursos_versoes_fatias. O primeiro statement
+    de cada transacao que escreve nas tabelas do recurso grava uma linha pendente; o trigger
+    adiado dela incrementa uma fatia no commit, e o incremento so fica visivel junto com a
+    escrita: quem le a versao nova ja enxerga os dados novos.
+    """
+    await db.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS recursos_versoes_fatias (
+              recurso VARCHAR(40) NOT NULL,
+              fatia SMALLINT NOT NULL,
+              versao BIGINT NOT NULL,
+              PRIMARY KEY (recurso, fatia)
+            )
+            """
+        )
+    )
+    # Sem WAL: so guarda o que ainda vai ser aplicado no commit da propria transacao.
+    await db.execute(
+        text(
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS recursos_versoes_pendentes (
+              recurso VARCHAR(40) NOT NULL,
+              txid BIGINT NOT NULL
+            )
+            """
+        )
+    )
+    # Comeca no epoch em ms para nao repetir ETags ja emitidas por versoes anteriores do contador.
+    await db.execute(
+        text(
+            """
+            INSERT INTO recursos_versoes_fatias (recurso, fatia, versao)
+            SELECT :recurso, f, CASE WHEN f = 0 THEN CAST(EXTRACT(EPOCH FROM clock_timestamp()) * 1000 AS BIGINT) ELSE 0 END
+            FROM generate_series(0, :fatias - 1) AS f
+            ON CONFLICT (recurso, fatia) DO NOTHING
+            """
+        ),
+        {"recurso": recurso, "fatias": VERSAO_FATIAS},
+    )
+    existentes = (
+        await db.execute(
+            text("SELECT t FROM unnest(CAST(:tabelas AS TEXT[])) AS t WHERE to_regclass(t) IS NOT NULL"),
+            {"tabelas": list(RECURSOS[recurso])},
+        )
+    ).scalars().all()
+    aplicados = await garantir_ddl(
+        db, REGISTRAR_FUNCAO, APLICAR_FUNCAO, APLICAR_TRIGGER, *(_trigger(recurso, tabela) for tabela in existentes)
+    )
+    if any(nome.startswith("tg_versao_") for nome in aplicados):
+        # Escritas anteriores ao trigger nao foram contadas.
+        await db.execute(
+            text("UPDATE recursos_versoes_fatias SET versao = versao + 1 WHERE recurso = :recurso AND fatia = 0"),
+            {"recurso": recurso},
+        )
+    await db.commit()
+    # False enquanto alguma tabela ainda nao existe (criada sob demanda pelo ensure_* dela).
+    return len(existentes) == len(RECURSOS[recurso])
+
+
+async def obter_versao(db: AsyncSession, recurso: str) -> int:
+    versao = (
+        await db.execute(
+            text("SELECT SUM(versao) FROM recursos_versoes_fatias WHERE recurso = :recurso"), {"recurso": recurso}
+        )
+    ).scalar()
+    return int(versao or 0)
+
+
+async def versao_atual(recurso: str) -> tuple[int, datetime]:
+    """Versao do recurso e quando este processo a viu mudar; so vai ao banco com o cache vencido."""
+    cache = _versoes.get(recurso)
+    if cache and cache[1] > time.monotonic():
+        return cache[0], cache[2]
+    async with SessionLocal() as db:
+        if recurso not in _garantidos and await ensure_versao_recurso(db, recurso):
+            _garantidos.add(recurso)
+        versao = await obter_versao(db, recurso)
+    visto_em = cache[2] if cache and cache[0] == versao else datetime.now(timezone.utc).replace(microsecond=0)
+    _versoes[recurso] = (versao, time.monotonic() + VERSAO_CACHE_TTL, visto_em)
+    return versao, visto_em
+
+
+def invalidar_versoes(*recursos: str):
+    """
+    Chamado apos requests de escrita (todos os recursos) e a cada NOTIFY da agenda: a proxima
+    leitura reconsulta as versoes no banco.
+    """
+    for recurso, (versao, _, visto_em) in list(_versoes.items()):
+        if not recursos or recurso in recursos:
+            _versoes[recurso] = (versao, 0.0, visto_em)
+
+
+async def checar_condicional(request: Request, recurso: str, variante: str = "") -> tuple[dict, Response | None]:
+    """
+    Cabecalhos de cache (ETag fraco + Last-Modified) do recurso e, se o cliente ja tem a versao
+    atual (If-None-Match, ou If-Modified-Since sem ETag), a resposta 304 pronta - sem consultar
+    o banco enquanto a versao estiver em cache. variante separa representacoes que mudam sem
+    escrita no banco (ex.: agenda de "hoje" quando o dia vira).
+    """
+    versao, visto_em = await versao_atual(recurso)
+    etag = f'W/"{recurso}-{versao}{"-" + variante if variante else ""}"'
+    headers = {"ETag": etag, "Last-Modified": format_datetime(visto_em, usegmt=True), "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        if "*" in tags or etag.removeprefix("W/") in tags:
+            return headers, Response(status_code=304, headers=headers)
+        return headers, None
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            if visto_em <= parsedate_to_datetime(if_modified_since):
+                return headers, Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    return headers, None
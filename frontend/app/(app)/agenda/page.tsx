@@ -163,6 +163,18 @@ export default function AgendaPage() {
     setDidAutoDefaultProfessor(true);
   }, [me, professores, professorId, didAutoDefaultProfessor]);
 
+  useEffect(() => {
+    // Live updates: the API pushes agenda deltas (SSE); any change just refetches the current view.
+    if (typeof window === "undefined" || !("EventSource" in window)) return;
+    const qs = new URLSearchParams();
+    if (professorId !== "todos") qs.set("profissional_id", professorId);
+    const source = new EventSource(`${API_URL}/agenda/eventos?${qs.toString()}`);
+    const refetch = () => qc.invalidateQueries({ queryKey: ["agenda-v2"] });
+    const tipos = ["aula_criada", "aula_remarcada", "aula_status", "aula_removida", "bloqueio_criado", "bloqueio_removido", "resync"];
+    tipos.forEach((t) => source.addEventListener(t, refetch));
+    return () => source.close();
+  }, [professorId, qc]);
+
   const { data, isLoading } = useQuery<{ aulas: AulaApi[]; bloqueios: BloqueioApi[] }>({
     queryKey: ["agenda-v2", modo, dataRef, professorId],
     queryFn: async () => {
@@ -389,7 +401,7 @@ export default function AgendaPage() {
       <div className="space-y-3">
         {isLoading && Array.from({ length: 3 }).map((_, i) => <Card key={i} className="h-20 animate-pulse" />)}
         {!isLoading && (data?.bloqueios || []).map((b) => (
-          <Card key={`b-${b.id}`} className="flex items-center justify-between border border-danger/20 bg-danger/5 p-4">
+          <Card key={`b-${b.id}-${b.data}`} className="flex items-center justify-between border border-danger/20 bg-danger/5 p-4">
             <div>
               <p className="text-sm font-semibold text-danger">Bloqueio {b.data} - {b.hora_inicio} - {b.hora_fim}</p>
               <p className="text-xs text-muted">{b.professor_nome || "Todos"} - {b.motivo || "Sem motivo"}</p>
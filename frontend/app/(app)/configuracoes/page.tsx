@@ -122,6 +122,22 @@ type RegraComissaoApi = {
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || "/api/v1";
 
+// Listagens paginadas por keyset: segue next_cursor ate acabar para a tela ter o conjunto inteiro.
+async function fetchTodasPaginas<T>(path: string): Promise<T[]> {
+  const items: T[] = [];
+  let cursor: string | null = null;
+  do {
+    const qs = new URLSearchParams({ limit: "500" });
+    if (cursor) qs.set("cursor", cursor);
+    const res = await fetch(`${API_URL}${path}?${qs.toString()}`, { cache: "no-store" });
+    if (!res.ok) break;
+    const body = await res.json();
+    items.push(...((body.items || []) as T[]));
+    cursor = body.next_cursor || null;
+  } while (cursor);
+  return items;
+}
+
 const LABELS: Record<Entidade, string> = {
   usuarios: "Usuarios",
   alunos: "Alunos",
@@ -267,28 +283,21 @@ CONTRATADA: ______________________`);
   const { data: movimentacoesApi = [] } = useQuery<MovimentacaoApi[]>({
     queryKey: ["movimentacoes-financeiras-config"],
     queryFn: async () => {
-      const res = await fetch(`${API_URL}/movimentacoes-financeiras`, { cache: "no-store" });
+      const res = await fetch(`${API_URL}/movimentacoes-financeiras?limit=300`, { cache: "no-store" });
       if (!res.ok) return [];
-      return res.json();
+      const body = await res.json();
+      return body.items || [];
     },
     enabled: entidade === "movimentacoes_financeiras",
   });
   const { data: contasReceberApi = [] } = useQuery<ContaReceberApi[]>({
     queryKey: ["contas-receber-config"],
-    queryFn: async () => {
-      const res = await fetch(`${API_URL}/contas-receber`, { cache: "no-store" });
-      if (!res.ok) return [];
-      return res.json();
-    },
+    queryFn: () => fetchTodasPaginas<ContaReceberApi>("/contas-receber"),
     enabled: entidade === "contas_receber",
   });
   const { data: contasPagarApi = [] } = useQuery<ContaPagarApi[]>({
     queryKey: ["contas-pagar-config"],
-    queryFn: async () => {
-      const res = await fetch(`${API_URL}/contas-pagar`, { cache: "no-store" });
-      if (!res.ok) return [];
-      return res.json();
-    },
+    queryFn: () => fetchTodasPaginas<ContaPagarApi>("/contas-pagar"),
     enabled: entidade === "contas_pagar",
   });
   const { data: categoriasApi = [] } = useQuery<CategoriaApi[]>({
@@ -1,7 +1,7 @@
 ﻿"use client";
 
 import { useMemo, useState } from "react";
-import { useQuery, useQueryClient } from "@tanstack/react-query";
+import { useInfiniteQuery, useQuery, useQueryClient } from "@tanstack/react-query";
 import { Card } from "@/components/ui/card";
 import { FloatingActionButton } from "@/components/ui/floating-action-button";
 import { Section } from "@/components/ui/section";
@@ -42,8 +42,12 @@ function parseAlunoFromDescricao(descricao: string) {
   return { aluno: d, extra: "" };
 }
 
-async function fetchFinanceiro() {
-  const res = await fetch(`${API_URL}/financeiro`, { cache: "no-store" });
+type Totais = { entradas: number; saidas: number; resultado: number; quantidade: number };
+type PaginaFinanceiro = { items: any[]; next_cursor: string | null; totais: Totais | null };
+
+async function fetchFinanceiro(cursor: string | null): Promise<PaginaFinanceiro> {
+  const qs = cursor ? `?${new URLSearchParams({ cursor }).toString()}` : "";
+  const res = await fetch(`${API_URL}/financeiro${qs}`, { cache: "no-store" });
   if (!res.ok) throw new Error("Falha ao carregar financeiro");
   return res.json();
 }
@@ -61,16 +65,23 @@ export default function FinanceiroPage() {
   const [valor, setValor] = useState("");
   const [descricao, setDescricao] = useState("");
 
-  const { data: movimentos = [] } = useQuery({ queryKey: ["financeiro"], queryFn: fetchFinanceiro });
+  const financeiro = useInfiniteQuery({
+    queryKey: ["financeiro"],
+    queryFn: ({ pageParam }) => fetchFinanceiro(pageParam),
+    initialPageParam: null as string | null,
+    getNextPageParam: (ultima) => ultima.next_cursor,
+  });
   const { data: dre } = useQuery({ queryKey: ["dre"], queryFn: fetchDre });
 
+  const movimentos = useMemo(() => (financeiro.data?.pages || []).flatMap((p) => p.items || []), [financeiro.data]);
+
+  // Totais somados no servidor sobre todos os movimentos (vem na primeira pagina).
   const resumo = useMemo(() => {
-    const isEntrada = (t: any) => ["entrada", "receita"].includes(String(t || "").toLowerCase());
-    const isSaida = (t: any) => ["saida", "saída", "despesa"].includes(String(t || "").toLowerCase());
-    const receitas = movimentos.filter((m: any) => isEntrada(m.tipo)).reduce((a: number, b: any) => a + Number(b.valor), 0);
-    const despesas = movimentos.filter((m: any) => isSaida(m.tipo)).reduce((a: number, b: any) => a + Number(b.valor), 0);
+    const totais = financeiro.data?.pages[0]?.totais;
+    const receitas = Number(totais?.entradas || 0);
+    const despesas = Number(totais?.saidas || 0);
     return { receitas, despesas, resultado: receitas - despesas };
-  }, [movimentos]);
+  }, [financeiro.data]);
 
   async function salvar() {
     await fetch(`${API_URL}/financeiro`, {
@@ -142,6 +153,15 @@ export default function FinanceiroPage() {
               </div>
             </Card>
           ))}
+          {financeiro.hasNextPage && (
+            <Button
+              className="w-full"
+              disabled={financeiro.isFetchingNextPage}
+              onClick={() => financeiro.fetchNextPage()}
+            >
+              {financeiro.isFetchingNextPage ? "Carregando..." : "Carregar mais"}
+            </Button>
+          )}
         </div>
       </Section>
 
@@ -54,27 +54,6 @@ function todayIso() {
   return new Date().toISOString().slice(0, 10);
 }
 
-function brDateToEpoch(d: string) {
-  const s = String(d || "").trim();
-  // Accepts DD/MM/YYYY or YYYY-MM-DD; falls back to 0.
-  if (!s) return 0;
-  if (s.includes("/")) {
-    const [dd, mm, yyyy] = s.split("/");
-    const y = Number(yyyy);
-    const m = Number(mm);
-    const day = Number(dd);
-    if (!y || !m || !day) return 0;
-    return Date.UTC(y, m - 1, day);
-  }
-  const iso = s.slice(0, 10);
-  const [yyyy, mm, dd] = iso.split("-");
-  const y = Number(yyyy);
-  const m = Number(mm);
-  const day = Number(dd);
-  if (!y || !m || !day) return 0;
-  return Date.UTC(y, m - 1, day);
-}
-
 export default function HomePage() {
   const role = useAuthStore((s) => s.role) || "gestor";
   const nome = useAuthStore((s) => s.nome) || "Visitante";
@@ -108,12 +87,14 @@ export default function HomePage() {
     enabled: !!token && role === "gestor",
   });
 
-  const { data: pendencias, isLoading: pendLoading } = useQuery<ContaReceber[]>({
+  // Agregado por aluno no servidor: todas as contas em aberto, nao so uma pagina da listagem.
+  const { data: pendencias, isLoading: pendLoading } = useQuery<ContaReceberAgg[]>({
     queryKey: ["home-contas-receber-aberto"],
     queryFn: async () => {
-      const res = await fetch(`${API_URL}/contas-receber?status=aberto`, { cache: "no-store", headers: authHeaders });
+      const res = await fetch(`${API_URL}/contas-receber/por-aluno?status=aberto`, { cache: "no-store", headers: authHeaders });
       if (!res.ok) return [];
-      return res.json();
+      const body = await res.json();
+      return body.items || [];
     },
     enabled: !!token && role === "gestor",
   });
@@ -171,39 +152,7 @@ export default function HomePage() {
     .filter((a) => String(a.status || "").toLowerCase() !== "realizada")
     .slice(0, 6);
 
-  const contasAbertasPorAluno = useMemo(() => {
-    const m = new Map<string, ContaReceberAgg>();
-    for (const c of pendencias || []) {
-      const key = c.aluno_id ? `id:${c.aluno_id}` : `nome:${String(c.aluno_nome || "").toLowerCase()}`;
-      const existing = m.get(key);
-      if (!existing) {
-        m.set(key, {
-          aluno_id: c.aluno_id,
-          aluno_nome: c.aluno_nome,
-          total: Number(c.valor || 0),
-          qtd: 1,
-          proximo_vencimento: c.vencimento,
-          proxima_conta: c,
-        });
-        continue;
-      }
-      existing.total += Number(c.valor || 0);
-      existing.qtd += 1;
-
-      if (brDateToEpoch(c.vencimento) && brDateToEpoch(c.vencimento) < brDateToEpoch(existing.proximo_vencimento)) {
-        existing.proximo_vencimento = c.vencimento;
-        existing.proxima_conta = c;
-      }
-    }
-    return Array.from(m.values()).sort((a, b) => {
-      const da = brDateToEpoch(a.proximo_vencimento);
-      const db = brDateToEpoch(b.proximo_vencimento);
-      if (da !== db) return da - db;
-      return b.total - a.total;
-    });
-  }, [pendencias]);
-
-  const contasAbertas = contasAbertasPorAluno;
+  const contasAbertas = pendencias || [];
 
   return (
     <main className="space-y-5">